@@ -0,0 +1,124 @@
+"""
+Deposit Address Pool
+Gives every deal its own escrow deposit address so incoming transfers can be attributed to a deal
+"""
+import asyncio
+import logging
+import database
+from config import ADDRESS_POOL_LOW_WATERMARK, ADDRESS_POOL_REFILL_SIZE, ADDRESS_POOL_REFILL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+NETWORKS = ['BTC', 'LTC', 'USDT (TRC20)', 'USDT (BEP20)', 'TON']
+
+# Reverse index address -> deal_id (filled on assignment and on lookup)
+_deal_by_address = {}
+
+# Balance an address held before it was claimed (filled on lookup)
+_baseline_by_address = {}
+
+
+def assign(deal_id, network):
+    """
+    Atomically claim a free pool address for a deal (same address on repeat calls).
+    Returns None when the pool for this network is empty.
+    """
+    address = database.claim_deposit_address(network, deal_id)
+    if address:
+        _deal_by_address[address] = deal_id
+    else:
+        logger.warning(f"Deposit address pool for {network} is empty")
+    return address
+
+
+def deal_for_address(address):
+    """deal_id that owns a pool address (None for shared/unknown wallets)"""
+    if address not in _deal_by_address:
+        deal_id = database.get_deal_id_for_address(address)
+        if not deal_id:
+            return None
+        _deal_by_address[address] = deal_id
+    return _deal_by_address[address]
+
+
+def baseline(address):
+    """Balance a pool address held before its deal (None for shared/unmeasured addresses)"""
+    if address not in _baseline_by_address:
+        amount = database.get_deposit_baseline(address)
+        if amount is None:
+            return None
+        _baseline_by_address[address] = amount
+    return _baseline_by_address[address]
+
+
+def import_addresses(network, addresses):
+    """Add externally generated addresses to the pool; returns how many were new"""
+    addresses = [a.strip() for a in addresses if a and a.strip()]
+    return database.import_deposit_addresses(network, addresses) or 0
+
+
+# ====================
+# HD DERIVATION
+# ====================
+
+def derive_addresses(network, xpub, start, count):
+    """
+    Derive receive addresses from an account-level extended public key.
+    Needs the optional bip_utils package; TON cannot be derived and must be imported.
+    """
+    from bip_utils import Bip44, Bip44Coins, Bip84, Bip84Coins, Bip44Changes
+
+    if network == 'BTC':
+        account = Bip84.FromExtendedKey(xpub, Bip84Coins.BITCOIN)
+    elif network == 'LTC':
+        account = Bip84.FromExtendedKey(xpub, Bip84Coins.LITECOIN)
+    elif network == 'USDT (BEP20)':
+        account = Bip44.FromExtendedKey(xpub, Bip44Coins.BINANCE_SMART_CHAIN)
+    elif network == 'USDT (TRC20)':
+        account = Bip44.FromExtendedKey(xpub, Bip44Coins.TRON)
+    else:
+        raise ValueError(f"HD derivation is not supported for {network}")
+
+    chain = account.Change(Bip44Changes.CHAIN_EXT)
+    return [
+        (start + i, chain.AddressIndex(start + i).PublicKey().ToAddress())
+        for i in range(count)
+    ]
+
+
+def refill(network):
+    """Top up a network's pool from its xpub (config key xpub_<network>) when it runs low"""
+    free = database.count_free_deposit_addresses(network) or 0
+    if free >= ADDRESS_POOL_LOW_WATERMARK:
+        return 0
+
+    xpub = database.get_config(f"xpub_{network}")
+    if not xpub:
+        logger.warning(f"Deposit pool for {network} is low ({free} free) and no xpub is configured - import more addresses")
+        return 0
+
+    try:
+        last_index = database.get_max_derivation_index(network)
+        start = 0 if last_index is None else last_index + 1
+        derived = derive_addresses(network, xpub, start, ADDRESS_POOL_REFILL_SIZE)
+    except ImportError:
+        logger.error("bip_utils is not installed - cannot derive deposit addresses")
+        return 0
+    except Exception as e:
+        logger.error(f"Error deriving {network} addresses: {e}")
+        return 0
+
+    added = database.import_deposit_addresses(network, [a for _, a in derived], [i for i, _ in derived]) or 0
+    logger.info(f"💳 Added {added} {network} deposit addresses to the pool")
+    return added
+
+
+async def refill_forever():
+    """Background loop started from post_init"""
+    while True:
+        for network in NETWORKS:
+            try:
+                await asyncio.to_thread(refill, network)
+            except Exception as e:
+                logger.error(f"❌ Address pool refill error ({network}): {e}")
+        await asyncio.sleep(ADDRESS_POOL_REFILL_SECONDS)
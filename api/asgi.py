@@ -0,0 +1,17 @@
+"""
+ASGI entry point for the admin panel (e.g. uvicorn api.asgi:app).
+Same routes and templates as index.py. The views are still synchronous Flask
+views run in the server's thread pool (WsgiToAsgi), not coroutines; only their
+database reads go concurrently through async_db's shared connection pool.
+"""
+import os
+import sys
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+if current_dir not in sys.path:
+    sys.path.insert(0, current_dir)
+
+from asgiref.wsgi import WsgiToAsgi
+from index import app as flask_app
+
+app = WsgiToAsgi(flask_app)
@@ -0,0 +1,96 @@
+"""
+Async Database Access
+Read queries for the admin panel issued concurrently on one shared event loop
+and Supabase HTTP connection pool (reused across requests). Views stay
+synchronous and run in the server's thread pool; only their reads overlap here.
+Queries are built by queries.py, the same builders database.py uses.
+"""
+import asyncio
+import os
+import threading
+from postgrest import AsyncPostgrestClient
+import queries
+
+SUPABASE_URL = os.getenv("SUPABASE_URL", "")
+SUPABASE_KEY = os.getenv("SUPABASE_KEY", "")
+QUERY_TIMEOUT_SECONDS = 20
+
+_loop = None
+_client = None
+_start_lock = threading.Lock()
+
+
+def _ensure_loop():
+    """Start the background loop on first use (one per process, shared by all requests)"""
+    global _loop
+    with _start_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name='async-db', daemon=True).start()
+    return _loop
+
+
+def _table(name):
+    global _client
+    if _client is None:
+        # Created on the background loop, so its connection pool lives there
+        _client = AsyncPostgrestClient(
+            f"{SUPABASE_URL}/rest/v1",
+            headers={
+                'apikey': SUPABASE_KEY,
+                'Authorization': f"Bearer {SUPABASE_KEY}",
+                'Accept': 'application/json',
+                'Content-Type': 'application/json'
+            }
+        )
+    return _client.from_(name)
+
+
+def gather(**queries):
+    """
+    Run named query coroutines concurrently from a (sync) view and return
+    {name: result}, e.g. gather(rows=get_dashboard_statistics(day), users=get_recent_users(10))
+    """
+    async def run_all():
+        results = await asyncio.gather(*queries.values())
+        return dict(zip(queries.keys(), results))
+
+    future = asyncio.run_coroutine_threadsafe(run_all(), _ensure_loop())
+    return future.result(QUERY_TIMEOUT_SECONDS)
+
+
+# ====================
+# QUERIES (built and shaped by queries.py, like database.py)
+# ====================
+
+async def get_configs(keys):
+    """Several config values in one query: {key: value} (missing keys are absent)"""
+    try:
+        result = await queries.configs(_table, keys).execute()
+        return queries.key_values(result.data)
+    except Exception as e:
+        print(f"Error getting config: {e}")
+        return {}
+
+
+async def get_dashboard_statistics(day):
+    """
+    statistics rows the dashboard needs (counters plus that day's deals_created_<day>),
+    with updated_at: [{'key', 'value', 'updated_at'}]
+    """
+    try:
+        result = await queries.dashboard_statistics(_table, day).execute()
+        return result.data
+    except Exception as e:
+        print(f"Error getting dashboard statistics: {e}")
+        return []
+
+
+async def get_recent_users(limit):
+    """Newest bot users, same tuple shape as database.get_all_bot_users"""
+    try:
+        result = await queries.bot_users(_table, limit).execute()
+        return queries.user_tuples(result.data)
+    except Exception as e:
+        print(f"Error getting recent users: {e}")
+        return []
@@ -7,9 +7,14 @@ parent_dir = os.path.dirname(current_dir)
 if parent_dir not in sys.path:
     sys.path.insert(0, parent_dir)
 
-from flask import Flask, request, render_template, redirect, url_for, session, flash, jsonify
+import hashlib
+import json
+import threading
+import time
+import uuid
+from flask import Flask, request, render_template, redirect, url_for, session, flash, jsonify, Response, stream_with_context, make_response
 from werkzeug.utils import secure_filename
-from datetime import datetime
+from datetime import datetime, timezone
 
 # Robust Database Import
 DB_AVAILABLE = False
@@ -43,6 +48,10 @@ except Exception as e:
         @staticmethod
         def get_all_bot_users(): return []
         @staticmethod
+        def get_deal_status_counts(): return {}
+        @staticmethod
+        def iter_table_rows(table, key_column, columns='*', date_column=None, start=None, end=None, page_size=500): return iter(())
+        @staticmethod
         def get_config(key): return None
         @staticmethod
         def update_config(key, value): return False
@@ -59,6 +68,12 @@ except Exception as e:
         @staticmethod
         def update_crypto_address(address_id, currency, address, network='', label=''): return False
         @staticmethod
+        def import_deposit_addresses(network, addresses, derivation_indexes=None): return 0
+        @staticmethod
+        def get_media_records(): return []
+        @staticmethod
+        def save_media_file(file_type, file_path, description="", file_id=None, content_hash=None): return None
+        @staticmethod
         def get_telegram_admin_session(): return None
         @staticmethod
         def save_telegram_session(session_string, phone, user_data=None): return False
@@ -66,6 +81,35 @@ except Exception as e:
         def get_telegram_session(phone=None): return None
         @staticmethod
         def delete_telegram_session(phone): return False
+        @staticmethod
+        def create_upload(upload_id, filename, size, chunk_size, total_parts, ttl_seconds): return False
+        @staticmethod
+        def get_upload(upload_id): return None
+        @staticmethod
+        def save_upload_part(upload_id, part_index, data): return False
+        @staticmethod
+        def get_upload_part_indexes(upload_id): return []
+        @staticmethod
+        def get_upload_part(upload_id, part_index): return None
+        @staticmethod
+        def delete_upload(upload_id=None): return False
+
+# Concurrent reads over one shared connection pool (falls back to sequential database calls)
+ASYNC_DB = False
+if DB_AVAILABLE:
+    try:
+        if current_dir not in sys.path:
+            sys.path.insert(0, current_dir)
+        import async_db
+        ASYNC_DB = True
+    except Exception as e:
+        print(f"âš ï¸ Async database access unavailable: {e}")
+
+def get_configs(keys):
+    """{key: value} for several config keys (one query when async_db is available)"""
+    if ASYNC_DB:
+        return async_db.gather(config=async_db.get_configs(keys))['config']
+    return {key: database.get_config(key) for key in keys}
 
 app = Flask(__name__)
 app.secret_key = os.getenv("SECRET_KEY", "escrow_bot_secret_key_change_this_in_production")
@@ -131,19 +175,105 @@ def logout():
     flash('Logged out successfully!', 'success')
     return redirect(url_for('login'))
 
+# Dashboard aggregate: small counters kept current by triggers in statistics
+# (users_count, deals_status_*, deals_created_<day>) plus the newest users.
+# Polling browsers within DASHBOARD_CACHE_SECONDS share one read, and an
+# unchanged aggregate answers 304 via its ETag / Last-Modified.
+DASHBOARD_CACHE_SECONDS = 10
+RECENT_USERS_LIMIT = 10
+_dashboard_cache = {'data': None, 'loaded_at': 0}
+
+def _parse_db_timestamp(value):
+    """Supabase TIMESTAMP text (UTC, variable fraction digits) -> aware datetime"""
+    return datetime.strptime(str(value)[:19], '%Y-%m-%dT%H:%M:%S').replace(tzinfo=timezone.utc)
+
+def load_dashboard():
+    """{'aggregate', 'etag', 'last_modified'} for the dashboard (cached briefly)"""
+    if _dashboard_cache['data'] and time.time() - _dashboard_cache['loaded_at'] < DASHBOARD_CACHE_SECONDS:
+        return _dashboard_cache['data']
+
+    day = datetime.utcnow().strftime('%Y-%m-%d')
+    if ASYNC_DB:
+        data = async_db.gather(
+            rows=async_db.get_dashboard_statistics(day),
+            recent_users=async_db.get_recent_users(RECENT_USERS_LIMIT)
+        )
+        rows, recent_users = data['rows'] or [], data['recent_users'] or []
+    else:
+        rows = [{'key': key, 'value': value} for key, value in (database.get_statistics() or {}).items()]
+        recent_users = (database.get_all_bot_users() or [])[:RECENT_USERS_LIMIT]
+
+    counters = {row['key']: row['value'] for row in rows}
+    aggregate = {
+        'users_count': counters.get('users_count', 0),
+        'created_today': counters.get(f'deals_created_{day}', 0),
+        'deal_counts': {key[len('deals_status_'):]: value for key, value in counters.items()
+                        if key.startswith('deals_status_')},
+        'stats': {
+            'total_deals': counters.get('total_deals', 0),
+            'disputes_resolved': counters.get('disputes_resolved', 0)
+        },
+        'recent_users': [list(user) for user in recent_users]
+    }
+
+    changed = [row.get('updated_at') for row in rows] + [user[4] for user in recent_users]
+    body = json.dumps(aggregate, sort_keys=True, default=str)
+    data = {
+        'aggregate': aggregate,
+        'etag': hashlib.sha1(body.encode()).hexdigest(),
+        'last_modified': max((_parse_db_timestamp(value) for value in changed if value), default=None)
+    }
+    _dashboard_cache.update(data=data, loaded_at=time.time())
+    return data
+
+def conditional_response(data, build):
+    """304 when the browser already has this aggregate, else build() with validators attached"""
+    if request.if_none_match.contains(data['etag']) or (
+        not request.if_none_match and data['last_modified'] and request.if_modified_since
+        and data['last_modified'] <= request.if_modified_since
+    ):
+        response = Response(status=304)
+    else:
+        response = make_response(build())
+    response.set_etag(data['etag'])
+    if data['last_modified']:
+        response.last_modified = data['last_modified']
+    # Revalidate on every refresh (cheap: answered from the cache above)
+    response.cache_control.no_cache = True
+    response.cache_control.private = True
+    return response
+
 @app.route('/')
 @login_required
 def dashboard():
     try:
-        stats = database.get_statistics() or {'total_deals': 0, 'disputes_resolved': 0}
-        users = database.get_all_bot_users() or []
-        return render_template('admin_dashboard.html', stats=stats, users=users)
+        data = load_dashboard()
+        aggregate = data['aggregate']
+        return conditional_response(data, lambda: render_template(
+            'admin_dashboard.html',
+            stats=aggregate['stats'],
+            users_count=aggregate['users_count'],
+            created_today=aggregate['created_today'],
+            deal_counts=aggregate['deal_counts'],
+            recent_users=aggregate['recent_users']
+        ))
     except Exception as e:
         print(f"Dashboard error: {e}")
         import traceback
         traceback.print_exc()
         return f"Dashboard error: {str(e)}<br>DB Available: {DB_AVAILABLE}", 500
 
+@app.route('/dashboard.json')
+@login_required
+def dashboard_json():
+    """Dashboard aggregate for lightweight polling (same ETag as the page)"""
+    try:
+        data = load_dashboard()
+        return conditional_response(data, lambda: jsonify(data['aggregate']))
+    except Exception as e:
+        print(f"Dashboard error: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/users')
 @login_required
 def users():
@@ -154,6 +284,83 @@ def users():
         print(f"Users error: {e}")
         return f"Error loading users: {str(e)}", 500
 
+# Streaming exports: dataset -> (table, key column, date column, columns)
+EXPORT_DATASETS = {
+    'users': ('bot_users', 'user_id', 'started_at',
+              ['user_id', 'username', 'first_name', 'last_name', 'started_at']),
+    'deals': ('deals', 'deal_id', 'created_at',
+              ['deal_id', 'buyer_id', 'seller_id', 'buyer_address', 'seller_address',
+               'bot_address', 'amount', 'group_id', 'status', 'created_at']),
+}
+
+class _LineBuffer:
+    """File-like object that hands back whatever csv.writer writes to it"""
+    def write(self, value):
+        return value
+
+def _parse_export_date(value):
+    """Validate an optional ?from= / ?to= date and return it as ISO text"""
+    if not value:
+        return None
+    return datetime.fromisoformat(value).isoformat()
+
+@app.route('/export/<dataset>.<fmt>')
+@login_required
+def export_data(dataset, fmt):
+    """Stream bot_users or deals as CSV / NDJSON without loading the whole table"""
+    import csv
+    import json
+
+    if dataset not in EXPORT_DATASETS or fmt not in ('csv', 'ndjson'):
+        return jsonify({'error': 'Unknown export'}), 404
+
+    try:
+        start = _parse_export_date(request.args.get('from'))
+        end = _parse_export_date(request.args.get('to'))
+    except ValueError:
+        return jsonify({'error': 'Dates must be ISO formatted (YYYY-MM-DD)'}), 400
+
+    table, key_column, date_column, columns = EXPORT_DATASETS[dataset]
+    rows = database.iter_table_rows(
+        table, key_column,
+        columns=','.join(columns),
+        date_column=date_column,
+        start=start,
+        end=end
+    )
+
+    # A page that fails mid-stream ends the file with an error marker and aborts the
+    # response, so a truncated download is never mistaken for a complete export
+    def generate_csv():
+        writer = csv.writer(_LineBuffer())
+        yield writer.writerow(columns)
+        try:
+            for row in rows:
+                yield writer.writerow([row.get(c) for c in columns])
+        except Exception as e:
+            yield writer.writerow([f"ERROR: export incomplete ({e})"])
+            raise
+
+    def generate_ndjson():
+        try:
+            for row in rows:
+                yield json.dumps({c: row.get(c) for c in columns}, default=str) + '\n'
+        except Exception as e:
+            yield json.dumps({'error': f"export incomplete ({e})"}) + '\n'
+            raise
+
+    if fmt == 'csv':
+        body, mimetype = generate_csv(), 'text/csv'
+    else:
+        body, mimetype = generate_ndjson(), 'application/x-ndjson'
+
+    filename = f"{dataset}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{fmt}"
+    return Response(
+        stream_with_context(body),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
 @app.route('/videos', methods=['GET', 'POST'])
 @login_required
 def videos():
@@ -179,13 +386,223 @@ def videos():
         uploaded_files = []
         try:
             uploaded_files = os.listdir(app.config['UPLOAD_FOLDER']) if os.path.exists(app.config['UPLOAD_FOLDER']) else []
+            # In-progress assemblies of chunked uploads are not files yet
+            uploaded_files = [f for f in uploaded_files if not f.startswith('.') and not f.endswith('.tmp')]
         except:
             pass
-        return render_template('admin_videos.html', files=uploaded_files)
+        published = {row['file_path']: row['file_type'] for row in database.get_media_records() or [] if row.get('file_id')}
+        return render_template('admin_videos.html', files=uploaded_files, max_upload_mb=MAX_UPLOAD_SIZE // (1024 * 1024),
+                               published=published, storage_chat_id=database.get_config('media_storage_chat_id') or '')
     except Exception as e:
         print(f"Videos error: {e}")
         return f"Error: {str(e)}", 500
 
+# Chunked uploads: the browser sends fixed-size parts (each with its SHA-256), so
+# no request carries or buffers more than one part. An upload id survives page
+# reloads, and the client resumes by asking which parts arrived.
+# Manifests and verified parts are kept in the database (uploads / upload_parts),
+# not on local disk, so each request of an upload may reach a different instance.
+UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024   # stays under serverless request body limits
+MAX_UPLOAD_SIZE = 50 * 1024 * 1024
+UPLOAD_EXPIRY_SECONDS = 24 * 3600
+STREAM_BLOCK_SIZE = 64 * 1024
+
+def load_manifest(upload_id):
+    """Upload manifest, or None if the id is unknown or expired (or not a plain token)"""
+    if not upload_id.isalnum():
+        return None
+    return database.get_upload(upload_id)
+
+def received_parts(upload_id):
+    """Indexes of parts that passed their check (a part is only stored once verified)"""
+    return database.get_upload_part_indexes(upload_id) or []
+
+def upload_status(manifest):
+    received = received_parts(manifest['upload_id'])
+    received_bytes = sum(part_size(manifest, index) for index in received)
+    return {
+        'upload_id': manifest['upload_id'],
+        'filename': manifest['filename'],
+        'chunk_size': manifest['chunk_size'],
+        'total_parts': manifest['total_parts'],
+        'received': received,
+        'progress': round(received_bytes * 100 / manifest['size'], 1) if manifest['size'] else 100.0
+    }
+
+def part_size(manifest, index):
+    if index < manifest['total_parts'] - 1:
+        return manifest['chunk_size']
+    return manifest['size'] - manifest['chunk_size'] * (manifest['total_parts'] - 1)
+
+@app.route('/videos/uploads', methods=['POST'])
+@login_required
+def start_upload():
+    """Begin a chunked upload: {filename, size} -> upload id and part layout"""
+    data = request.get_json(silent=True) or {}
+    filename = secure_filename(data.get('filename') or '')
+    size = data.get('size')
+    if not filename or not allowed_file(filename):
+        return jsonify({'error': 'Invalid file type'}), 400
+    if not isinstance(size, int) or not 0 < size <= MAX_UPLOAD_SIZE:
+        return jsonify({'error': f'File must be between 1 byte and {MAX_UPLOAD_SIZE // (1024 * 1024)} MB'}), 400
+
+    # Unfinished uploads past UPLOAD_EXPIRY_SECONDS (their parts go with them)
+    database.delete_upload()
+    manifest = {
+        'upload_id': uuid.uuid4().hex,
+        'filename': filename,
+        'size': size,
+        'chunk_size': UPLOAD_CHUNK_SIZE,
+        'total_parts': -(-size // UPLOAD_CHUNK_SIZE)
+    }
+    if not database.create_upload(**manifest, ttl_seconds=UPLOAD_EXPIRY_SECONDS):
+        return jsonify({'error': 'Could not start the upload - try again'}), 503
+    return jsonify(upload_status(manifest)), 201
+
+@app.route('/videos/uploads/<upload_id>', methods=['GET'])
+@login_required
+def upload_progress(upload_id):
+    """Which parts arrived (a resuming client sends only the rest)"""
+    manifest = load_manifest(upload_id)
+    if not manifest:
+        return jsonify({'error': 'Unknown upload'}), 404
+    return jsonify(upload_status(manifest))
+
+@app.route('/videos/uploads/<upload_id>/parts/<int:index>', methods=['PUT'])
+@login_required
+def upload_part(upload_id, index):
+    """Store one part once it matches its size and X-Part-SHA256"""
+    manifest = load_manifest(upload_id)
+    if not manifest:
+        return jsonify({'error': 'Unknown upload'}), 404
+    if not 0 <= index < manifest['total_parts']:
+        return jsonify({'error': 'Part index out of range'}), 400
+    expected_hash = (request.headers.get('X-Part-SHA256') or '').lower()
+    if not expected_hash:
+        return jsonify({'error': 'X-Part-SHA256 header required'}), 400
+
+    # Read at most one block past the expected size - an oversized part fails the check
+    data = bytearray()
+    limit = part_size(manifest, index)
+    while len(data) <= limit:
+        block = request.stream.read(STREAM_BLOCK_SIZE)
+        if not block:
+            break
+        data += block
+
+    if len(data) != limit or hashlib.sha256(data).hexdigest() != expected_hash:
+        return jsonify({'error': f'Part {index} failed its size/hash check - resend it'}), 422
+    # Upsert: parts can arrive concurrently and a retried part simply replaces itself
+    if not database.save_upload_part(upload_id, index, bytes(data)):
+        return jsonify({'error': f'Could not store part {index} - resend it'}), 503
+    return jsonify(upload_status(manifest))
+
+@app.route('/videos/uploads/<upload_id>/complete', methods=['POST'])
+@login_required
+def complete_upload(upload_id):
+    """Write the stored parts, in order, into the final file"""
+    manifest = load_manifest(upload_id)
+    if not manifest:
+        return jsonify({'error': 'Unknown upload'}), 404
+    missing = sorted(set(range(manifest['total_parts'])) - set(received_parts(upload_id)))
+    if missing:
+        return jsonify({'error': 'Upload incomplete', 'missing': missing}), 409
+
+    final_path = os.path.join(app.config['UPLOAD_FOLDER'], manifest['filename'])
+    # Own temp file per request: a repeated or concurrent complete never writes into another's
+    tmp_path = f"{final_path}.{uuid.uuid4().hex[:8]}.tmp"
+    complete = True
+    try:
+        with open(tmp_path, 'wb') as out:
+            for index in range(manifest['total_parts']):
+                # One part in memory at a time
+                data = database.get_upload_part(upload_id, index)
+                if data is None:
+                    complete = False
+                    break
+                out.write(data)
+        if not complete:
+            # Another complete of this upload finished first and removed the parts
+            os.remove(tmp_path)
+            return jsonify({'error': 'Upload already completed'}), 409
+        os.replace(tmp_path, final_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    database.delete_upload(upload_id)
+    return jsonify({'filename': manifest['filename'], 'size': manifest['size']})
+
+# Publishing: an uploaded file is sent once to a private storage chat and the
+# bot then sends it by the returned file_id (media_files.file_id)
+PUBLISH_METHODS = {  # extension -> (Bot API method, result field)
+    'mp4': ('sendVideo', 'video'), 'avi': ('sendVideo', 'video'), 'mov': ('sendVideo', 'video'),
+    'png': ('sendPhoto', 'photo'), 'jpg': ('sendPhoto', 'photo'), 'jpeg': ('sendPhoto', 'photo'),
+}
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(STREAM_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def publish_media(filename, file_type, storage_chat_id):
+    """
+    Send an uploaded file to the storage chat and record its file_id and hash.
+    Returns (file_id, already_published).
+    """
+    path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    content_hash = file_sha256(path)
+    current = next((row for row in database.get_media_records() or [] if row['file_type'] == file_type), None)
+    if current and current.get('file_id') and current.get('content_hash') == content_hash:
+        return current['file_id'], True
+
+    method, field = PUBLISH_METHODS[filename.rsplit('.', 1)[1].lower()]
+    with open(path, 'rb') as f:
+        result = bot_api(method, {'chat_id': storage_chat_id, 'disable_notification': True}, files={field: f})
+    if not result.get('ok'):
+        raise Exception(result.get('description', 'Unknown error'))
+    # Telegram keeps non-MP4 videos (avi, mov) as documents
+    kind = next((k for k in ('video', 'photo', 'animation', 'document') if k in result['result']), None)
+    if kind != field:
+        raise Exception(f"Telegram stored {filename} as {kind or 'unknown media'}, not {field} - convert it to MP4 and publish again")
+    sent = result['result'][kind]
+    # Photos come back in several sizes - the last is the original
+    file_id = sent[-1]['file_id'] if isinstance(sent, list) else sent['file_id']
+
+    database.save_media_file(file_type, filename, f"Published from admin panel ({filename})", file_id, content_hash)
+    return file_id, False
+
+@app.route('/videos/publish', methods=['POST'])
+@login_required
+def publish_video():
+    filename = secure_filename(request.form.get('filename', ''))
+    file_type = request.form.get('file_type', '').strip() or 'video'
+    storage_chat_id = request.form.get('storage_chat_id', '').strip()
+
+    if not filename or not allowed_file(filename) or not os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], filename)):
+        flash('File not found - upload it again.', 'danger')
+        return redirect(url_for('videos'))
+    if not storage_chat_id:
+        flash('Enter the storage chat ID (a private chat or channel where the bot can post).', 'danger')
+        return redirect(url_for('videos'))
+    if not os.getenv('BOT_TOKEN'):
+        flash('BOT_TOKEN not configured in environment variables', 'danger')
+        return redirect(url_for('videos'))
+
+    try:
+        if storage_chat_id != (database.get_config('media_storage_chat_id') or ''):
+            database.update_config('media_storage_chat_id', storage_chat_id)
+        file_id, unchanged = publish_media(filename, file_type, storage_chat_id)
+        if unchanged:
+            flash(f'{filename} is already published as "{file_type}" - nothing to send.', 'info')
+        else:
+            flash(f'Published {filename} as "{file_type}". The bot now sends it by file_id.', 'success')
+    except Exception as e:
+        flash(f'Error publishing {filename}: {e}', 'danger')
+    return redirect(url_for('videos'))
+
 @app.route('/content', methods=['GET', 'POST'])
 @login_required
 def content():
@@ -258,12 +675,13 @@ def settings():
                 if api_id or api_hash or phone:
                     flash('Telegram settings updated!', 'success')
 
+        values = get_configs(['admin_username', 'admin_password', 'telegram_api_id', 'telegram_api_hash', 'telegram_phone'])
         config = {
-            'admin_username': database.get_config('admin_username') or 'admin',
-            'admin_password': database.get_config('admin_password') or 'Not set',
-            'api_id': database.get_config('telegram_api_id') or '',
-            'api_hash': database.get_config('telegram_api_hash') or '',
-            'phone': database.get_config('telegram_phone') or ''
+            'admin_username': values.get('admin_username') or 'admin',
+            'admin_password': values.get('admin_password') or 'Not set',
+            'api_id': values.get('telegram_api_id') or '',
+            'api_hash': values.get('telegram_api_hash') or '',
+            'phone': values.get('telegram_phone') or ''
         }
         return render_template('admin_settings.html', config=config)
     except Exception as e:
@@ -289,10 +707,11 @@ def telegram_config():
             flash('Telegram credentials saved!', 'success')
             return redirect(url_for('telegram_config'))
         
+        values = get_configs(['telegram_api_id', 'telegram_api_hash', 'telegram_phone'])
         config = {
-            'api_id': database.get_config('telegram_api_id') or '',
-            'api_hash': database.get_config('telegram_api_hash') or '',
-            'phone': database.get_config('telegram_phone') or ''
+            'api_id': values.get('telegram_api_id') or '',
+            'api_hash': values.get('telegram_api_hash') or '',
+            'phone': values.get('telegram_phone') or ''
         }
         
         return render_template('telegram_config.html', config=config)
@@ -307,10 +726,7 @@ def telegram_logout():
         if 'tg_phone' in session:
             database.delete_telegram_session(session['tg_phone'])
         
-        session.pop('tg_step', None)
-        session.pop('tg_phone', None)
-        session.pop('tg_phone_code_hash', None)
-        session.pop('tg_temp_session', None)
+        clear_login_state()
         
         flash('Logged out from Telegram', 'success')
         return redirect(url_for('telegram_login'))
@@ -318,21 +734,30 @@ def telegram_logout():
         flash(f"Error logging out: {e}", 'danger')
         return redirect(url_for('telegram_login'))
 
+def clear_login_state():
+    """Forget the Telegram login in progress (and close its pending connection)"""
+    login_id = session.pop('tg_login_id', None)
+    session.pop('tg_step', None)
+    session.pop('tg_phone', None)
+    if login_id:
+        try:
+            if current_dir not in sys.path:
+                sys.path.insert(0, current_dir)
+            from telegram_auth import login_worker
+            login_worker.cancel(login_id)
+        except Exception as e:
+            print(f"Error cancelling Telegram login: {e}")
+
 @app.route('/telegram-login', methods=['GET', 'POST'])
 @login_required
 def telegram_login():
     """Telegram login page with working authentication"""
     try:
-        import asyncio
-        import sys
-        import os
-        
         # Add current directory to path for imports
-        current_dir = os.path.dirname(os.path.abspath(__file__))
         if current_dir not in sys.path:
             sys.path.insert(0, current_dir)
         
-        from telegram_auth import TelegramAuth
+        from telegram_auth import login_worker
     except ImportError as e:
         flash(f'Telegram authentication module not available: {str(e)}', 'danger')
         return render_template('telegram_login.html', session_data=None, login_step='phone', phone=None)
@@ -345,10 +770,7 @@ def telegram_login():
         
         if action == 'start_over':
             # Clear all telegram session data
-            session.pop('tg_step', None)
-            session.pop('tg_phone', None)
-            session.pop('tg_phone_code_hash', None)
-            session.pop('tg_temp_session', None)
+            clear_login_state()
             flash('Started over. Please enter your phone number.', 'info')
             return redirect(url_for('telegram_login'))
         
@@ -358,14 +780,13 @@ def telegram_login():
                 flash('Please enter your phone number', 'danger')
                 return redirect(url_for('telegram_login'))
             
-            # Send verification code
-            auth = TelegramAuth()
+            # Send verification code (the connection stays open in the login worker)
+            clear_login_state()
             try:
-                result = asyncio.run(auth.send_code(phone))
+                result = login_worker.send_code(phone)
                 if result['success']:
                     session['tg_phone'] = phone
-                    session['tg_temp_session'] = result['temp_session']
-                    session['tg_phone_code_hash'] = result['phone_code_hash']
+                    session['tg_login_id'] = result['login_id']
                     session['tg_step'] = 'code'
                     flash(f"âœ… Code sent to {phone}! Enter it below.", 'success')
                 else:
@@ -377,19 +798,17 @@ def telegram_login():
         
         elif action == 'verify_code':
             phone = session.get('tg_phone')
-            temp_session = session.get('tg_temp_session')
-            phone_code_hash = session.get('tg_phone_code_hash')
+            login_id = session.get('tg_login_id')
             code = request.form.get('code')
             
-            if not all([phone, temp_session, phone_code_hash, code]):
+            if not all([phone, login_id, code]):
                 flash('Session expired. Please start over.', 'danger')
                 session.pop('tg_step', None)
                 return redirect(url_for('telegram_login'))
             
             # Verify code
-            auth = TelegramAuth()
             try:
-                result = asyncio.run(auth.verify_code(temp_session, phone, code, phone_code_hash))
+                result = login_worker.verify_code(login_id, code)
                 
                 if result['success']:
                     # Save session
@@ -405,15 +824,13 @@ def telegram_login():
                         flash('âš ï¸ Login successful but failed to save session.', 'warning')
                     
                     # Clear session data
-                    session.pop('tg_step', None)
-                    session.pop('tg_phone', None)
-                    session.pop('tg_temp_session', None)
-                    session.pop('tg_phone_code_hash', None)
+                    clear_login_state()
                 elif result.get('requires_password'):
                     session['tg_step'] = 'password'
-                    session['tg_temp_session'] = result['temp_session']
                     flash('2FA enabled. Enter your password.', 'info')
                 else:
+                    if result.get('expired'):
+                        clear_login_state()
                     flash(result.get('error', 'Invalid code'), 'danger')
             except Exception as e:
                 flash(f"Error: {str(e)}", 'danger')
@@ -422,15 +839,14 @@ def telegram_login():
             
         elif action == 'verify_password':
             password = request.form.get('password')
-            temp_session = session.get('tg_temp_session')
+            login_id = session.get('tg_login_id')
             
-            if not password or not temp_session:
+            if not password or not login_id:
                 flash('Please enter your password', 'danger')
                 return redirect(url_for('telegram_login'))
             
-            auth = TelegramAuth()
             try:
-                result = asyncio.run(auth.verify_password(temp_session, password))
+                result = login_worker.verify_password(login_id, password)
                 
                 if result['success']:
                     phone = session.get('tg_phone')
@@ -440,11 +856,10 @@ def telegram_login():
                         result['user_data']
                     )
                     flash('Successfully logged in with 2FA!', 'success')
-                    session.pop('tg_step', None)
-                    session.pop('tg_phone', None)
-                    session.pop('tg_phone_code_hash', None)
-                    session.pop('tg_temp_session', None)
+                    clear_login_state()
                 else:
+                    if result.get('expired'):
+                        clear_login_state()
                     flash(f"Error: {result.get('error', 'Invalid password')}", 'danger')
             except Exception as e:
                 flash(f"Error verifying password: {str(e)}", 'danger')
@@ -489,6 +904,12 @@ def crypto_addresses():
                 else:
                     flash('Error deleting address!', 'danger')
             
+            elif action == 'import_pool':
+                network = request.form.get('network')
+                addresses = [a.strip() for a in request.form.get('addresses', '').splitlines() if a.strip()]
+                added = database.import_deposit_addresses(network, addresses) or 0
+                flash(f'Imported {added} new {network} deposit addresses ({len(addresses) - added} already in pool)', 'success')
+            
             elif action == 'update':
                 address_id = request.form.get('address_id')
                 currency = request.form.get('currency')
@@ -509,26 +930,87 @@ def crypto_addresses():
         print(f"Crypto addresses error: {e}")
         return f"Error: {str(e)}", 500
 
+# Bot API calls from the panel reuse one keep-alive session; getWebhookInfo is
+# cached briefly (dropped on set/delete) and each fetch records pending_update_count
+WEBHOOK_INFO_CACHE_SECONDS = 15
+WEBHOOK_HISTORY_SIZE = 40
+_bot_api_session = None
+_webhook_info_cache = {'info': None, 'loaded_at': 0}
+_pending_history = None  # [[unix time, pending_update_count], ...] oldest first
+_pending_history_lock = threading.Lock()
+
+def bot_api(method, payload=None, files=None):
+    """Call a Bot API method over the shared session; returns the decoded response"""
+    global _bot_api_session
+    import requests
+    if _bot_api_session is None:
+        _bot_api_session = requests.Session()
+    url = f"https://api.telegram.org/bot{os.getenv('BOT_TOKEN')}/{method}"
+    if files:
+        # Multipart upload (form fields + files); larger files need a longer timeout
+        response = _bot_api_session.post(url, data=payload, files=files, timeout=300)
+    else:
+        response = _bot_api_session.post(url, json=payload, timeout=10)
+    return response.json()
+
+def load_pending_history():
+    try:
+        return json.loads(database.get_config('webhook_pending_history') or '[]')
+    except ValueError:
+        return []
+
+def pending_history():
+    """pending_update_count samples (kept in config so they survive restarts)"""
+    global _pending_history
+    with _pending_history_lock:
+        if _pending_history is None:
+            _pending_history = load_pending_history()
+        return list(_pending_history)
+
+def record_pending_count(count):
+    """Append a sample to the stored history, re-read first so other instances' samples are kept"""
+    global _pending_history
+    with _pending_history_lock:
+        history = load_pending_history()
+        history.append([int(time.time()), count])
+        del history[:-WEBHOOK_HISTORY_SIZE]
+        database.update_config('webhook_pending_history', json.dumps(history))
+        _pending_history = history
+
+def get_webhook_info():
+    """getWebhookInfo result, at most one call per WEBHOOK_INFO_CACHE_SECONDS"""
+    if _webhook_info_cache['info'] is not None and time.time() - _webhook_info_cache['loaded_at'] < WEBHOOK_INFO_CACHE_SECONDS:
+        return _webhook_info_cache['info']
+
+    result = bot_api('getWebhookInfo')
+    if not result.get('ok'):
+        raise Exception(result.get('description', 'Unknown error'))
+    info = result.get('result', {})
+    _webhook_info_cache.update(info=info, loaded_at=time.time())
+
+    record_pending_count(info.get('pending_update_count', 0))
+    return info
+
+def invalidate_webhook_info():
+    _webhook_info_cache['info'] = None
+
 @app.route('/webhook-manager', methods=['GET', 'POST'])
 @login_required
 def webhook_manager():
     try:
-        import requests
-        
         bot_token = os.getenv('BOT_TOKEN')
         if not bot_token:
             flash('BOT_TOKEN not configured in environment variables', 'danger')
-            return render_template('webhook_manager.html', webhook_info={})
-        
-        base_url = 'https://api.telegram.org/bot' + bot_token
+            return render_template('webhook_manager.html', webhook_info={}, history=[])
         
         if request.method == 'POST':
             action = request.form.get('action')
+            # Whatever happens next, the status shown must be re-read
+            invalidate_webhook_info()
             
             if action == 'delete':
                 try:
-                    response = requests.post(base_url + '/deleteWebhook', timeout=10)
-                    result = response.json()
+                    result = bot_api('deleteWebhook')
                     if result.get('ok'):
                         flash('Webhook deleted successfully!', 'success')
                     else:
@@ -540,8 +1022,7 @@ def webhook_manager():
                 webhook_url = request.form.get('webhook_url')
                 if webhook_url:
                     try:
-                        response = requests.post(base_url + '/setWebhook', json={'url': webhook_url}, timeout=10)
-                        result = response.json()
+                        result = bot_api('setWebhook', {'url': webhook_url})
                         if result.get('ok'):
                             flash('Webhook set to: ' + webhook_url, 'success')
                         else:
@@ -551,8 +1032,7 @@ def webhook_manager():
             
             elif action == 'fix':
                 try:
-                    response = requests.post(base_url + '/deleteWebhook', timeout=10)
-                    result = response.json()
+                    result = bot_api('deleteWebhook')
                     if result.get('ok'):
                         flash('Webhook deleted! Bot is now in polling mode.', 'success')
                     else:
@@ -564,14 +1044,16 @@ def webhook_manager():
         
         webhook_info = {}
         try:
-            response = requests.get(base_url + '/getWebhookInfo', timeout=10)
-            result = response.json()
-            if result.get('ok'):
-                webhook_info = result.get('result', {})
+            webhook_info = get_webhook_info()
         except Exception as e:
             flash('Error getting webhook info: ' + str(e), 'warning')
         
-        return render_template('webhook_manager.html', webhook_info=webhook_info)
+        history = [
+            {'at': datetime.fromtimestamp(at, timezone.utc).strftime('%H:%M:%S'), 'count': count}
+            for at, count in pending_history()
+        ]
+        return render_template('webhook_manager.html', webhook_info=webhook_info, history=history,
+                               history_max=max([h['count'] for h in history] + [1]))
     except Exception as e:
         print(f"Webhook manager error: {e}")
         return f"Error: {str(e)}", 500
@@ -3,6 +3,10 @@ Telegram Authentication Module
 Fetches API_ID and API_HASH from Supabase (configured via admin panel Settings tab).
 """
 import os
+import asyncio
+import secrets
+import threading
+import time
 from telethon import TelegramClient
 from telethon.sessions import StringSession
 from telethon.errors import (
@@ -39,6 +43,13 @@ def _get_tg_credentials():
         )
 
 
+def _user_data(me):
+    return {
+        'id': me.id, 'phone': me.phone, 'username': me.username,
+        'first_name': me.first_name, 'last_name': me.last_name
+    }
+
+
 class TelegramAuth:
     def __init__(self):
         self.api_id, self.api_hash, self.phone = _get_tg_credentials()
@@ -48,113 +59,211 @@ class TelegramAuth:
             return False, "API_ID and API_HASH not configured. Go to Admin Panel â†’ Settings â†’ Telegram API Credentials."
         return True, None
 
-    async def send_code(self, phone):
-        """Send verification code and return temp session + phone_code_hash"""
-        ok, err = self._check_creds()
+
+async def get_telegram_client(session_string, api_id=None, api_hash=None):
+    """Get an authenticated Telegram client from saved session."""
+    if not api_id or not api_hash:
+        api_id, api_hash, _ = _get_tg_credentials()
+    client = TelegramClient(StringSession(session_string), api_id, api_hash)
+    await client.connect()
+    if not await client.is_user_authorized():
+        await client.disconnect()
+        return None
+    return client
+
+
+async def create_escrow_group(session_string, title, description=""):
+    """Create a Telegram group using saved session."""
+    client = await get_telegram_client(session_string)
+    if not client:
+        return {'success': False, 'error': 'Session invalid or expired. Please re-login via admin panel.'}
+    try:
+        result = await client.create_channel(title=title, about=description, megagroup=True)
+        group_id = result.chats[0].id
+        await client.disconnect()
+        return {'success': True, 'group_id': group_id, 'title': title}
+    except Exception as e:
+        if client.is_connected(): await client.disconnect()
+        return {'success': False, 'error': str(e)}
+
+
+# ====================
+# LOGIN WORKER
+# ====================
+
+# A login left unfinished is dropped (and its connection closed) after this long
+LOGIN_TTL_SECONDS = 600
+# Longest a panel request waits on a login step
+STEP_TIMEOUT_SECONDS = 60
+
+
+def _login_store():
+    """database module that persists pending logins (None when the panel runs without one)"""
+    try:
+        import database
+        return database
+    except Exception as e:
+        print(f"[telegram_auth] Pending logins are not persisted: {e}")
+        return None
+
+
+class LoginWorker:
+    """
+    Keeps each pending login's client connected on one background event loop,
+    keyed by a server-side login id, so send-code, verify-code and 2FA are each
+    a single RPC on the same connection (no new loop, client or handshake per step).
+    The login's session and phone_code_hash are also stored under its id, so an
+    instance that never saw the login reconnects from the stored session.
+    """
+
+    def __init__(self):
+        self._loop = None
+        self._start_lock = threading.Lock()
+        self._pending = {}  # login_id -> {'client', 'phone', 'phone_code_hash', 'expires_at'}
+
+    def _ensure_loop(self):
+        with self._start_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name='telegram-login', daemon=True).start()
+                asyncio.run_coroutine_threadsafe(self._expire_forever(), self._loop)
+        return self._loop
+
+    def _run(self, coro):
+        """Run a step on the worker loop and wait for its result (called from Flask threads)"""
+        future = asyncio.run_coroutine_threadsafe(coro, self._ensure_loop())
+        return future.result(STEP_TIMEOUT_SECONDS)
+
+    async def _persist(self, login_id, login):
+        """Store the login (refreshing its expiry) for the other panel instances"""
+        login['expires_at'] = time.time() + LOGIN_TTL_SECONDS
+        store = _login_store()
+        if store:
+            await asyncio.to_thread(
+                store.save_telegram_login, login_id, login['phone'], login['phone_code_hash'],
+                login['client'].session.save(), LOGIN_TTL_SECONDS
+            )
+
+    async def _drop(self, login_id):
+        login = self._pending.pop(login_id, None)
+        if login and login['client'].is_connected():
+            await login['client'].disconnect()
+        store = _login_store()
+        if store:
+            await asyncio.to_thread(store.delete_telegram_login, login_id)
+
+    async def _expire_forever(self):
+        while True:
+            now = time.time()
+            for login_id in [i for i, login in self._pending.items() if login['expires_at'] < now]:
+                await self._drop(login_id)
+            store = _login_store()
+            if store:
+                await asyncio.to_thread(store.delete_telegram_login)
+            await asyncio.sleep(30)
+
+    async def _get(self, login_id):
+        """Live login for this id, reconnected from the stored session if another instance started it"""
+        login = self._pending.get(login_id)
+        if login:
+            return login if login['expires_at'] >= time.time() else None
+
+        store = _login_store()
+        row = await asyncio.to_thread(store.get_telegram_login, login_id) if store else None
+        if not row:
+            return None
+
+        auth = await asyncio.to_thread(TelegramAuth)
+        client = TelegramClient(StringSession(row['session_string']), auth.api_id, auth.api_hash)
+        try:
+            await client.connect()
+        except Exception as e:
+            print(f"[telegram_auth] Error resuming login: {e}")
+            return None
+
+        login = {
+            'client': client,
+            'phone': row['phone'],
+            'phone_code_hash': row['phone_code_hash'],
+            'expires_at': time.time() + LOGIN_TTL_SECONDS
+        }
+        self._pending[login_id] = login
+        return login
+
+    async def _send_code(self, phone):
+        auth = await asyncio.to_thread(TelegramAuth)
+        ok, err = auth._check_creds()
         if not ok:
             return {'success': False, 'error': err}
 
-        client = None
+        client = TelegramClient(StringSession(), auth.api_id, auth.api_hash)
         try:
-            client = TelegramClient(StringSession(), self.api_id, self.api_hash)
             await client.connect()
             result = await client.send_code_request(phone)
-            temp_session = client.session.save()
-            phone_code_hash = result.phone_code_hash
-            await client.disconnect()
-            return {
-                'success': True,
-                'temp_session': temp_session,
-                'phone_code_hash': phone_code_hash,
-                'phone': phone
-            }
         except FloodWaitError as e:
-            if client: await client.disconnect()
+            await client.disconnect()
             return {'success': False, 'error': f'Too many requests. Wait {e.seconds} seconds.'}
         except Exception as e:
-            if client: await client.disconnect()
+            await client.disconnect()
             return {'success': False, 'error': f'Error: {str(e)}'}
 
-    async def verify_code(self, temp_session, phone, code, phone_code_hash):
-        """Verify OTP code"""
-        ok, err = self._check_creds()
-        if not ok:
-            return {'success': False, 'error': err}
+        login_id = secrets.token_urlsafe(16)
+        login = {'client': client, 'phone': phone, 'phone_code_hash': result.phone_code_hash}
+        self._pending[login_id] = login
+        await self._persist(login_id, login)
+        return {'success': True, 'login_id': login_id, 'phone': phone}
+
+    async def _finish(self, login_id, client):
+        """Signed in: hand back the session and release the connection"""
+        session_string = client.session.save()
+        me = await client.get_me()
+        await self._drop(login_id)
+        return {'success': True, 'session_string': session_string, 'user_data': _user_data(me)}
 
-        client = None
+    async def _verify_code(self, login_id, code):
+        login = await self._get(login_id)
+        if not login:
+            return {'success': False, 'error': 'Login expired. Click Start Over to get a new code.', 'expired': True}
+        client = login['client']
         try:
-            client = TelegramClient(StringSession(temp_session), self.api_id, self.api_hash)
-            await client.connect()
-            try:
-                await client.sign_in(phone, code, phone_code_hash=phone_code_hash)
-                session_string = client.session.save()
-                me = await client.get_me()
-                user_data = {
-                    'id': me.id, 'phone': me.phone, 'username': me.username,
-                    'first_name': me.first_name, 'last_name': me.last_name
-                }
-                await client.disconnect()
-                return {'success': True, 'session_string': session_string, 'user_data': user_data}
-            except SessionPasswordNeededError:
-                temp_session_2fa = client.session.save()
-                await client.disconnect()
-                return {'success': False, 'requires_password': True, 'temp_session': temp_session_2fa}
+            await client.sign_in(login['phone'], code, phone_code_hash=login['phone_code_hash'])
+        except SessionPasswordNeededError:
+            await self._persist(login_id, login)
+            return {'success': False, 'requires_password': True}
         except PhoneCodeInvalidError:
-            if client and client.is_connected(): await client.disconnect()
+            # Same connection stays up for the next try
             return {'success': False, 'error': 'Invalid code. Please check and try again.'}
         except PhoneCodeExpiredError:
-            if client and client.is_connected(): await client.disconnect()
+            await self._drop(login_id)
             return {'success': False, 'error': 'Code expired. Click Start Over to get a new code.', 'expired': True}
         except Exception as e:
-            if client and client.is_connected(): await client.disconnect()
             return {'success': False, 'error': f'Error: {str(e)}'}
+        return await self._finish(login_id, client)
 
-    async def verify_password(self, temp_session, password):
-        """Complete 2FA login"""
-        ok, err = self._check_creds()
-        if not ok:
-            return {'success': False, 'error': err}
-
-        client = None
+    async def _verify_password(self, login_id, password):
+        login = await self._get(login_id)
+        if not login:
+            return {'success': False, 'error': 'Login expired. Click Start Over to get a new code.', 'expired': True}
         try:
-            client = TelegramClient(StringSession(temp_session), self.api_id, self.api_hash)
-            await client.connect()
-            await client.sign_in(password=password)
-            session_string = client.session.save()
-            me = await client.get_me()
-            user_data = {
-                'id': me.id, 'phone': me.phone, 'username': me.username,
-                'first_name': me.first_name, 'last_name': me.last_name
-            }
-            await client.disconnect()
-            return {'success': True, 'session_string': session_string, 'user_data': user_data}
+            await login['client'].sign_in(password=password)
         except Exception as e:
-            if client and client.is_connected(): await client.disconnect()
             return {'success': False, 'error': f'Invalid password: {str(e)}'}
+        return await self._finish(login_id, login['client'])
 
+    def send_code(self, phone):
+        """Start a login; returns {'success', 'login_id', 'phone'} or 'error'"""
+        return self._run(self._send_code(phone))
 
-async def get_telegram_client(session_string, api_id=None, api_hash=None):
-    """Get an authenticated Telegram client from saved session."""
-    if not api_id or not api_hash:
-        api_id, api_hash, _ = _get_tg_credentials()
-    client = TelegramClient(StringSession(session_string), api_id, api_hash)
-    await client.connect()
-    if not await client.is_user_authorized():
-        await client.disconnect()
-        return None
-    return client
+    def verify_code(self, login_id, code):
+        return self._run(self._verify_code(login_id, code))
 
+    def verify_password(self, login_id, password):
+        return self._run(self._verify_password(login_id, password))
 
-async def create_escrow_group(session_string, title, description=""):
-    """Create a Telegram group using saved session."""
-    client = await get_telegram_client(session_string)
-    if not client:
-        return {'success': False, 'error': 'Session invalid or expired. Please re-login via admin panel.'}
-    try:
-        result = await client.create_channel(title=title, about=description, megagroup=True)
-        group_id = result.chats[0].id
-        await client.disconnect()
-        return {'success': True, 'group_id': group_id, 'title': title}
-    except Exception as e:
-        if client.is_connected(): await client.disconnect()
-        return {'success': False, 'error': str(e)}
+    def cancel(self, login_id):
+        if login_id and self._loop is not None:
+            self._run(self._drop(login_id))
+
+
+# Shared instance used by the admin panel
+login_worker = LoginWorker()
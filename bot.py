@@ -1,6 +1,5 @@
 import logging
 import re
-import uuid
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     ApplicationBuilder,
@@ -20,6 +19,20 @@ import os
 from bot_error_wrapper import handle_errors, safe_call
 from create_command import create_command
 import telegram_group_manager
+import deal_states
+import deal_sweeper
+import deposit_watcher
+import address_pool
+import price_oracle
+import qr_codes
+import leaderboard
+import callback_router
+import deal_cache
+import cluster
+import lifecycle
+import deal_groups
+import reference_data
+import deal_ids
 
 # Logging setup
 logging.basicConfig(
@@ -64,8 +77,35 @@ from telegram import BotCommand
 
 async def post_init(application):
     """Start tasks after bot initialization"""
-    asyncio.create_task(health_check_server())
-    logger.info("✅ Health check task scheduled")
+    # Runs before polling starts, so the first updates hit warm caches
+    await reference_data.warm_up([
+        ("prices", price_oracle.oracle.refresh),
+        ("leaderboard", leaderboard.get_text),
+    ])
+
+    if not cluster.MULTI:
+        # In multi-instance mode the worker endpoint answers health checks
+        lifecycle.spawn(health_check_server(), "health_check")
+        logger.info("✅ Health check task scheduled")
+
+        # SIGTERM runs the drain protocol, then stops run_polling's loop
+        lifecycle.install(application, asyncio.get_running_loop().stop)
+
+    if cluster.runs_singletons():
+        lifecycle.spawn(deal_sweeper.run_forever(), "deal_sweeper")
+        logger.info("✅ Deal sweeper scheduled")
+
+        lifecycle.spawn(deposit_watcher.watcher.run_forever(application.bot), "deposit_watcher")
+        logger.info("✅ Deposit watcher scheduled")
+
+        lifecycle.spawn(address_pool.refill_forever(), "address_pool_refill")
+        logger.info("✅ Address pool refill scheduled")
+
+        # Finish group creations a previous shutdown/crash cut short
+        asyncio.create_task(lifecycle.resume_jobs(application.bot))
+
+    lifecycle.spawn(price_oracle.oracle.run_forever(), "price_oracle")
+    logger.info("✅ Price oracle scheduled")
     
     # Set Bot Commands (Activates the Menu Button)
     commands = [
@@ -76,6 +116,7 @@ async def post_init(application):
         BotCommand("blockchain", "View official escrow addresses"),
         BotCommand("pay_seller", "Release funds to seller"),
         BotCommand("refund_buyer", "Refund funds to buyer"),
+        BotCommand("dispute", "Open a dispute on a funded deal"),
         BotCommand("seller", "Set your wallet as Seller"),
         BotCommand("buyer", "Set your wallet as Buyer"),
         BotCommand("instructions", "How to use the bot"),
@@ -84,6 +125,17 @@ async def post_init(application):
     await application.bot.set_my_commands(commands)
     logger.info(f"✅ Set {len(commands)} bot commands")
 
+def load_deal(group_id, deal_id=None):
+    """Deal record by id when a button carries it, else by the group it belongs to"""
+    if deal_id:
+        return deal_cache.get_by_id(deal_id)
+    return deal_cache.get(group_id)
+
+def deal_button(text, deal, action):
+    """Inline button whose callback carries the deal id (when there is a deal)"""
+    data = callback_router.deal_callback(deal.deal_id, action) if deal else action
+    return InlineKeyboardButton(text, callback_data=data)
+
 def get_group_keyboard():
     """Get inline keyboard for group messages"""
     keyboard = [
@@ -94,6 +146,41 @@ def get_group_keyboard():
     ]
     return InlineKeyboardMarkup(keyboard)
 
+# ====================
+# MEDIA
+# ====================
+
+# media_files type of the welcome/tutorial video, and the local file used until one is published
+VIDEO_MEDIA_TYPE = 'video'
+LOCAL_VIDEO_PATH = "video.mp4"
+_uploaded_file_ids = {}  # local path -> file_id Telegram returned for its first upload
+
+async def reply_with_video(message, caption, reply_markup=None):
+    """
+    Reply with the video by Telegram file_id: the one published from the admin panel,
+    else the one learned from uploading LOCAL_VIDEO_PATH once. False if there is no video.
+    """
+    from telegram.error import BadRequest
+
+    media = reference_data.media(VIDEO_MEDIA_TYPE) or {}
+    file_id = media.get('file_id') or _uploaded_file_ids.get(LOCAL_VIDEO_PATH)
+    if file_id:
+        try:
+            await message.reply_video(video=file_id, caption=caption, reply_markup=reply_markup, parse_mode='HTML')
+            return True
+        except BadRequest as e:
+            # file_id no longer valid for this bot - fall back to the local copy
+            logger.warning(f"Stored video file_id rejected ({e}) - uploading local copy")
+            _uploaded_file_ids.pop(LOCAL_VIDEO_PATH, None)
+
+    if not os.path.exists(LOCAL_VIDEO_PATH):
+        return False
+    with open(LOCAL_VIDEO_PATH, "rb") as video:
+        sent = await message.reply_video(video=video, caption=caption, reply_markup=reply_markup, parse_mode='HTML')
+    if sent.video:
+        _uploaded_file_ids[LOCAL_VIDEO_PATH] = sent.video.file_id
+    return True
+
 # ====================
 # COMMAND HANDLERS
 # ====================
@@ -106,22 +193,14 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         # If in group, send group welcome
         if update.effective_chat.type in ['group', 'supergroup']:
-            stats = database.get_statistics()
+            stats = reference_data.statistics()
             welcome_text = messages.GROUP_WELCOME_TEXT.format(
                 total_deals=stats.get('total_deals', 5542),
                 disputes_resolved=stats.get('disputes_resolved', 158)
             )
             keyboard = get_group_keyboard()
             
-            if os.path.exists("video.mp4"):
-                with open("video.mp4", "rb") as video:
-                    await update.message.reply_video(
-                        video=video,
-                        caption=welcome_text,
-                        reply_markup=keyboard,
-                        parse_mode='HTML'
-                    )
-            else:
+            if not await reply_with_video(update.message, welcome_text, keyboard):
                 await update.message.reply_text(
                     welcome_text,
                     reply_markup=keyboard,
@@ -162,14 +241,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        if os.path.exists("video.mp4"):
-            await update.message.reply_video(
-                video=open("video.mp4", "rb"),
-                caption=f"<b>{messages.WELCOME_TEXT}</b>",
-                reply_markup=reply_markup,
-                parse_mode='HTML'
-            )
-        else:
+        if not await reply_with_video(update.message, f"<b>{messages.WELCOME_TEXT}</b>", reply_markup):
             await update.message.reply_text(
                 f"<b>{messages.WELCOME_TEXT}</b>",
                 reply_markup=reply_markup,
@@ -190,19 +262,21 @@ async def menu_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /menu command - show keyboard in groups"""
     if update.effective_chat.type in ['group', 'supergroup']:
         # Group menu with action buttons (from screenshot)
+        # Bind deal buttons to the deal so presses skip the group lookup
+        deal = deal_cache.get(update.effective_chat.id)
         keyboard = [
             [InlineKeyboardButton(messages.BTN_INSTRUCTIONS, callback_data='instructions')],
             [
-                InlineKeyboardButton(messages.BTN_PAY_SELLER, callback_data='pay_seller'),
-                InlineKeyboardButton(messages.BTN_REFUND_BUYER, callback_data='refund_buyer')
+                deal_button(messages.BTN_PAY_SELLER, deal, 'pay_seller'),
+                deal_button(messages.BTN_REFUND_BUYER, deal, 'refund_buyer')
             ],
-            [InlineKeyboardButton(messages.BTN_RESET_ROLES, callback_data='reset_roles')],
+            [deal_button(messages.BTN_RESET_ROLES, deal, 'reset_roles')],
             [
-                InlineKeyboardButton(messages.BTN_BALANCE, callback_data='balance'),
-                InlineKeyboardButton(messages.BTN_BLOCKCHAIN, callback_data='blockchain')
+                deal_button(messages.BTN_BALANCE, deal, 'balance'),
+                deal_button(messages.BTN_BLOCKCHAIN, deal, 'blockchain')
             ],
             [
-                InlineKeyboardButton(messages.BTN_GET_QR, callback_data='get_qr'),
+                deal_button(messages.BTN_GET_QR, deal, 'get_qr'),
                 InlineKeyboardButton(messages.BTN_CONTACT, callback_data='contact')
             ],
             [InlineKeyboardButton(messages.BTN_LEADERBOARD, callback_data='leaderboard')]
@@ -266,22 +340,27 @@ async def seller_address_command(update: Update, context: ContextTypes.DEFAULT_T
     # If in group, update deal
     if update.effective_chat.type in ['group', 'supergroup']:
         group_id = update.effective_chat.id
-        deal = database.get_deal_by_group(group_id)
+        deal = deal_cache.get(group_id)
         
         if deal:
-            deal_id = deal[0]
-            existing_buyer_id = deal[1]
-            existing_buyer_addr = deal[3]
+            if deal.roles_locked:
+                await update.message.reply_text(
+                    "🔒 <b>Roles are locked once the deal is funded.</b>",
+                    parse_mode='HTML'
+                )
+                return
             
             # PREVENT SELF-DEALING: Check if user is already Buyer
-            if existing_buyer_id and str(existing_buyer_id) == str(user.id):
+            if deal.buyer_id and str(deal.buyer_id) == str(user.id):
                  await update.message.reply_text(
                     "❌ <b>You cannot be both Seller and Buyer!</b>",
                     parse_mode='HTML'
                 )
                  return
 
-            database.update_deal_address(deal_id, 'seller', address, user_id=user.id)
+            if not deal_cache.set_party(deal, 'seller', address, user.id):
+                await update.message.reply_text("<b>Could not save your wallet. Please try again.</b>", parse_mode='HTML')
+                return
             
             # Role Declaration Message
             msg = (
@@ -292,7 +371,7 @@ async def seller_address_command(update: Update, context: ContextTypes.DEFAULT_T
             )
             
             # Only show prompt via text if Buyer is NOT ready
-            if not existing_buyer_addr:
+            if not deal.buyer_address:
                 msg += (
                     "\n\n"
                     "💬 <b>Buyer, please enter your receiving address using:</b> <code>/buyer ADDRESS</code>\n"
@@ -341,22 +420,27 @@ async def buyer_address_command(update: Update, context: ContextTypes.DEFAULT_TY
     # If in group, update deal
     if update.effective_chat.type in ['group', 'supergroup']:
         group_id = update.effective_chat.id
-        deal = database.get_deal_by_group(group_id)
+        deal = deal_cache.get(group_id)
         
         if deal:
-            deal_id = deal[0]
-            existing_seller_id = deal[2]
-            existing_seller_addr = deal[4]
+            if deal.roles_locked:
+                await update.message.reply_text(
+                    "🔒 <b>Roles are locked once the deal is funded.</b>",
+                    parse_mode='HTML'
+                )
+                return
             
             # PREVENT SELF-DEALING: Check if user is already Seller
-            if existing_seller_id and str(existing_seller_id) == str(user.id):
+            if deal.seller_id and str(deal.seller_id) == str(user.id):
                  await update.message.reply_text(
                     "❌ <b>You cannot be both Buyer and Seller!</b>",
                     parse_mode='HTML'
                 )
                  return
             
-            database.update_deal_address(deal_id, 'buyer', address, user_id=user.id)
+            if not deal_cache.set_party(deal, 'buyer', address, user.id):
+                await update.message.reply_text("<b>Could not save your wallet. Please try again.</b>", parse_mode='HTML')
+                return
             
             # Role Declaration Message
             msg = (
@@ -367,7 +451,7 @@ async def buyer_address_command(update: Update, context: ContextTypes.DEFAULT_TY
             )
             
             # Only show prompt via text if Seller is NOT ready
-            if not existing_seller_addr:
+            if not deal.seller_address:
                 msg += (
                     "\n\n"
                     "💬 <b>Seller, please enter your receiving address using:</b> <code>/seller ADDRESS</code>\n"
@@ -395,14 +479,12 @@ async def buyer_address_command(update: Update, context: ContextTypes.DEFAULT_TY
 
 async def check_and_send_transaction_info(update, context, group_id):
     """Check if both parties ready and send info"""
-    deal = database.get_deal_by_group(group_id)
+    deal = deal_cache.get(group_id)
     if not deal:
         return
 
-    # deal structure: (deal_id, buyer_id, seller_id, buyer_address, seller_address, bot_address, status)
-    
-    buyer_addr = deal[3]
-    seller_addr = deal[4]
+    buyer_addr = deal.buyer_address
+    seller_addr = deal.seller_address
     
     if buyer_addr and seller_addr:
         # Both ready! Trigger Info.
@@ -413,7 +495,7 @@ async def check_and_send_transaction_info(update, context, group_id):
             network = "Unknown"
         
         # 2. Fetch Bot Address
-        bot_wallet = database.get_config(f"wallet_{network}")
+        bot_wallet = reference_data.config(f"wallet_{network}")
         
         if not bot_wallet:
              bot_wallet = "NOT_SET_CONTACT_ADMIN"
@@ -422,13 +504,13 @@ async def check_and_send_transaction_info(update, context, group_id):
         msg = (
             "📍 <b>TRANSACTION INFORMATION</b>\n\n"
             "⚡️ <b>SELLER</b>\n"
-            f"<a href='tg://user?id={deal[2]}'>Seller</a>\n"
-            f"[{deal[2]}]\n\n"
+            f"<a href='tg://user?id={deal.seller_id}'>Seller</a>\n"
+            f"[{deal.seller_id}]\n\n"
             "⚡️ <b>BUYER</b>\n"
-            f"<a href='tg://user?id={deal[1]}'>Buyer</a>\n"
-            f"[{deal[1]}]\n\n"
+            f"<a href='tg://user?id={deal.buyer_id}'>Buyer</a>\n"
+            f"[{deal.buyer_id}]\n\n"
             "📝 <b>TRANSACTION ID</b>\n"
-            f"<code>{deal[0]}</code>\n\n"
+            f"<code>{deal.deal_id}</code>\n\n"
             "🟢 <b>ESCROW ADDRESS:</b>\n"
             f"<code>{bot_wallet}</code> [{network}]\n\n"
             "⚠️ <b>IMPORTANT: AVOID SCAMS!</b>\n\n"
@@ -490,7 +572,7 @@ async def set_escrow_address_command(update: Update, context: ContextTypes.DEFAU
     # Let's just use a dedicated key in 'config' table or 'crypto_addresses' with strict labels?
     # The user said "in admin panel configure...". 
     # I will use `database.set_config(f"wallet_{network_key}", address)` for simplicity and reliability.
-    database.set_config(f"wallet_{network_key}", address)
+    reference_data.set_config(f"wallet_{network_key}", address)
     
     await update.message.reply_text(
         f"✅ <b>Escrow Address Set!</b>\n"
@@ -520,7 +602,7 @@ async def show_bot_escrow_addresses_command(update: Update, context: ContextType
     msg = "🔐 <b>Bot Escrow Addresses:</b>\n\n"
     
     for net in networks:
-        addr = database.get_config(f"wallet_{net}")
+        addr = reference_data.config(f"wallet_{net}")
         if not addr:
             addr = "❌ Not Set"
         else:
@@ -532,15 +614,14 @@ async def show_bot_escrow_addresses_command(update: Update, context: ContextType
 
 async def check_and_send_transaction_info(update, context, group_id):
     """Check if both parties ready and send info"""
-    deal = database.get_deal_by_group(group_id)
+    deal = deal_cache.get(group_id)
     if not deal:
         return
 
-    # deal structure: (deal_id, buyer_id, seller_id, buyer_address, seller_address, bot_address, status)
     # Indexes: 0=id, 1=buy_id, 2=sell_id, 3=buy_addr, 4=sell_addr
     
-    buyer_addr = deal[3]
-    seller_addr = deal[4]
+    buyer_addr = deal.buyer_address
+    seller_addr = deal.seller_address
     
     if buyer_addr and seller_addr:
         # Both ready! Trigger Info.
@@ -551,15 +632,15 @@ async def check_and_send_transaction_info(update, context, group_id):
             network = "Unknown"
         
         # 2. Fetch Bot Address
-        # Use new database helper that checks crypto_addresses table (Admin Panel) FIRST
-        bot_wallet = database.get_bot_wallet_address(network)
+        # Prefer a per-deal address from the pool so deposits can be attributed,
+        # then the shared wallet from crypto_addresses table (Admin Panel)
+        bot_wallet = address_pool.assign(deal.deal_id, network) or reference_data.bot_wallet_address(network)
         
         # Fallback if specific not found (e.g. USDT BEP20 not set)
         if not bot_wallet:
              bot_wallet = "NOT_SET_CONTACT_ADMIN"
         
         # 3. Get User Usernames/Links
-        # Use deal[1] (buyer_id) and deal[2] (seller_id)
         # We try to get usernames if possible, but IDs are safer.
         # User requested specific format with @Mentions if available.
         # Telethon logic isn't here, checks update.effective_user roughly.
@@ -572,13 +653,13 @@ async def check_and_send_transaction_info(update, context, group_id):
         msg = (
             "📍 <b>TRANSACTION INFORMATION</b>\n\n"
             "⚡️ <b>SELLER</b>\n"
-            f"<a href='tg://user?id={deal[2]}'>Seller</a>\n"
-            f"[{deal[2]}]\n\n"
+            f"<a href='tg://user?id={deal.seller_id}'>Seller</a>\n"
+            f"[{deal.seller_id}]\n\n"
             "⚡️ <b>BUYER</b>\n"
-            f"<a href='tg://user?id={deal[1]}'>Buyer</a>\n"
-            f"[{deal[1]}]\n\n"
+            f"<a href='tg://user?id={deal.buyer_id}'>Buyer</a>\n"
+            f"[{deal.buyer_id}]\n\n"
             "📝 <b>TRANSACTION ID</b>\n"
-            f"<code>{deal[0]}</code>\n\n"
+            f"<code>{deal.deal_id}</code>\n\n"
             "🟢 <b>ESCROW ADDRESS:</b>\n"
             f"<code>{bot_wallet}</code> [{network}]\n\n"
             "<b>TYPE /blockchain to view the escrow address</b>\n\n"
@@ -596,7 +677,14 @@ async def check_and_send_transaction_info(update, context, group_id):
             disable_web_page_preview=True
         )
         
-        # 4. REVOKE GROUP INVITE LINKS (Close the group)
+        # 4. Advance lifecycle: roles declared, then escrow address issued
+        status = deal.state
+        if status == deal_states.CREATED and deal_states.transition(deal.deal_id, status, deal_states.ROLES_SET):
+            status = deal_states.ROLES_SET
+        if status == deal_states.ROLES_SET and bot_wallet != "NOT_SET_CONTACT_ADMIN":
+            deal_states.transition(deal.deal_id, status, deal_states.AWAITING_DEPOSIT, bot_address=bot_wallet)
+        
+        # 5. REVOKE GROUP INVITE LINKS (Close the group)
         try:
             revoke_result = await telegram_group_manager.revoke_group_invites(group_id)
             if revoke_result and revoke_result.get('success'):
@@ -616,7 +704,7 @@ async def show_addresses_command(update: Update, context: ContextTypes.DEFAULT_T
         return
     
     group_id = update.effective_chat.id
-    deal = database.get_deal_by_group(group_id)
+    deal = deal_cache.get(group_id)
     
     if not deal:
         await update.message.reply_text(
@@ -625,12 +713,10 @@ async def show_addresses_command(update: Update, context: ContextTypes.DEFAULT_T
         )
         return
     
-    deal_id, buyer_id, seller_id, buyer_addr, seller_addr, bot_addr, status = deal
-    
     text = "<b>📍 Escrow Addresses:</b>\n\n"
-    text += f"<b>Buyer:</b> <code>{buyer_addr if buyer_addr else 'Not set'}</code>\n"
-    text += f"<b>Seller:</b> <code>{seller_addr if seller_addr else 'Not set'}</code>\n"
-    text += f"<b>Bot (Escrow):</b> <code>{bot_addr if bot_addr else 'Not set'}</code>\n"
+    text += f"<b>Buyer:</b> <code>{deal.buyer_address or 'Not set'}</code>\n"
+    text += f"<b>Seller:</b> <code>{deal.seller_address or 'Not set'}</code>\n"
+    text += f"<b>Bot (Escrow):</b> <code>{deal.bot_address or 'Not set'}</code>\n"
     
     await update.message.reply_text(text, parse_mode='HTML')
 
@@ -711,7 +797,7 @@ async def create_escrow_group_command(update: Update, context: ContextTypes.DEFA
     )
     
     try:
-        deal_id = str(uuid.uuid4())[:8]  # Short deal ID
+        deal_id = deal_ids.new_deal_id()
         bot_username = context.bot.username
         
         # Create group using Telethon
@@ -723,7 +809,7 @@ async def create_escrow_group_command(update: Update, context: ContextTypes.DEFA
         )
         
         # Store in database
-        database.create_deal(deal_id, buyer_id, seller_id, group_id)
+        database.create_deal(deal_id, buyer_id, seller_id, group_id, creator_id=update.effective_user.id)
         
         
         # NOTE: Welcome message is now sent automatically by track_member_updates
@@ -765,7 +851,7 @@ async def join_deal_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
     
-    deal_id = context.args[0]
+    deal_id = deal_ids.normalize(context.args[0])
     # In a real implementation, you'd look up the group_id from the deal_id
     # For now, assuming you have the group_id
     
@@ -774,6 +860,27 @@ async def join_deal_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         parse_mode='HTML'
     )
 
+@handle_errors
+async def sweep_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin command to run the deal sweeper now"""
+    if update.effective_user.id not in ADMIN_USER_IDS:
+        await update.message.reply_text(
+            "<b>🚫 This command is admin-only.</b>",
+            parse_mode='HTML'
+        )
+        return
+
+    await update.message.reply_text("🧹 <b>Sweeping stale deals...</b>", parse_mode='HTML')
+    report = await deal_sweeper.sweep()
+    await update.message.reply_text(
+        "🧹 <b>Sweep complete</b>\n\n"
+        f"Expired deals: {report['expired']}\n"
+        f"Groups reclaimed: {report['groups_reclaimed']}\n"
+        f"Deals archived: {report['archived']}\n"
+        f"Failed: {report['failed']}",
+        parse_mode='HTML'
+    )
+
 @handle_errors
 @handle_errors
 async def delete_service_messages(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -813,7 +920,7 @@ async def track_member_updates(update: Update, context: ContextTypes.DEFAULT_TYP
             # Bot joined/added to a group
             logger.info("🤖 Bot joined a new group via MY_CHAT_MEMBER! Sending welcome message...")
             try:
-                stats = database.get_statistics()
+                stats = reference_data.statistics()
                 welcome_text = messages.GROUP_WELCOME_TEXT.format(
                     total_deals=stats.get('total_deals', 5542),
                     disputes_resolved=stats.get('disputes_resolved', 158)
@@ -863,42 +970,45 @@ async def contact_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         await update.message.reply_text(messages.GROUP_ONLY_COMMAND, parse_mode='HTML')
 
+async def send_escrow_addresses(message, group_id, deal_id=None):
+    """Show the official escrow addresses (shared by /blockchain and the Blockchain button)"""
+    deal = load_deal(group_id, deal_id)
+    
+    if deal:
+        # Show ALL available addresses (as requested)
+        addresses = reference_data.crypto_addresses()
+        
+        # Format addresses
+        addr_text = ""
+        if addresses:
+            for a in addresses:
+                # a = (id, currency, address, network, label, created_at)
+                currency = a[1] or "Unknown"
+                addr = a[2]
+                net = f" ({a[3]})" if a[3] else ""
+                addr_text += f"\n🟢 <b>{currency}{net}:</b>\n<code>{addr}</code>\n"
+        else:
+             # Fallback if DB empty (should not happen due to init_db)
+             addr_text = "No addresses configured."
+
+        await message.reply_text(
+            f"<b>OFFICIAL ESCROW ADDRESSES</b>\n"
+            f"{addr_text}\n"
+            "⚠️ <b>IMPORTANT: Always verify the address before sending!</b>",
+            parse_mode='HTML',
+            disable_web_page_preview=True
+        )
+    else:
+        await message.reply_text(
+            "<b>No active deal found. Escrow address not available.</b>",
+            parse_mode='HTML'
+        )
+
 @handle_errors
 async def blockchain_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /blockchain command - group only"""
     if update.effective_chat.type in ['group', 'supergroup']:
-        group_id = update.effective_chat.id
-        deal = database.get_deal_by_group(group_id)
-        
-        if deal:
-            # Show ALL available addresses (as requested)
-            addresses = database.get_crypto_addresses()
-            
-            # Format addresses
-            addr_text = ""
-            if addresses:
-                for a in addresses:
-                    # a = (id, currency, address, network, label, created_at)
-                    currency = a[1] or "Unknown"
-                    addr = a[2]
-                    net = f" ({a[3]})" if a[3] else ""
-                    addr_text += f"\n🟢 <b>{currency}{net}:</b>\n<code>{addr}</code>\n"
-            else:
-                 # Fallback if DB empty (should not happen due to init_db)
-                 addr_text = "No addresses configured."
-
-            await update.message.reply_text(
-                f"<b>OFFICIAL ESCROW ADDRESSES</b>\n"
-                f"{addr_text}\n"
-                "⚠️ <b>IMPORTANT: Always verify the address before sending!</b>",
-                parse_mode='HTML',
-                disable_web_page_preview=True
-            )
-        else:
-            await update.message.reply_text(
-                "<b>No active deal found. Escrow address not available.</b>",
-                parse_mode='HTML'
-            )
+        await send_escrow_addresses(update.message, update.effective_chat.id)
     else:
         await update.message.reply_text(messages.GROUP_ONLY_COMMAND, parse_mode='HTML')
 
@@ -939,26 +1049,64 @@ async def refund_buyer_command(update: Update, context: ContextTypes.DEFAULT_TYP
     else:
         await update.message.reply_text("<b>This command is for use in escrow groups only.</b>", parse_mode='HTML')
 
+async def send_qr(message, group_id, deal_id=None):
+    """Send the payment QR for the deal's escrow address (shared by /qr and the Get QR button)"""
+    deal = load_deal(group_id, deal_id)
+    if not deal or not deal.bot_address:
+        await message.reply_text(
+            "📱 <b>QR Code</b>\n\n"
+            "The escrow address is issued once both Buyer and Seller have set their wallets.",
+            parse_mode='HTML'
+        )
+        return
+
+    address = deal.bot_address
+    network = deposit_watcher.deal_network(deal.buyer_address) or "Unknown"
+    # Deals have no agreed amount before funding (deals.amount is the deposit),
+    # so the QR carries the address only and the buyer enters the amount
+    key = qr_codes.cache_key(address, None, network)
+    caption = f"📱 <b>ESCROW ADDRESS</b> [{network}]\n\n<code>{address}</code>"
+
+    # Already uploaded once - resend by file_id (no render, no upload)
+    file_id = qr_codes.cached_file_id(key)
+    if file_id:
+        try:
+            await message.reply_photo(photo=file_id, caption=caption, parse_mode='HTML')
+            return
+        except Exception as e:
+            logger.warning(f"Cached QR file_id rejected, re-uploading: {e}")
+            qr_codes.forget_file_id(key)
+
+    try:
+        png = await asyncio.to_thread(qr_codes.render, address, None, network)
+    except ImportError:
+        logger.error("qrcode is not installed - cannot render QR codes")
+        await message.reply_text(caption, parse_mode='HTML')
+        return
+
+    sent = await message.reply_photo(photo=png, caption=caption, parse_mode='HTML')
+    qr_codes.remember_file_id(key, sent.photo[-1].file_id)
+
 @handle_errors
 async def qr_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /qr command - group only"""
     if update.effective_chat.type in ['group', 'supergroup']:
-        await update.message.reply_text(
-            "📱 <b>QR Code</b>\n\n"
-            "QR code generation feature coming soon!",
-            parse_mode='HTML'
-        )
+        await send_qr(update.message, update.effective_chat.id)
     else:
         await update.message.reply_text("<b>This command is for use in escrow groups only.</b>", parse_mode='HTML')
 
-@handle_errors
-async def leaderboard_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle /leaderboard command - works everywhere"""
+async def send_leaderboard(message):
+    """Reply with the leaderboard (shared by /leaderboard and the Leaderboard button)"""
     try:
-        await update.message.reply_text(messages.LEADERBOARD_TEXT, parse_mode='HTML')
+        await message.reply_text(leaderboard.get_text(), parse_mode='HTML')
     except Exception as e:
         logger.error(f"Error showing leaderboard: {e}")
-        await update.message.reply_text("<b>Error loading leaderboard. Please try again.</b>", parse_mode='HTML')
+        await message.reply_text("<b>Error loading leaderboard. Please try again.</b>", parse_mode='HTML')
+
+@handle_errors
+async def leaderboard_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /leaderboard command - works everywhere"""
+    await send_leaderboard(update.message)
 
 
 
@@ -1007,7 +1155,7 @@ async def real_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     user = update.message.reply_to_message.from_user
-    admin_username = database.get_config("admin_username") or "MiddleCryptoSupport"
+    admin_username = reference_data.config("admin_username") or "MiddleCryptoSupport"
     
     # Check if user is the real admin
     is_real_admin = (
@@ -1035,17 +1183,14 @@ async def real_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def whatisescrow_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(f"<b>{messages.TEXT_WHAT_IS_ESCROW}</b>", parse_mode='HTML')
 
+async def send_video(message):
+    """Send the tutorial video (shared by /video and the Video Tutorial button)"""
+    if not await reply_with_video(message, f"<b>{messages.TEXT_VIDEO_CAPTION}</b>"):
+        await message.reply_text("<b>Video not found on server.</b>", parse_mode='HTML')
+
 @handle_errors
 async def video_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    import os
-    if os.path.exists("video.mp4"):
-        await update.message.reply_video(
-            video=open("video.mp4", "rb"),
-            caption=f"<b>{messages.TEXT_VIDEO_CAPTION}</b>",
-            parse_mode='HTML'
-        )
-    else:
-        await update.message.reply_text("<b>Video not found on server.</b>", parse_mode='HTML')
+    await send_video(update.message)
 
 @handle_errors
 async def terms_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1087,14 +1232,127 @@ async def setpin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         parse_mode='HTML'
     )
 
+async def settle_deal(message, user, group_id, target, deal_id=None):
+    """
+    Release funds to the seller or refund the buyer (shared by commands and buttons).
+    The deal waits in release_pending/refund_pending until an admin sends the
+    payout and confirms it with /paid.
+    """
+    deal = load_deal(group_id, deal_id)
+    status = deal.state if deal else None
+
+    if status in deal_states.PAYOUT_STATES:
+        await message.reply_text(messages.PAYOUT_PENDING_TEXT, parse_mode='HTML')
+        return
+    if status not in (deal_states.FUNDED, deal_states.DISPUTED):
+        await message.reply_text(messages.NO_BALANCE_TEXT, parse_mode='HTML')
+        return
+
+    is_admin = user.id in ADMIN_USER_IDS
+    if status == deal_states.DISPUTED and not is_admin:
+        await message.reply_text(messages.DEAL_DISPUTED_TEXT, parse_mode='HTML')
+        return
+
+    # /pay_seller is the buyer's decision, /refund_buyer is the seller's
+    if target == deal_states.RELEASED:
+        allowed = is_admin or str(deal.buyer_id) == str(user.id)
+        denied_text, done_text = messages.ONLY_BUYER_RELEASES_TEXT, messages.RELEASE_REQUESTED_TEXT
+        pending, action, address = deal_states.RELEASE_PENDING, "Release to Seller", deal.seller_address
+    else:
+        allowed = is_admin or str(deal.seller_id) == str(user.id)
+        denied_text, done_text = messages.ONLY_SELLER_REFUNDS_TEXT, messages.REFUND_REQUESTED_TEXT
+        pending, action, address = deal_states.REFUND_PENDING, "Refund to Buyer", deal.buyer_address
+
+    if not allowed:
+        await message.reply_text(denied_text, parse_mode='HTML')
+        return
+
+    if not deal_states.transition(deal.deal_id, status, pending):
+        await message.reply_text(messages.DEAL_STATE_CHANGED_TEXT, parse_mode='HTML')
+        return
+
+    await message.reply_text(done_text, parse_mode='HTML')
+    await notify_admins(message.get_bot(), messages.PAYOUT_REQUEST_ADMIN_TEXT.format(
+        action=action,
+        deal_id=deal.deal_id,
+        amount=format_escrow_balance(deal),
+        address=address or "not set"
+    ))
+
+async def notify_admins(bot, text):
+    """Message every bot admin (one unreachable admin does not stop the rest)"""
+    for admin_id in ADMIN_USER_IDS:
+        try:
+            await bot.send_message(admin_id, text, parse_mode='HTML')
+        except Exception as e:
+            logger.error(f"Error notifying admin {admin_id}: {e}")
+
 @handle_errors
-async def pay_seller_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle /pay_seller command"""
-    if update.effective_chat.type in ['group', 'supergroup']:
+async def paid_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin command confirming a requested payout was sent: /paid <deal_id>"""
+    if update.effective_user.id not in ADMIN_USER_IDS:
+        await update.message.reply_text(
+            "<b>🚫 This command is admin-only.</b>",
+            parse_mode='HTML'
+        )
+        return
+
+    if not context.args:
+        await update.message.reply_text("<b>Usage: /paid DEAL_ID</b>", parse_mode='HTML')
+        return
+
+    deal = deal_cache.get_by_id(context.args[0])
+    if not deal or deal.state not in deal_states.PAYOUT_STATES:
         await update.message.reply_text(
-            "🚫 <b>NO BALANCE available in escrow address. Seller should NOT PROVIDE the buyer with product/service before balance is visible. Type /balance after 1 confirmation.</b>",
+            f"<b>No payout is waiting for deal #{context.args[0]}.</b>",
+            parse_mode='HTML'
+        )
+        return
+
+    final = deal_states.PAYOUT_STATES[deal.state]
+    if not deal_states.transition(deal.deal_id, deal.state, final):
+        await update.message.reply_text(messages.DEAL_STATE_CHANGED_TEXT, parse_mode='HTML')
+        return
+
+    await update.message.reply_text(f"✅ <b>Deal #{deal.deal_id} marked {final}.</b>", parse_mode='HTML')
+    if deal.group_id:
+        text = messages.RELEASE_PAID_TEXT if final == deal_states.RELEASED else messages.REFUND_PAID_TEXT
+        await context.bot.send_message(deal.group_id, text, parse_mode='HTML')
+
+async def may_reset_roles(bot, deal, user, group_id):
+    """The deal's buyer or seller, a bot admin, or an admin of the group"""
+    if user.id in ADMIN_USER_IDS or str(user.id) in (str(deal.buyer_id), str(deal.seller_id)):
+        return True
+    try:
+        member = await bot.get_chat_member(group_id, user.id)
+        return member.status in ('administrator', 'creator')
+    except Exception as e:
+        logger.error(f"Error checking admin status of {user.id} in {group_id}: {e}")
+        return False
+
+async def reset_deal_roles(message, user, group_id, deal_id=None):
+    """Clear buyer/seller on a deal that has not been funded yet"""
+    deal = load_deal(group_id, deal_id)
+    if not deal:
+        await message.reply_text("<b>No active deal found in this group.</b>", parse_mode='HTML')
+    elif not await may_reset_roles(message.get_bot(), deal, user, group_id):
+        await message.reply_text(messages.ONLY_PARTIES_RESET_TEXT, parse_mode='HTML')
+    elif deal.roles_locked:
+        await message.reply_text("🔒 <b>Roles cannot be reset after the deal is funded.</b>", parse_mode='HTML')
+    elif deal_states.reset_roles(deal.deal_id):
+        await message.reply_text(
+            "🔄 <b>Roles have been reset.</b>\n\n"
+            "Use /seller or /buyer to register again.",
             parse_mode='HTML'
         )
+    else:
+        await message.reply_text(messages.DEAL_STATE_CHANGED_TEXT, parse_mode='HTML')
+
+@handle_errors
+async def pay_seller_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /pay_seller command"""
+    if update.effective_chat.type in ['group', 'supergroup']:
+        await settle_deal(update.message, update.effective_user, update.effective_chat.id, deal_states.RELEASED)
     else:
         await update.message.reply_text(messages.GROUP_ONLY_COMMAND, parse_mode='HTML')
 
@@ -1102,246 +1360,194 @@ async def pay_seller_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
 async def refund_buyer_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /refund_buyer command"""
     if update.effective_chat.type in ['group', 'supergroup']:
-        await update.message.reply_text(
-            "🚫 <b>NO BALANCE available in escrow address. Seller should NOT PROVIDE the buyer with product/service before balance is visible. Type /balance after 1 confirmation.</b>",
-            parse_mode='HTML'
-        )
+        await settle_deal(update.message, update.effective_user, update.effective_chat.id, deal_states.REFUNDED)
     else:
         await update.message.reply_text(messages.GROUP_ONLY_COMMAND, parse_mode='HTML')
 
+@handle_errors
+async def dispute_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /dispute command - buyer or seller escalates a funded deal"""
+    if update.effective_chat.type not in ['group', 'supergroup']:
+        await update.message.reply_text(messages.GROUP_ONLY_COMMAND, parse_mode='HTML')
+        return
+
+    deal = deal_cache.get(update.effective_chat.id)
+    if not deal or deal.state != deal_states.FUNDED:
+        await update.message.reply_text(messages.NO_BALANCE_TEXT, parse_mode='HTML')
+        return
+
+    user_id = str(update.effective_user.id)
+    if user_id not in (str(deal.buyer_id), str(deal.seller_id)):
+        await update.message.reply_text("🚫 <b>Only the Buyer or Seller can open a dispute.</b>", parse_mode='HTML')
+        return
+
+    if deal_states.transition(deal.deal_id, deal_states.FUNDED, deal_states.DISPUTED):
+        await update.message.reply_text(messages.DISPUTE_OPENED_TEXT, parse_mode='HTML')
+    else:
+        await update.message.reply_text(messages.DEAL_STATE_CHANGED_TEXT, parse_mode='HTML')
+
+def format_escrow_balance(deal):
+    """Balance line for the escrow wallet, from the deposit watcher's cache"""
+    network = "USDT (TRC20)"
+    amount = 0.0
+
+    if deal:
+        # Deposits come in on the buyer's network
+        network = deposit_watcher.deal_network(deal.buyer_address) or network
+        deposit = deposit_watcher.watcher.cached(deal.bot_address) if deal.bot_address else None
+        if deposit:
+            amount = deposit.amount
+
+    usd = price_oracle.oracle.to_usd(amount, network)
+    usd_display = f"${usd:,.2f}" if usd is not None else "$?"
+
+    if network in ("BTC", "LTC"):
+        return f"{amount:.8f} {network} [{usd_display}]"
+    return f"{amount:.1f} {network} [{usd_display}]"
+
+async def send_balance(message, group_id, deal_id=None):
+    """Reply with the escrow wallet balance (shared by /balance and the Balance button)"""
+    deal = load_deal(group_id, deal_id)
+    await message.reply_text(
+        "📍 <b>ESCROW WALLET</b>\n\n"
+        "💬 Wait for the balance to show up here, then continue with the deal. The funds will show up after 1 blockchain confirmation.\n\n"
+        f"💰 <b>BALANCE:</b> {format_escrow_balance(deal)}\n\n"
+        "💡 <b>Type /blockchain for escrow addresses</b>",
+        parse_mode='HTML'
+    )
+
 @handle_errors
 async def balance_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /balance command"""
     if update.effective_chat.type in ['group', 'supergroup']:
-        group_id = update.effective_chat.id
-        deal = database.get_deal_by_group(group_id)
-        
-        # Default currency text
-        currency_display = "0.0 USDT (TRC20) [$0.0]"
-        
-        if deal:
-            buyer_addr = deal[3]
-            is_valid, network = validators.validate_crypto_address(buyer_addr)
-            
-            if network == "BTC":
-                currency_display = "0.00000000 BTC [$0.0]"
-            elif network == "LTC":
-                currency_display = "0.00000000 LTC [$0.0]"
-            elif network == "USDT (TRC20)":
-                currency_display = "0.0 USDT (TRC20) [$0.0]"
-            elif network == "USDT (BEP20)":
-                currency_display = "0.0 USDT (BEP20) [$0.0]"
-            elif network == "USDT (ERC20)":
-                currency_display = "0.0 USDT (ERC20) [$0.0]"
-        
-        await update.message.reply_text(
-            "📍 <b>ESCROW WALLET</b>\n\n"
-            "💬 Wait for the balance to show up here, then continue with the deal. The funds will show up after 1 blockchain confirmation.\n\n"
-            f"💰 <b>BALANCE:</b> {currency_display}\n\n"
-            "💡 <b>Type /blockchain for escrow addresses</b>",
-            parse_mode='HTML'
-        )
+        await send_balance(update.message, update.effective_chat.id)
     else:
         await update.message.reply_text(messages.GROUP_ONLY_COMMAND, parse_mode='HTML')
 # ====================
 # CALLBACK HANDLERS
 # ====================
 
-@handle_errors
-async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle inline button clicks"""
-    query = update.callback_query
-    await query.answer()
-    
-    if query.data == 'what_is_escrow':
-        await query.message.reply_text(f"<b>{messages.TEXT_WHAT_IS_ESCROW}</b>", parse_mode='HTML')
-    elif query.data == 'instructions':
-        await query.message.reply_text(f"<b>{messages.TEXT_INSTRUCTIONS}</b>", parse_mode='HTML')
-    elif query.data == 'terms':
-        await query.message.reply_text(f"<b>{messages.TEXT_TERMS}</b>", parse_mode='HTML')
-    elif query.data == 'video':
-        import os
-        if os.path.exists("video.mp4"):
-            await query.message.reply_video(
-                video=open("video.mp4", "rb"),
-                caption=f"<b>{messages.TEXT_VIDEO_CAPTION}</b>",
-                parse_mode='HTML'
-            )
-        else:
-            await query.message.reply_text("<b>Video not found.</b>", parse_mode='HTML')
-    
-    
-    # Group menu button handlers - check if in group
-    elif query.data == 'pay_seller':
-        if query.message.chat.type in ['group', 'supergroup']:
-            await query.message.reply_text(
-                "� <b>NO BALANCE available in escrow address. Seller should NOT PROVIDE the buyer with product/service before balance is visible. Type /balance after 1 confirmation.</b>",
-                parse_mode='HTML'
-            )
-        else:
-            await query.message.reply_text("<b>This command is for use in escrow groups only.</b>", parse_mode='HTML')
-    
-    elif query.data == 'refund_buyer':
-        if query.message.chat.type in ['group', 'supergroup']:
-            await query.message.reply_text(
-                "� <b>NO BALANCE available in escrow address. Seller should NOT PROVIDE the buyer with product/service before balance is visible. Type /balance after 1 confirmation.</b>",
-                parse_mode='HTML'
-            )
-        else:
-            await query.message.reply_text("<b>This command is for use in escrow groups only.</b>", parse_mode='HTML')
+def deal_group_id(deal_id):
+    """Group a deal belongs to (None for unknown deals)"""
+    deal = deal_cache.get_by_id(deal_id)
+    return deal.group_id if deal else None
+
+router = callback_router.CallbackRouter(deal_group=deal_group_id)
+
+@router.register('what_is_escrow')
+async def what_is_escrow_callback(query, context, payload):
+    await query.message.reply_text(f"<b>{messages.TEXT_WHAT_IS_ESCROW}</b>", parse_mode='HTML')
+
+@router.register('instructions')
+async def instructions_callback(query, context, payload):
+    await query.message.reply_text(f"<b>{messages.TEXT_INSTRUCTIONS}</b>", parse_mode='HTML')
+
+@router.register('terms')
+async def terms_callback(query, context, payload):
+    await query.message.reply_text(f"<b>{messages.TEXT_TERMS}</b>", parse_mode='HTML')
+
+@router.register('video')
+async def video_callback(query, context, payload):
+    await send_video(query.message)
+
+# Group menu buttons
+@router.register('pay_seller', 'refund_buyer', group_only=True)
+async def settle_callback(query, context, payload):
+    target = deal_states.RELEASED if payload.action == 'pay_seller' else deal_states.REFUNDED
+    await settle_deal(query.message, query.from_user, query.message.chat.id, target, payload.deal_id)
+
+@router.register('reset_roles', group_only=True)
+async def reset_roles_callback(query, context, payload):
+    await reset_deal_roles(query.message, query.from_user, query.message.chat.id, payload.deal_id)
+
+@router.register('balance', group_only=True)
+async def balance_callback(query, context, payload):
+    await send_balance(query.message, query.message.chat.id, payload.deal_id)
+
+@router.register('blockchain', group_only=True)
+async def blockchain_callback(query, context, payload):
+    await send_escrow_addresses(query.message, query.message.chat.id, payload.deal_id)
+
+@router.register('get_qr', group_only=True)
+async def qr_callback(query, context, payload):
+    await send_qr(query.message, query.message.chat.id, payload.deal_id)
+
+@router.register('contact', group_only=True)
+async def contact_callback(query, context, payload):
+    await query.message.reply_text(f"<b>{messages.TEXT_CONTACT_ADMIN}</b>", parse_mode='HTML')
+
+@router.register('leaderboard')
+async def leaderboard_callback(query, context, payload):
+    # Leaderboard works in both private and group
+    await send_leaderboard(query.message)
+
+@router.register('create_group')
+async def create_group_callback(query, context, payload):
+    """User clicked Create Escrow Group button"""
+    user_id = query.from_user.id
+    user_name = query.from_user.first_name or "User"
+    
+    # Send "Creating..." message
+    creating_msg = await query.message.reply_text(
+        "🏗️ <b>Creating Escrow Group. Please Wait...</b>",
+        parse_mode='HTML'
+    )
     
-    elif query.data == 'reset_roles':
-        if query.message.chat.type in ['group', 'supergroup']:
-            await query.message.reply_text(
-                "🔄 <b>Roles have been reset.</b>\n\n"
-                "Use /seller or /buyer to register again.",
-                parse_mode='HTML'
+    try:
+        # Time-ordered deal ID (Format: 02M87-9V000)
+        deal_id = deal_ids.new_deal_id()
+        
+        # For demo/testing, we'll create a group with the user as both buyer and seller
+        buyer_id = user_id
+        seller_id = 0  # Use 0 for seller (to avoid constraint error if buyer==seller is not allowed)
+        bot_username = context.bot.username
+        
+        # Create group via Telethon and store the deal (journaled for restarts)
+        try:
+            result = await deal_groups.create_deal_group(
+                deal_id, buyer_id, seller_id, bot_username, query.message.chat.id
             )
-        else:
-            await query.message.reply_text("<b>This command is for use in escrow groups only.</b>", parse_mode='HTML')
-    
-    elif query.data == 'balance':
-        if query.message.chat.type in ['group', 'supergroup']:
-            group_id = query.message.chat.id
-            deal = database.get_deal_by_group(group_id)
             
-            # Default currency text
-            currency_display = "0.0 USDT (TRC20) [$0.0]"
-            
-            if deal:
-                # Determine relevant currency from deal (buyer address)
-                # deal[3] is buyer_address
-                buyer_addr = deal[3]
-                is_valid, network = validators.validate_crypto_address(buyer_addr)
+            if result['success']:
+                # A double tap gets the group of the creation already running
+                deal_id = result['deal_id']
+                group_id = result['group_id']
+                invite_link = result['invite_link']
+            else:
+                raise Exception(result.get('error', 'Unknown error'))
                 
-                if network == "BTC":
-                    currency_display = "0.00000000 BTC [$0.0]"
-                elif network == "LTC":
-                    currency_display = "0.00000000 LTC [$0.0]"
-                elif network == "USDT (TRC20)":
-                    currency_display = "0.0 USDT (TRC20) [$0.0]"
-                elif network == "USDT (BEP20)":
-                    currency_display = "0.0 USDT (BEP20) [$0.0]"
-                elif network == "USDT (ERC20)":
-                    currency_display = "0.0 USDT (ERC20) [$0.0]"
-            
-            await query.message.reply_text(
-                "📍 <b>ESCROW WALLET</b>\n\n"
-                "💬 Wait for the balance to show up here, then continue with the deal. The funds will show up after 1 blockchain confirmation.\n\n"
-                f"💰 <b>BALANCE:</b> {currency_display}\n\n"
-                "💡 <b>Type /blockchain for escrow addresses</b>",
-                parse_mode='HTML'
-            )
-        else:
-            await query.message.reply_text("<b>This command is for use in escrow groups only.</b>", parse_mode='HTML')
-    
-    elif query.data == 'blockchain':
-        if query.message.chat.type in ['group', 'supergroup']:
-            await query.message.reply_text(
-                "🌐 <b>Blockchain Explorer</b>\n\n"
-                "View transaction on blockchain:\n"
-                "https://blockchain.info",
-                parse_mode='HTML'
-            )
-        else:
-            await query.message.reply_text("<b>This command is for use in escrow groups only.</b>", parse_mode='HTML')
-    
-    elif query.data == 'get_qr':
-        if query.message.chat.type in ['group', 'supergroup']:
-            await query.message.reply_text(
-                "📱 <b>QR Code</b>\n\n"
-                "QR code generation feature coming soon!",
-                parse_mode='HTML'
-            )
-        else:
-            await query.message.reply_text("<b>This command is for use in escrow groups only.</b>", parse_mode='HTML')
-    
-    elif query.data == 'contact':
-        if query.message.chat.type in ['group', 'supergroup']:
-            await query.message.reply_text(f"<b>{messages.TEXT_CONTACT_ADMIN}</b>", parse_mode='HTML')
-        else:
-            await query.message.reply_text("<b>This command is for use in escrow groups only.</b>", parse_mode='HTML')
-    
-    elif query.data == 'create_group':
-        # User clicked Create Escrow Group button
-        user_id = query.from_user.id
-        user_name = query.from_user.first_name or "User"
+        except Exception as e:
+            logger.error(f"Error creating group via button: {e}")
+            raise Exception(f"Failed to create group: {str(e)}")
         
-        # Send "Creating..." message
-        creating_msg = await query.message.reply_text(
-            "🏗️ <b>Creating Escrow Group. Please Wait...</b>",
+        # NOTE: Welcome message is now sent automatically by track_member_updates
+        # when the bot joins the group. We don't need to send it here.
+        
+        # Send success message with invite link
+        
+        # Send success message with invite link
+        await creating_msg.edit_text(
+            f"✅ <b>Created Escrow Group #{deal_id}</b>\n\n"
+            f"<b>Group Link:</b> {invite_link}\n\n"
+            f"Now Join this escrow group & Forward this message to buyer/seller.\n\n"
+            f"Enjoy Safe Escrow 🤝",
             parse_mode='HTML'
         )
         
-        try:
-            import uuid
-            import requests
-            import string
-            import random
-            
-            # Generate a unique deal ID (Format: ABCDE-12345-FGHIJ)
-            def generate_segment(length=5, chars=string.ascii_uppercase + string.digits):
-                return ''.join(random.choices(chars, k=length))
-            
-            deal_id = f"{generate_segment()}-{generate_segment()}-{generate_segment()}"
-            
-            # For demo/testing, we'll create a group with the user as both buyer and seller
-            buyer_id = user_id
-            seller_id = 0  # Use 0 for seller (to avoid constraint error if buyer==seller is not allowed)
-            bot_username = context.bot.username
-            
-            # Call Telethon microservice to create group
-            # Call Telethon directly to create group (No HTTP request needed)
-            try:
-                result = await telegram_group_manager.create_escrow_group(
-                    deal_id=deal_id,
-                    bot_username=bot_username
-                )
-                
-                if result['success']:
-                    group_id = result['group_id']
-                    invite_link = result['invite_link']
-                else:
-                    raise Exception(result.get('error', 'Unknown error'))
-                    
-            except Exception as e:
-                logger.error(f"Error creating group via button: {e}")
-                raise Exception(f"Failed to create group: {str(e)}")
-            
-            # Store in database
-            database.create_deal(deal_id, buyer_id, seller_id, group_id)
-            
-            # NOTE: Welcome message is now sent automatically by track_member_updates
-            # when the bot joins the group. We don't need to send it here.
-            
-            # Send success message with invite link
-            
-            # Send success message with invite link
-            await creating_msg.edit_text(
-                f"✅ <b>Created Escrow Group #{deal_id}</b>\n\n"
-                f"<b>Group Link:</b> {invite_link}\n\n"
-                f"Now Join this escrow group & Forward this message to buyer/seller.\n\n"
-                f"Enjoy Safe Escrow 🤝",
-                parse_mode='HTML'
-            )
-            
-        except Exception as e:
-            logger.error(f"Error creating group from button: {e}")
-            import traceback
-            traceback.print_exc()
-            await creating_msg.edit_text(
-                f"❌ <b>Error creating group:</b> {str(e)}\n\n"
-                f"Please try again or contact support.",
-                parse_mode='HTML'
-            )
-    
-    elif query.data == 'leaderboard':
-        # Leaderboard works in both private and group
-        try:
-            await query.message.reply_text(messages.LEADERBOARD_TEXT, parse_mode='HTML')
-        except Exception as e:
-            logger.error(f"Error showing leaderboard: {e}")
-            await query.message.reply_text("<b>Error loading leaderboard. Please try again.</b>", parse_mode='HTML')
+    except Exception as e:
+        logger.error(f"Error creating group from button: {e}")
+        import traceback
+        traceback.print_exc()
+        await creating_msg.edit_text(
+            f"❌ <b>Error creating group:</b> {str(e)}\n\n"
+            f"Please try again or contact support.",
+            parse_mode='HTML'
+        )
+
+@handle_errors
+async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle inline button clicks"""
+    await router.dispatch(update, context)
 
 
 # ====================
@@ -1354,7 +1560,13 @@ def main():
     database.init_db()
     
     # Create application
-    app = ApplicationBuilder().token(BOT_TOKEN).post_init(post_init).build()
+    app = (
+        ApplicationBuilder()
+        .token(BOT_TOKEN)
+        .application_class(lifecycle.DrainingApplication)
+        .post_init(post_init)
+        .build()
+    )
     
     # Add handlers
     app.add_handler(CommandHandler("start", start))
@@ -1376,6 +1588,7 @@ def main():
     app.add_handler(CommandHandler("create", create_command))  # NEW: Simple /create command
     app.add_handler(CommandHandler("creategroup", create_escrow_group_command))
     app.add_handler(CommandHandler("joindeal", join_deal_command))
+    app.add_handler(CommandHandler("sweep", sweep_command))
     
     # Other commands
     app.add_handler(CommandHandler("whatisescrow", whatisescrow_command))
@@ -1390,6 +1603,8 @@ def main():
     app.add_handler(CommandHandler("pay_seller", pay_seller_command))
     app.add_handler(CommandHandler("refundbuyer", refund_buyer_command))
     app.add_handler(CommandHandler("refund_buyer", refund_buyer_command))
+    app.add_handler(CommandHandler("dispute", dispute_command))
+    app.add_handler(CommandHandler("paid", paid_command))
     app.add_handler(CommandHandler("balance", balance_command))
     app.add_handler(CommandHandler("setpin", setpin_command))
     
@@ -1412,6 +1627,12 @@ def main():
     app.add_handler(MessageHandler(filters.StatusUpdate.NEW_CHAT_MEMBERS | filters.StatusUpdate.LEFT_CHAT_MEMBER, delete_service_messages))
     
     # Start bot
+    if cluster.MULTI:
+        # Webhook ingress, chats routed to workers by id (no Conflict possible)
+        logger.info(f"Bot started as cluster worker {cluster.CLUSTER_WORKER_INDEX} ({cluster.INSTANCE_ID})")
+        cluster.run_worker(app)
+        return
+
     # Start bot with conflict handling
     logger.info("Bot started! (Version: Auto-Group-Creation)")
     
@@ -1424,7 +1645,8 @@ def main():
     for i in range(max_retries):
         try:
             # Drop pending updates to flush old queue
-            app.run_polling(drop_pending_updates=True, allowed_updates=Update.ALL_TYPES)
+            # stop_signals=None: lifecycle handles SIGTERM/SIGINT (drain before stopping)
+            app.run_polling(drop_pending_updates=True, allowed_updates=Update.ALL_TYPES, stop_signals=None)
             break
         except Conflict:
             logger.warning(f"⚠️ Conflict error detected (Attempt {i+1}/{max_retries}). Another instance is running.")
@@ -0,0 +1,82 @@
+"""
+Callback Router
+Dispatches inline button presses through a registry instead of an if/elif chain.
+Callback data is either "<action>" or "deal:<deal_id>:<action>" (buttons tied to a deal).
+"""
+import logging
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+DEAL_PREFIX = 'deal'
+GROUP_ONLY_TEXT = "<b>This command is for use in escrow groups only.</b>"
+OTHER_DEAL_TEXT = "This button belongs to a different escrow group."
+
+# Parsed callback payload
+CallbackData = namedtuple('CallbackData', ['action', 'deal_id'])
+
+
+def parse(data):
+    """'deal:ABC12:balance' -> ('balance', 'ABC12'), 'terms' -> ('terms', None)"""
+    if data and data.startswith(DEAL_PREFIX + ':'):
+        parts = data.split(':', 2)
+        if len(parts) == 3:
+            return CallbackData(parts[2], parts[1])
+    return CallbackData(data, None)
+
+
+def _chat_key(chat_id):
+    """Deals may store a supergroup id with or without its -100 prefix"""
+    text = str(chat_id)
+    return text[4:] if text.startswith('-100') else text.lstrip('-')
+
+
+def deal_callback(deal_id, action):
+    """Callback data for a button bound to a specific deal (Telegram allows 64 bytes)"""
+    data = f"{DEAL_PREFIX}:{deal_id}:{action}"
+    return data if len(data.encode()) <= 64 else action
+
+
+class CallbackRouter:
+    """
+    Action name -> handler registry; handlers get (query, context, payload).
+    deal_group(deal_id) returns the group a deal belongs to, so a button carrying
+    a deal id is only honoured in that deal's own group.
+    """
+
+    def __init__(self, deal_group=None):
+        self._handlers = {}
+        self.deal_group = deal_group
+
+    def register(self, *actions, group_only=False):
+        """Decorator registering a handler for one or more actions"""
+        def decorator(func):
+            for action in actions:
+                self._handlers[action] = (func, group_only)
+            return func
+        return decorator
+
+    async def dispatch(self, update, context):
+        """CallbackQueryHandler entry point"""
+        query = update.callback_query
+        payload = parse(query.data)
+
+        if payload.deal_id and self.deal_group:
+            group_id = self.deal_group(payload.deal_id)
+            if group_id is None or _chat_key(group_id) != _chat_key(query.message.chat.id):
+                logger.warning(f"Deal {payload.deal_id} button pressed outside its group in {query.message.chat.id}")
+                await query.answer(OTHER_DEAL_TEXT, show_alert=True)
+                return
+
+        await query.answer()
+        entry = self._handlers.get(payload.action)
+        if not entry:
+            logger.warning(f"No callback handler for {query.data!r}")
+            return
+
+        func, group_only = entry
+        if group_only and query.message.chat.type not in ['group', 'supergroup']:
+            await query.message.reply_text(GROUP_ONLY_TEXT, parse_mode='HTML')
+            return
+
+        await func(query, context, payload)
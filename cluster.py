@@ -0,0 +1,413 @@
+"""
+Cluster Coordination
+Runs the bot as several instances: each chat is routed to one worker, single-writer
+resources are guarded by leases and cache invalidations are broadcast between workers
+"""
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import asynccontextmanager
+import requests
+import database
+import deal_states
+import lifecycle
+from config import (
+    CLUSTER_MODE, CLUSTER_WORKERS, CLUSTER_WORKER_INDEX, CLUSTER_PEERS, CLUSTER_SECRET,
+    WEBHOOK_URL, CLUSTER_LEASE_SECONDS, CLUSTER_EVENT_POLL_SECONDS
+)
+
+logger = logging.getLogger(__name__)
+
+MULTI = CLUSTER_MODE == 'multi'
+INSTANCE_ID = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+class LeaseUnavailable(Exception):
+    """Another instance kept the lease for longer than we were willing to wait"""
+
+
+# ====================
+# ROUTING
+# ====================
+
+# Update fields that carry the chat an update belongs to
+_CHAT_FIELDS = [
+    'message', 'edited_message', 'channel_post', 'edited_channel_post',
+    'my_chat_member', 'chat_member', 'chat_join_request'
+]
+_USER_FIELDS = ['inline_query', 'chosen_inline_result', 'shipping_query', 'pre_checkout_query', 'poll_answer']
+
+
+def worker_for(chat_id, workers=CLUSTER_WORKERS):
+    """
+    Rendezvous hashing: a chat always lands on the same worker,
+    and changing the worker count only moves ~1/N of the chats
+    """
+    if workers <= 1 or chat_id is None:
+        return 0
+    return max(range(workers), key=lambda w: hashlib.sha1(f"{w}:{chat_id}".encode()).digest())
+
+
+def update_chat_id(data):
+    """Chat id of a raw update dict (None for updates not tied to a chat)"""
+    for field in _CHAT_FIELDS:
+        if field in data:
+            return (data[field].get('chat') or {}).get('id')
+    if 'callback_query' in data:
+        query = data['callback_query']
+        message = query.get('message')
+        return message['chat']['id'] if message else query['from']['id']
+    for field in _USER_FIELDS:
+        if field in data:
+            return (data[field].get('from') or data[field].get('user') or {}).get('id')
+    return None
+
+
+def runs_singletons():
+    """Background loops (sweeper, deposit watcher, pool refill) run on worker 0 only"""
+    return not MULTI or CLUSTER_WORKER_INDEX == 0
+
+
+# ====================
+# BACKENDS
+# ====================
+
+class LocalBackend:
+    """
+    In-process stand-in for the shared store, for single-node runs and tests.
+    Several Coordinators sharing one LocalBackend behave like separate workers.
+    """
+
+    def __init__(self, max_events=1000):
+        self._lock = threading.Lock()
+        self._leases = {}  # name -> (holder, expires_at)
+        self._events = deque(maxlen=max_events)
+        self._next_id = 1
+
+    def try_acquire(self, name, holder, ttl):
+        with self._lock:
+            now = time.time()
+            current = self._leases.get(name)
+            if current and current[0] != holder and current[1] > now:
+                return False
+            self._leases[name] = (holder, now + ttl)
+            return True
+
+    def release(self, name, holder):
+        with self._lock:
+            if self._leases.get(name, (None,))[0] == holder:
+                del self._leases[name]
+
+    def publish(self, channel, payload, origin):
+        with self._lock:
+            self._events.append({'id': self._next_id, 'channel': channel, 'payload': payload, 'origin': origin})
+            self._next_id += 1
+
+    def fetch_events(self, after_id):
+        with self._lock:
+            return [e for e in self._events if e['id'] > after_id]
+
+    def latest_event_id(self):
+        with self._lock:
+            return self._next_id - 1
+
+
+class SupabaseBackend:
+    """Leases and events in Supabase (cluster_leases / cluster_events tables)"""
+
+    def try_acquire(self, name, holder, ttl):
+        return database.acquire_lease(name, holder, ttl)
+
+    def release(self, name, holder):
+        database.release_lease(name, holder)
+
+    def publish(self, channel, payload, origin):
+        database.publish_cluster_event(channel, payload, origin)
+
+    def fetch_events(self, after_id):
+        return database.get_cluster_events(after_id) or []
+
+    def latest_event_id(self):
+        return database.get_latest_cluster_event_id()
+
+
+# ====================
+# COORDINATOR
+# ====================
+
+class Coordinator:
+    """Leases and broadcasts for one bot instance"""
+
+    def __init__(self, backend, instance_id=INSTANCE_ID):
+        self.backend = backend
+        self.instance_id = instance_id
+        self._subscribers = {}   # channel -> [callback(payload)]
+        self._local_locks = {}   # lease name -> asyncio.Lock (serialises callers inside this instance)
+        self._last_event_id = None
+
+    @asynccontextmanager
+    async def lease(self, name, ttl=CLUSTER_LEASE_SECONDS, wait=None):
+        """Hold `name` exclusively across all instances; raises LeaseUnavailable after `wait` seconds"""
+        wait = ttl if wait is None else wait
+        deadline = time.monotonic() + wait
+        lock = self._local_locks.setdefault(name, asyncio.Lock())
+        try:
+            await asyncio.wait_for(lock.acquire(), wait)
+        except asyncio.TimeoutError:
+            raise LeaseUnavailable(f"'{name}' is busy, please try again shortly")
+
+        try:
+            while not await asyncio.to_thread(self.backend.try_acquire, name, self.instance_id, ttl):
+                if time.monotonic() >= deadline:
+                    raise LeaseUnavailable(f"'{name}' is busy on another instance, please try again shortly")
+                await asyncio.sleep(0.5)
+            renewer = asyncio.create_task(self._renew(name, ttl))
+            try:
+                yield
+            finally:
+                renewer.cancel()
+                await asyncio.to_thread(self.backend.release, name, self.instance_id)
+        finally:
+            lock.release()
+
+    async def _renew(self, name, ttl):
+        """Extend a held lease every ttl/3 so a long-running holder does not lose it to expiry"""
+        while True:
+            await asyncio.sleep(ttl / 3)
+            try:
+                if not await asyncio.to_thread(self.backend.try_acquire, name, self.instance_id, ttl):
+                    logger.error(f"Lease '{name}' was taken over while still held")
+                    return
+            except Exception as e:
+                logger.error(f"Error renewing lease '{name}': {e}")
+
+    def subscribe(self, channel):
+        """Decorator: run fn(payload) when another instance broadcasts on `channel`"""
+        def decorator(func):
+            self._subscribers.setdefault(channel, []).append(func)
+            return func
+        return decorator
+
+    def broadcast(self, channel, payload):
+        """Tell the other instances about a change (this instance is not notified)"""
+        try:
+            self.backend.publish(channel, payload, self.instance_id)
+        except Exception as e:
+            logger.error(f"Error broadcasting on {channel}: {e}")
+
+    def _deliver(self, event):
+        for func in self._subscribers.get(event['channel'], []):
+            try:
+                func(event['payload'])
+            except Exception as e:
+                logger.error(f"Cluster subscriber {func.__name__} failed: {e}")
+
+    async def poll_once(self):
+        """Apply events other instances published since the last poll; returns how many"""
+        if self._last_event_id is None:
+            # Start at the head - earlier events describe state we load fresh anyway
+            self._last_event_id = await asyncio.to_thread(self.backend.latest_event_id)
+            return 0
+
+        events = await asyncio.to_thread(self.backend.fetch_events, self._last_event_id)
+        for event in events:
+            self._last_event_id = event['id']
+            if event['origin'] != self.instance_id:
+                self._deliver(event)
+        return len(events)
+
+    async def run_forever(self):
+        """Background loop started by run_worker"""
+        while True:
+            try:
+                await self.poll_once()
+            except Exception as e:
+                logger.error(f"❌ Cluster event poll error: {e}")
+            await asyncio.sleep(CLUSTER_EVENT_POLL_SECONDS)
+
+
+# Shared instance used by the bot
+coordinator = Coordinator(SupabaseBackend() if MULTI else LocalBackend())
+
+
+# Deal transitions are broadcast so every worker's caches and aggregates follow along
+_replaying = False
+
+
+@deal_states.on_transition
+def _share_transition(deal_id, old, new):
+    if not _replaying:
+        coordinator.broadcast('deal_transition', {'deal_id': deal_id, 'old': old, 'new': new})
+
+
+@coordinator.subscribe('deal_transition')
+def _replay_transition(payload):
+    global _replaying
+    _replaying = True
+    try:
+        deal_states.replay(payload['deal_id'], payload['old'], payload['new'])
+    finally:
+        _replaying = False
+
+
+# ====================
+# WEBHOOK INGRESS
+# ====================
+
+# A forward is retried this many times (with exponential backoff) before it is dropped
+FORWARD_ATTEMPTS = 5
+FORWARD_BACKOFF_SECONDS = 0.5
+
+
+class _Outbox:
+    """Ordered forwarding of updates to one peer worker"""
+
+    def __init__(self, url):
+        self.url = f"{url}/cluster/update"
+        self.queue = asyncio.Queue()
+        self.session = requests.Session()
+        self.task = None
+
+    def _post(self, body):
+        response = self.session.post(
+            self.url, data=body, timeout=10,
+            headers={'Content-Type': 'application/json', 'X-Cluster-Secret': CLUSTER_SECRET}
+        )
+        response.raise_for_status()
+
+    async def run(self, application):
+        while True:
+            body = await self.queue.get()
+            # Never handle it here: the owner's in-process state would be bypassed.
+            # Later updates wait behind the retries so the chat stays in order.
+            for attempt in range(FORWARD_ATTEMPTS):
+                try:
+                    await asyncio.to_thread(self._post, body)
+                    break
+                except Exception as e:
+                    if attempt == FORWARD_ATTEMPTS - 1:
+                        update_id = json.loads(body).get('update_id')
+                        logger.error(f"Forward of update {update_id} to {self.url} failed ({e}) - dropped")
+                    else:
+                        await asyncio.sleep(FORWARD_BACKOFF_SECONDS * 2 ** attempt)
+
+
+_outboxes = {}  # worker index -> _Outbox
+
+
+async def _enqueue(application, data):
+    from telegram import Update
+    await application.update_queue.put(Update.de_json(data, application.bot))
+
+
+async def route(application, data):
+    """Handle an update here if this worker owns its chat, else forward it to the owner"""
+    owner = worker_for(update_chat_id(data))
+    if owner == CLUSTER_WORKER_INDEX or owner >= len(CLUSTER_PEERS):
+        await _enqueue(application, data)
+        return
+
+    outbox = _outboxes.get(owner)
+    if not outbox:
+        outbox = _outboxes[owner] = _Outbox(CLUSTER_PEERS[owner])
+        outbox.task = asyncio.create_task(outbox.run(application))
+        lifecycle.register_queue(f"forward:{owner}", outbox.queue.qsize)
+    outbox.queue.put_nowait(json.dumps(data))
+
+
+def _authorized(headers, name):
+    return bool(CLUSTER_SECRET) and hmac.compare_digest(headers.get(name, ''), CLUSTER_SECRET)
+
+
+async def _handle_post(application, path, headers, body):
+    if not lifecycle.accepting():
+        # Telegram retries later (and a peer handles its forward itself)
+        return "503 Service Unavailable"
+    if path == '/telegram':
+        if not _authorized(headers, 'x-telegram-bot-api-secret-token'):
+            return "403 Forbidden"
+        await route(application, json.loads(body))
+    elif path == '/cluster/update':
+        if not _authorized(headers, 'x-cluster-secret'):
+            return "403 Forbidden"
+        await _enqueue(application, json.loads(body))
+    else:
+        return "404 Not Found"
+    return "200 OK"
+
+
+async def serve(application, port):
+    """Webhook + worker endpoint; any GET answers the platform health check"""
+
+    async def handle(reader, writer):
+        status = "200 OK"
+        try:
+            head = (await reader.readuntil(b"\r\n\r\n")).decode('latin-1').split("\r\n")
+            method, path = head[0].split(' ')[:2]
+            headers = {}
+            for line in head[1:]:
+                if ':' in line:
+                    key, value = line.split(':', 1)
+                    headers[key.strip().lower()] = value.strip()
+            if method == 'POST':
+                length = int(headers.get('content-length', 0))
+                body = await reader.readexactly(length) if length else b''
+                status = await _handle_post(application, path, headers, body)
+        except Exception as e:
+            logger.error(f"Bad request on cluster endpoint: {e}")
+            status = "400 Bad Request"
+        try:
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Length: 0\r\nConnection: close\r\n\r\n".encode())
+            await writer.drain()
+        except Exception:
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, '0.0.0.0', port)
+    logger.info(f"🚀 Worker {CLUSTER_WORKER_INDEX}/{CLUSTER_WORKERS} listening on port {port}")
+    async with server:
+        await server.serve_forever()
+
+
+def run_worker(application):
+    """Multi-instance entry point used by main() instead of run_polling"""
+    from telegram import Update
+
+    if not CLUSTER_SECRET:
+        raise RuntimeError("CLUSTER_SECRET must be set in multi-instance mode")
+
+    async def runner():
+        await application.initialize()
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        try:
+            if CLUSTER_WORKER_INDEX == 0 and WEBHOOK_URL:
+                await application.bot.set_webhook(
+                    f"{WEBHOOK_URL}/telegram",
+                    secret_token=CLUSTER_SECRET,
+                    allowed_updates=Update.ALL_TYPES
+                )
+                logger.info(f"✅ Webhook set to {WEBHOOK_URL}/telegram")
+            lifecycle.spawn(coordinator.run_forever(), "cluster_events")
+            server = asyncio.create_task(serve(application, int(os.environ.get("PORT", 8000))))
+            # SIGTERM: refuse new updates, drain, then close the endpoint
+            lifecycle.install(application, server.cancel)
+            try:
+                await server
+            except asyncio.CancelledError:
+                pass
+        finally:
+            await application.stop()
+            await application.shutdown()
+
+    asyncio.run(runner())
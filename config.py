@@ -70,5 +70,65 @@ API_ID = int(os.getenv('API_ID', '0'))
 API_HASH = os.getenv('API_HASH', '')
 PHONE_NUMBER = os.getenv('PHONE_NUMBER', '')
 
+# â”€â”€â”€ DEAL SWEEPER â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€
+# Unfunded deals older than STALE_DEAL_HOURS are expired and their groups deleted.
+# Released/refunded deals keep their group for CLOSED_DEAL_RETENTION_DAYS.
+STALE_DEAL_HOURS = int(os.getenv('STALE_DEAL_HOURS', '48'))
+CLOSED_DEAL_RETENTION_DAYS = int(os.getenv('CLOSED_DEAL_RETENTION_DAYS', '7'))
+SWEEP_INTERVAL_MINUTES = int(os.getenv('SWEEP_INTERVAL_MINUTES', '60'))
+SWEEP_BATCH_SIZE = int(os.getenv('SWEEP_BATCH_SIZE', '25'))
+
+# â”€â”€â”€ DEPOSIT WATCHER â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€
+# DEPOSIT_PROVIDER: 'live' (public chain APIs) or 'mock' (in-memory, for local testing)
+DEPOSIT_PROVIDER = os.getenv('DEPOSIT_PROVIDER', 'live').lower()
+DEPOSIT_POLL_SECONDS = int(os.getenv('DEPOSIT_POLL_SECONDS', '60'))
+BLOCKCHAIR_API_KEY = os.getenv('BLOCKCHAIR_API_KEY', '')
+BSCSCAN_API_KEY = os.getenv('BSCSCAN_API_KEY', '')
+
+# â”€â”€â”€ DEPOSIT ADDRESS POOL â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€
+ADDRESS_POOL_LOW_WATERMARK = int(os.getenv('ADDRESS_POOL_LOW_WATERMARK', '20'))
+ADDRESS_POOL_REFILL_SIZE = int(os.getenv('ADDRESS_POOL_REFILL_SIZE', '50'))
+ADDRESS_POOL_REFILL_SECONDS = int(os.getenv('ADDRESS_POOL_REFILL_SECONDS', '600'))
+
+# â”€â”€â”€ PRICE ORACLE â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€
+# PRICE_PROVIDER: 'coingecko' or 'fixture' (reads PRICE_FIXTURE_FILE, for offline testing)
+PRICE_PROVIDER = os.getenv('PRICE_PROVIDER', 'coingecko').lower()
+PRICE_FIXTURE_FILE = os.getenv('PRICE_FIXTURE_FILE', 'prices.json')
+PRICE_REFRESH_SECONDS = int(os.getenv('PRICE_REFRESH_SECONDS', '120'))
+# Quotes older than this are not shown (USD value falls back to "?")
+PRICE_MAX_AGE_SECONDS = int(os.getenv('PRICE_MAX_AGE_SECONDS', '900'))
+
+# â”€â”€â”€ DEAL CACHE â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€
+# Deals of active groups kept in memory by the bot (write-through on changes)
+DEAL_CACHE_SIZE = int(os.getenv('DEAL_CACHE_SIZE', '500'))
+# Upper bound on staleness for edits made outside this process (admin panel, SQL)
+DEAL_CACHE_SECONDS = int(os.getenv('DEAL_CACHE_SECONDS', '120'))
+
+# â”€â”€â”€ CLUSTER â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€
+# CLUSTER_MODE: 'single' (one polling instance) or 'multi' (webhook, N workers routed by chat id)
+CLUSTER_MODE = os.getenv('CLUSTER_MODE', 'single').lower()
+CLUSTER_WORKERS = int(os.getenv('CLUSTER_WORKERS', '1'))
+CLUSTER_WORKER_INDEX = int(os.getenv('CLUSTER_WORKER_INDEX', '0'))
+# Base URLs of all workers in index order, e.g. "http://bot-0:8000,http://bot-1:8000"
+CLUSTER_PEERS = [u.strip().rstrip('/') for u in os.getenv('CLUSTER_PEERS', '').split(',') if u.strip()]
+# Shared secret for webhook and worker-to-worker requests (A-Z, a-z, 0-9, _ and - only)
+CLUSTER_SECRET = os.getenv('CLUSTER_SECRET', '')
+# Public base URL Telegram delivers updates to (worker 0 registers <url>/telegram)
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '').rstrip('/')
+CLUSTER_LEASE_SECONDS = int(os.getenv('CLUSTER_LEASE_SECONDS', '120'))
+CLUSTER_EVENT_POLL_SECONDS = float(os.getenv('CLUSTER_EVENT_POLL_SECONDS', '2'))
+
+# â”€â”€â”€ SHUTDOWN â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€
+# Seconds to let in-flight work finish after SIGTERM (keep below the platform's kill timeout)
+SHUTDOWN_GRACE_SECONDS = int(os.getenv('SHUTDOWN_GRACE_SECONDS', '25'))
+# Jobs still 'running' after this long belong to a crashed instance and are resumed
+JOB_STALE_MINUTES = int(os.getenv('JOB_STALE_MINUTES', '10'))
+
+# â”€â”€â”€ GROUP CREATION â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€
+# Repeat create requests from the same user within this window get the same group
+CREATE_DEDUP_SECONDS = int(os.getenv('CREATE_DEDUP_SECONDS', '60'))
+# Unfunded deals a user may have open at once (admins are exempt)
+MAX_OPEN_DEALS_PER_USER = int(os.getenv('MAX_OPEN_DEALS_PER_USER', '3'))
+
 MEDIA_DIR = "media"
 MAX_VIDEO_SIZE_MB = 50
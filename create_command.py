@@ -2,11 +2,11 @@
 Simple /create command handler for escrow group creation
 """
 import logging
-import uuid
 from telegram import Update
 from telegram.ext import ContextTypes
 import telegram_group_manager
-import database
+import deal_groups
+import deal_ids
 
 logger = logging.getLogger(__name__)
 
@@ -17,8 +17,8 @@ async def create_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     user_id = update.effective_user.id
     
-    # Generate short deal ID (5 chars for matching reference)
-    deal_id = str(uuid.uuid4())[:5]
+    # Time-ordered deal ID (see deal_ids.py)
+    deal_id = deal_ids.new_deal_id()
     
     await update.message.reply_text(
         "<b>Creating escrow group... Please wait.</b>",
@@ -26,10 +26,9 @@ async def create_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     
     try:
-        # Create group using admin session from database
-        result = await telegram_group_manager.create_escrow_group(
-            deal_id=deal_id,
-            bot_username=context.bot.username
+        # Create group using admin session from database, then store the deal (journaled for restarts)
+        result = await deal_groups.create_deal_group(
+            deal_id, user_id, 0, context.bot.username, update.effective_chat.id
         )
         
         if not result['success']:
@@ -41,16 +40,10 @@ async def create_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             return
         
-        # Store in database
-        group_id = result['group_id']
+        # A repeated /create returns the group already being/just created
+        deal_id = result['deal_id']
         invite_link = result['invite_link']
         
-        # Store deal (use 0 for seller if not specified)
-        try:
-            database.create_deal(deal_id, user_id, 0, group_id)
-        except:
-            pass  # Database might not have function yet
-        
         # Send formatted success message matching reference bot
         success_message = telegram_group_manager.format_group_created_message(
             deal_id=deal_id,
@@ -1,6 +1,7 @@
 import os
+import base64
 from supabase import create_client, Client
-from datetime import datetime
+from datetime import datetime, timedelta
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -14,51 +15,33 @@ SUPABASE_KEY = os.getenv("SUPABASE_KEY", "YOUR_SUPABASE_KEY_HERE")
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
 from bot_error_wrapper import safe_call
+import queries
 
 @safe_call
 def init_db():
-    """Initialize database tables in Supabase"""
-    # Tables are created via Supabase dashboard or SQL editor
-    # This function can be used to insert default data
+    """Insert default data (tables are created via the Supabase SQL editor)"""
     try:
-        # Check if config exists, if not insert defaults
-        result = supabase.table('config').select('*').eq('key', 'admin_username').execute()
-        if not result.data:
-            supabase.table('config').insert([
-                {'key': 'admin_username', 'value': 'MiddleCryptoSupport'},
-                {'key': 'admin_password', 'value': 'admin123'}
-            ]).execute()
-        
-        # Check if addresses exist in crypto_addresses table (Admin Panel)
-        # If not, insert defaults
-        current_addrs = get_crypto_addresses()
-        if not current_addrs:
-             # BTC
-             add_crypto_address("BTC", "bc1q2szy4xmj4gxel6xdpp0zaelsn6x43885yy8nhg", "Bitcoin", "Main Wallet")
-             # LTC
-             add_crypto_address("LTC", "LPGJ1UeHiNYyUJjzBcwTCQEdMPpekqswFc", "Litecoin", "Main Wallet")
-             # USDT
-             add_crypto_address("USDT", "TJUq1Ab456XeKrJPwbDGUEZnwW3y31E5iQ", "TRC20", "Main Wallet")
-        
-        # Check if config exists (Legacy fallback), if not insert user provided defaults
-        # BTC
-        if not get_config("wallet_BTC"):
-            set_config("wallet_BTC", "bc1q2szy4xmj4gxel6xdpp0zaelsn6x43885yy8nhg")
-            
-        # LTC
-        if not get_config("wallet_LTC"):
-            set_config("wallet_LTC", "LPGJ1UeHiNYyUJjzBcwTCQEdMPpekqswFc")
-            
-        # USDT (TRC20)
-        if not get_config("wallet_USDT (TRC20)"):
-            set_config("wallet_USDT (TRC20)", "TJUq1Ab456XeKrJPwbDGUEZnwW3y31E5iQ")
-        
-        # Check if statistics exist
-        result = supabase.table('statistics').select('*').eq('key', 'total_deals').execute()
-        if not result.data:
-            supabase.table('statistics').insert([
-                {'key': 'total_deals', 'value': 5542},
-                {'key': 'disputes_resolved', 'value': 158}
+        # Defaults only fill missing keys (ignore_duplicates = ON CONFLICT DO NOTHING)
+        supabase.table('config').upsert([
+            {'key': 'admin_username', 'value': 'MiddleCryptoSupport'},
+            {'key': 'admin_password', 'value': 'admin123'},
+            # Legacy wallet fallback
+            {'key': 'wallet_BTC', 'value': 'bc1q2szy4xmj4gxel6xdpp0zaelsn6x43885yy8nhg'},
+            {'key': 'wallet_LTC', 'value': 'LPGJ1UeHiNYyUJjzBcwTCQEdMPpekqswFc'},
+            {'key': 'wallet_USDT (TRC20)', 'value': 'TJUq1Ab456XeKrJPwbDGUEZnwW3y31E5iQ'}
+        ], ignore_duplicates=True).execute()
+
+        supabase.table('statistics').upsert([
+            {'key': 'total_deals', 'value': 5542},
+            {'key': 'disputes_resolved', 'value': 158}
+        ], ignore_duplicates=True).execute()
+
+        # crypto_addresses (Admin Panel) has no natural key - seed only when empty
+        if not supabase.table('crypto_addresses').select('id').limit(1).execute().data:
+            supabase.table('crypto_addresses').insert([
+                {'currency': 'BTC', 'address': 'bc1q2szy4xmj4gxel6xdpp0zaelsn6x43885yy8nhg', 'network': 'Bitcoin', 'label': 'Main Wallet'},
+                {'currency': 'LTC', 'address': 'LPGJ1UeHiNYyUJjzBcwTCQEdMPpekqswFc', 'network': 'Litecoin', 'label': 'Main Wallet'},
+                {'currency': 'USDT', 'address': 'TJUq1Ab456XeKrJPwbDGUEZnwW3y31E5iQ', 'network': 'TRC20', 'label': 'Main Wallet'}
             ]).execute()
         
         print("âœ… Database initialized successfully")
@@ -111,22 +94,36 @@ def get_config(key):
         return None
 
 @safe_call
-def create_deal(deal_id, buyer_id, seller_id, group_id):
-    """Create a new escrow deal"""
+def get_all_config(exclude_prefixes=()):
+    """All config rows as a dict (optionally skipping per-user keys by prefix)"""
+    try:
+        query = supabase.table('config').select('key, value')
+        for prefix in exclude_prefixes:
+            query = query.not_.like('key', f"{prefix}%")
+        result = query.execute()
+        return {row['key']: row['value'] for row in result.data}
+    except Exception as e:
+        print(f"Error getting all config: {e}")
+        return {}
+
+@safe_call
+def create_deal(deal_id, buyer_id, seller_id, group_id, creator_id=None):
+    """Create a new escrow deal (creator_id defaults to the buyer who asked for the group)"""
     try:
         supabase.table('deals').insert({
             'deal_id': deal_id,
             'buyer_id': buyer_id,
             'seller_id': seller_id,
             'group_id': group_id,
-            'status': 'active'
+            'creator_id': creator_id or buyer_id,
+            'status': 'created'
         }).execute()
     except Exception as e:
         print(f"Error creating deal: {e}")
 
 @safe_call
 def update_deal_address(deal_id, role, address, user_id=None):
-    """Update buyer or seller address AND user_id for a deal"""
+    """Update buyer or seller address AND user_id for a deal (True once written)"""
     try:
         data = {}
         if role == 'buyer':
@@ -139,8 +136,12 @@ def update_deal_address(deal_id, role, address, user_id=None):
             if user_id:
                 data['seller_id'] = user_id
             supabase.table('deals').update(data).eq('deal_id', deal_id).execute()
+        else:
+            return False
+        return True
     except Exception as e:
         print(f"Error updating deal address: {e}")
+        return False
 
 @safe_call
 def get_deal_by_group(group_id):
@@ -164,12 +165,118 @@ def get_deal_by_group(group_id):
         print(f"Error getting deal: {e}")
         return None
 
+@safe_call
+def get_deal_by_id(deal_id):
+    """Get deal information by deal ID (same tuple as get_deal_by_group, plus group_id)"""
+    try:
+        result = supabase.table('deals').select('*').eq('deal_id', deal_id).execute()
+        if result.data:
+            d = result.data[0]
+            return (d['deal_id'], d['buyer_id'], d['seller_id'], d['buyer_address'], 
+                   d['seller_address'], d['bot_address'], d['status'], d['group_id'])
+        return None
+    except Exception as e:
+        print(f"Error getting deal {deal_id}: {e}")
+        return None
+
+@safe_call
+def compare_and_set_deal_status(deal_id, expected_statuses, new_status, fields=None):
+    """
+    Set deal status only if it is currently one of expected_statuses.
+    Returns True when a row was updated (i.e. this caller won the transition).
+    """
+    try:
+        data = dict(fields or {})
+        data['status'] = new_status
+        data['status_updated_at'] = datetime.now().isoformat()
+        result = supabase.table('deals').update(data) \
+            .eq('deal_id', deal_id) \
+            .in_('status', list(expected_statuses)) \
+            .execute()
+        return bool(result.data)
+    except Exception as e:
+        print(f"Error updating deal status: {e}")
+        return False
+
+@safe_call
+def get_deals_by_status(status, created_before=None, limit=100):
+    """Get deals in a status, oldest first (served by the (status, created_at) index)"""
+    try:
+        query = supabase.table('deals').select('*').eq('status', status)
+        if created_before:
+            query = query.lt('created_at', created_before)
+        result = query.order('created_at').limit(limit).execute()
+        return result.data or []
+    except Exception as e:
+        print(f"Error getting deals by status: {e}")
+        return []
+
+@safe_call
+def count_open_deals(creator_id, statuses):
+    """Number of deals a user created that are currently in one of statuses"""
+    try:
+        result = supabase.table('deals').select('deal_id', count='exact') \
+            .eq('creator_id', creator_id).in_('status', statuses).execute()
+        return result.count or 0
+    except Exception as e:
+        print(f"Error counting open deals: {e}")
+        return 0
+
+@safe_call
+def archive_deal(deal, group_reclaimed=False):
+    """Move a deal row into deals_archive and remove it from deals"""
+    try:
+        row = dict(deal)
+        row['group_reclaimed'] = group_reclaimed
+        row['archived_at'] = datetime.now().isoformat()
+        row.pop('id', None)
+        supabase.table('deals_archive').upsert(row).execute()
+        supabase.table('deals').delete().eq('deal_id', deal['deal_id']).execute()
+        return True
+    except Exception as e:
+        print(f"Error archiving deal: {e}")
+        return False
+
+@safe_call
+def get_deal_status_counts():
+    """Get per-status deal counters maintained by the deals status trigger"""
+    try:
+        result = queries.deal_status_counts(supabase.table).execute()
+        return queries.status_counts(result.data)
+    except Exception as e:
+        print(f"Error getting deal status counts: {e}")
+        return {}
+
+@safe_call
+def get_leaderboard(column, limit=20):
+    """Top users by a leaderboard column (total_deals, deals_as_seller, deals_as_buyer)"""
+    try:
+        result = supabase.table('leaderboard').select(f'user_id, {column}') \
+            .gt(column, 0).order(column, desc=True).limit(limit).execute()
+        return [(row['user_id'], row[column]) for row in result.data]
+    except Exception as e:
+        print(f"Error getting leaderboard: {e}")
+        return []
+
+@safe_call
+def get_usernames(user_ids):
+    """Map user_id -> (username, first_name) for users who started the bot"""
+    try:
+        if not user_ids:
+            return {}
+        result = supabase.table('bot_users').select('user_id, username, first_name') \
+            .in_('user_id', list(user_ids)).execute()
+        return {row['user_id']: (row['username'], row['first_name']) for row in result.data}
+    except Exception as e:
+        print(f"Error getting usernames: {e}")
+        return {}
+
 @safe_call
 def get_statistics():
     """Get current bot statistics"""
     try:
-        result = supabase.table('statistics').select('*').execute()
-        return {row['key']: row['value'] for row in result.data}
+        result = queries.statistics(supabase.table).execute()
+        return queries.key_values(result.data)
     except Exception as e:
         print(f"Error getting statistics: {e}")
         return {}
@@ -191,9 +298,8 @@ def track_user(user_id, username, first_name, last_name=None):
 def get_all_users():
     """Get all users who started the bot"""
     try:
-        result = supabase.table('bot_users').select('*').order('started_at', desc=True).execute()
-        return [(u['user_id'], u['username'], u['first_name'], u['last_name'], u['started_at']) 
-                for u in result.data]
+        result = queries.bot_users(supabase.table).execute()
+        return queries.user_tuples(result.data)
     except Exception as e:
         print(f"Error getting users: {e}")
         return []
@@ -201,9 +307,39 @@ def get_all_users():
 # Alias for compatibility
 get_all_bot_users = get_all_users
 
+def iter_table_rows(table, key_column, columns='*', date_column=None,
+                    start=None, end=None, page_size=500):
+    """
+    Yield rows of a table one page at a time (keyset pagination on key_column).
+    Only one page is held in memory, so this is safe for exports of any size.
+    start/end are ISO timestamps applied to date_column (start inclusive, end exclusive).
+    A failed page raises, so a caller never mistakes a cut-off export for a complete one.
+    """
+    last_key = None
+    while True:
+        try:
+            query = supabase.table(table).select(columns).order(key_column).limit(page_size)
+            if last_key is not None:
+                query = query.gt(key_column, last_key)
+            if date_column and start:
+                query = query.gte(date_column, start)
+            if date_column and end:
+                query = query.lt(date_column, end)
+            rows = query.execute().data or []
+        except Exception as e:
+            print(f"Error paging {table}: {e}")
+            raise
+
+        for row in rows:
+            yield row
+
+        if len(rows) < page_size:
+            return
+        last_key = rows[-1][key_column]
+
 @safe_call
-def save_media_file(file_type, file_path, description=""):
-    """Save media file info"""
+def save_media_file(file_type, file_path, description="", file_id=None, content_hash=None):
+    """Save media file info (file_id: Telegram file id once published, content_hash: sha256 of the file)"""
     try:
         # Delete old file of same type
         supabase.table('media_files').delete().eq('file_type', file_type).execute()
@@ -211,7 +347,9 @@ def save_media_file(file_type, file_path, description=""):
         supabase.table('media_files').insert({
             'file_type': file_type,
             'file_path': file_path,
-            'description': description
+            'description': description,
+            'file_id': file_id,
+            'content_hash': content_hash
         }).execute()
     except Exception as e:
         print(f"Error saving media file: {e}")
@@ -249,14 +387,13 @@ def get_content(key, default=""):
         return default
 
 @safe_call
-def get_all_media():
-    """Get all media files"""
+def get_media_records():
+    """All media_files rows as dicts, newest first (includes file_id / content_hash)"""
     try:
         result = supabase.table('media_files').select('*').order('uploaded_at', desc=True).execute()
-        return [(m['file_type'], m['file_path'], m['description'], m['uploaded_at']) 
-                for m in result.data]
+        return result.data
     except Exception as e:
-        print(f"Error getting all media: {e}")
+        print(f"Error getting media records: {e}")
         return []
 
 @safe_call
@@ -365,6 +502,37 @@ def update_crypto_address(address_id, currency, address, network='', label=''):
         print(f"Error updating crypto address: {e}")
         return False
 
+def match_crypto_address(addrs, network_string):
+    """Pick the crypto_addresses row for a network string (e.g. BTC, USDT (BEP20)); None if no match"""
+    net_upper = network_string.upper()
+    
+    for a in addrs:
+        # a = (id, currency, address, network, label, created_at)
+        # Try matching Currency (e.g. BTC == BTC)
+        currency = (a[1] or "").upper()
+        network_field = (a[3] or "").upper()
+        label = (a[4] or "").upper()
+        
+        # Simple Match: Currency matches exact string (e.g. BTC)
+        if currency == net_upper:
+            return a[2]
+        
+        # Complex Match: Currency inside string (e.g. USDT in USDT (BEP20))
+        if currency and currency in net_upper:
+            # If network specified in DB, must match (e.g. BEP20)
+            if network_field and network_field in net_upper:
+                return a[2]
+            # If no network specified in DB, generic match
+            if not network_field and not any(x in net_upper for x in ['BEP20', 'ERC20', 'TRC20']):
+                 # Only match if input string also has no specific network?
+                 # Or just return generic USDT.
+                 return a[2]
+
+        # Label Match (e.g. "Main Wallet")
+        if label and label == net_upper:
+            return a[2]
+    return None
+
 @safe_call
 def get_bot_wallet_address(network_string):
     """
@@ -375,41 +543,115 @@ def get_bot_wallet_address(network_string):
         # 1. Try crypto_addresses table
         # We fetch all because complex matching is easier in Python 
         # (given network strings vary)
-        addrs = get_crypto_addresses()
-        net_upper = network_string.upper()
-        
-        for a in addrs:
-            # a = (id, currency, address, network, label, created_at)
-            # Try matching Currency (e.g. BTC == BTC)
-            currency = (a[1] or "").upper()
-            network_field = (a[3] or "").upper()
-            label = (a[4] or "").upper()
-            
-            # Simple Match: Currency matches exact string (e.g. BTC)
-            if currency == net_upper:
-                return a[2]
-            
-            # Complex Match: Currency inside string (e.g. USDT in USDT (BEP20))
-            if currency and currency in net_upper:
-                # If network specified in DB, must match (e.g. BEP20)
-                if network_field and network_field in net_upper:
-                    return a[2]
-                # If no network specified in DB, generic match
-                if not network_field and not any(x in net_upper for x in ['BEP20', 'ERC20', 'TRC20']):
-                     # Only match if input string also has no specific network?
-                     # Or just return generic USDT.
-                     return a[2]
-
-            # Label Match (e.g. "Main Wallet")
-            if label and label == net_upper:
-                return a[2]
-                
+        address = match_crypto_address(get_crypto_addresses(), network_string)
+        if address:
+            return address
     except Exception as e:
         print(f"Error finding crypto address in table: {e}")
 
     # 2. Fallback to Config (Legacy)
     return get_config(f"wallet_{network_string}")
 
+# -------------------------------------------------------------------------
+# Deposit address pool (one escrow address per deal, see address_pool.py)
+# -------------------------------------------------------------------------
+
+@safe_call
+def claim_deposit_address(network, deal_id):
+    """Atomically assign a free pool address to a deal (returns existing one if already assigned)"""
+    try:
+        result = supabase.rpc('claim_deposit_address', {'p_network': network, 'p_deal_id': deal_id}).execute()
+        return result.data or None
+    except Exception as e:
+        print(f"Error claiming deposit address: {e}")
+        return None
+
+@safe_call
+def get_deal_id_for_address(address):
+    """Reverse lookup: which deal owns a pool address"""
+    try:
+        result = supabase.table('deposit_addresses').select('deal_id').eq('address', address).execute()
+        return result.data[0]['deal_id'] if result.data else None
+    except Exception as e:
+        print(f"Error looking up deposit address: {e}")
+        return None
+
+@safe_call
+def get_deposit_baseline(address):
+    """Balance recorded on a pool address before it was claimed (None if not measured yet)"""
+    try:
+        result = supabase.table('deposit_addresses').select('baseline_amount').eq('address', address).execute()
+        if not result.data or result.data[0]['baseline_amount'] is None:
+            return None
+        return float(result.data[0]['baseline_amount'])
+    except Exception as e:
+        print(f"Error getting deposit baseline: {e}")
+        return None
+
+@safe_call
+def get_unmeasured_deposit_addresses(network, limit=100):
+    """Free pool addresses whose starting balance has not been recorded yet"""
+    try:
+        result = supabase.table('deposit_addresses').select('address') \
+            .eq('network', network).is_('deal_id', 'null').is_('baseline_amount', 'null') \
+            .limit(limit).execute()
+        return [row['address'] for row in result.data or []]
+    except Exception as e:
+        print(f"Error getting unmeasured deposit addresses: {e}")
+        return []
+
+@safe_call
+def set_deposit_baseline(address, amount):
+    """Record the starting balance of a free pool address, which makes it claimable"""
+    try:
+        supabase.table('deposit_addresses').update({'baseline_amount': amount}) \
+            .eq('address', address).is_('baseline_amount', 'null').execute()
+        return True
+    except Exception as e:
+        print(f"Error setting deposit baseline: {e}")
+        return False
+
+@safe_call
+def import_deposit_addresses(network, addresses, derivation_indexes=None):
+    """Insert addresses into the pool, skipping ones already present. Returns count inserted."""
+    try:
+        rows = []
+        for i, address in enumerate(addresses):
+            row = {'address': address, 'network': network}
+            if derivation_indexes:
+                row['derivation_index'] = derivation_indexes[i]
+            rows.append(row)
+        if not rows:
+            return 0
+        result = supabase.table('deposit_addresses').upsert(rows, ignore_duplicates=True).execute()
+        return len(result.data or [])
+    except Exception as e:
+        print(f"Error importing deposit addresses: {e}")
+        return 0
+
+@safe_call
+def count_free_deposit_addresses(network):
+    """Number of unassigned pool addresses for a network"""
+    try:
+        result = supabase.table('deposit_addresses').select('address', count='exact') \
+            .eq('network', network).is_('deal_id', 'null').limit(1).execute()
+        return result.count or 0
+    except Exception as e:
+        print(f"Error counting deposit addresses: {e}")
+        return 0
+
+@safe_call
+def get_max_derivation_index(network):
+    """Highest HD derivation index already in the pool (None if nothing derived yet)"""
+    try:
+        result = supabase.table('deposit_addresses').select('derivation_index') \
+            .eq('network', network).not_.is_('derivation_index', 'null') \
+            .order('derivation_index', desc=True).limit(1).execute()
+        return result.data[0]['derivation_index'] if result.data else None
+    except Exception as e:
+        print(f"Error getting derivation index: {e}")
+        return None
+
 # -------------------------------------------------------------------------
 # Telegram Session Management (for Admin Panel group creation)
 # -------------------------------------------------------------------------
@@ -461,6 +703,16 @@ def get_telegram_session(phone=None):
         print(f"Error getting Telegram session: {e}")
         return None
 
+@safe_call
+def save_telegram_entity_cache(session_id, entity_cache):
+    """Store Telethon access hashes alongside the session (see telegram_group_manager.EntityCache)"""
+    try:
+        supabase.table('telegram_sessions').update({'entity_cache': entity_cache}).eq('id', session_id).execute()
+        return True
+    except Exception as e:
+        print(f"Error saving Telegram entity cache: {e}")
+        return False
+
 @safe_call
 def delete_telegram_session(phone):
     """Delete Telegram session from database"""
@@ -471,3 +723,223 @@ def delete_telegram_session(phone):
         print(f"Error deleting Telegram session: {e}")
         return False
 
+@safe_call
+def save_telegram_login(login_id, phone, phone_code_hash, session_string, ttl_seconds):
+    """Store (or refresh) a login in progress so any panel instance can continue it"""
+    try:
+        supabase.table('telegram_logins').upsert({
+            'login_id': login_id,
+            'phone': phone,
+            'phone_code_hash': phone_code_hash,
+            'session_string': session_string,
+            'expires_at': (datetime.utcnow() + timedelta(seconds=ttl_seconds)).isoformat()
+        }).execute()
+        return True
+    except Exception as e:
+        print(f"Error saving Telegram login: {e}")
+        return False
+
+@safe_call
+def get_telegram_login(login_id):
+    """Unexpired login in progress, or None"""
+    try:
+        result = supabase.table('telegram_logins').select('*').eq('login_id', login_id) \
+            .gt('expires_at', datetime.utcnow().isoformat()).execute()
+        return result.data[0] if result.data else None
+    except Exception as e:
+        print(f"Error getting Telegram login: {e}")
+        return None
+
+@safe_call
+def delete_telegram_login(login_id=None):
+    """Forget a login in progress (or every expired one when no id is given)"""
+    try:
+        query = supabase.table('telegram_logins').delete()
+        if login_id:
+            query = query.eq('login_id', login_id)
+        else:
+            query = query.lt('expires_at', datetime.utcnow().isoformat())
+        query.execute()
+        return True
+    except Exception as e:
+        print(f"Error deleting Telegram login: {e}")
+        return False
+
+# -------------------------------------------------------------------------
+# Chunked uploads (admin panel, see api/index.py) - shared by every instance
+# -------------------------------------------------------------------------
+
+@safe_call
+def create_upload(upload_id, filename, size, chunk_size, total_parts, ttl_seconds):
+    """Store the manifest of a new chunked upload"""
+    try:
+        supabase.table('uploads').insert({
+            'upload_id': upload_id,
+            'filename': filename,
+            'size': size,
+            'chunk_size': chunk_size,
+            'total_parts': total_parts,
+            'expires_at': (datetime.utcnow() + timedelta(seconds=ttl_seconds)).isoformat()
+        }).execute()
+        return True
+    except Exception as e:
+        print(f"Error creating upload: {e}")
+        return False
+
+@safe_call
+def get_upload(upload_id):
+    """Unexpired upload manifest, or None"""
+    try:
+        result = supabase.table('uploads').select('*').eq('upload_id', upload_id) \
+            .gt('expires_at', datetime.utcnow().isoformat()).execute()
+        return result.data[0] if result.data else None
+    except Exception as e:
+        print(f"Error getting upload: {e}")
+        return None
+
+@safe_call
+def save_upload_part(upload_id, part_index, data):
+    """Store one verified part (a resent part replaces itself)"""
+    try:
+        supabase.table('upload_parts').upsert({
+            'upload_id': upload_id,
+            'part_index': part_index,
+            'data': base64.b64encode(data).decode('ascii')
+        }).execute()
+        return True
+    except Exception as e:
+        print(f"Error saving upload part: {e}")
+        return False
+
+@safe_call
+def get_upload_part_indexes(upload_id):
+    """Indexes of the parts stored so far, ascending"""
+    try:
+        result = supabase.table('upload_parts').select('part_index') \
+            .eq('upload_id', upload_id).order('part_index').execute()
+        return [row['part_index'] for row in result.data or []]
+    except Exception as e:
+        print(f"Error getting upload parts: {e}")
+        return None
+
+@safe_call
+def get_upload_part(upload_id, part_index):
+    """Bytes of one part, or None if it is not stored"""
+    try:
+        result = supabase.table('upload_parts').select('data') \
+            .eq('upload_id', upload_id).eq('part_index', part_index).execute()
+        return base64.b64decode(result.data[0]['data']) if result.data else None
+    except Exception as e:
+        print(f"Error getting upload part: {e}")
+        return None
+
+@safe_call
+def delete_upload(upload_id=None):
+    """Drop an upload and its parts (or every expired upload when no id is given)"""
+    try:
+        query = supabase.table('uploads').delete()
+        if upload_id:
+            query = query.eq('upload_id', upload_id)
+        else:
+            query = query.lt('expires_at', datetime.utcnow().isoformat())
+        query.execute()
+        return True
+    except Exception as e:
+        print(f"Error deleting upload: {e}")
+        return False
+
+# ====================
+# CLUSTER COORDINATION
+# ====================
+
+@safe_call
+def acquire_lease(name, holder, ttl_seconds):
+    """Take or renew a named lease; True if `holder` now owns it"""
+    try:
+        result = supabase.rpc('acquire_lease', {
+            'p_name': name, 'p_holder': holder, 'p_ttl_seconds': int(ttl_seconds)
+        }).execute()
+        return bool(result.data)
+    except Exception as e:
+        print(f"Error acquiring lease {name}: {e}")
+        return False
+
+@safe_call
+def release_lease(name, holder):
+    """Give a lease back early (only if `holder` still owns it)"""
+    try:
+        supabase.table('cluster_leases').delete().eq('name', name).eq('holder', holder).execute()
+    except Exception as e:
+        print(f"Error releasing lease {name}: {e}")
+
+@safe_call
+def publish_cluster_event(channel, payload, origin):
+    """Append an event for the other bot instances"""
+    try:
+        result = supabase.rpc('publish_cluster_event', {
+            'p_channel': channel, 'p_payload': payload, 'p_origin': origin
+        }).execute()
+        return result.data
+    except Exception as e:
+        print(f"Error publishing cluster event: {e}")
+        return None
+
+@safe_call
+def get_cluster_events(after_id, limit=200):
+    """Events newer than after_id, oldest first"""
+    try:
+        result = supabase.table('cluster_events').select('id, channel, payload, origin') \
+            .gt('id', after_id).order('id').limit(limit).execute()
+        return result.data or []
+    except Exception as e:
+        print(f"Error fetching cluster events: {e}")
+        return []
+
+@safe_call
+def get_latest_cluster_event_id():
+    """Highest event id so a starting worker skips history"""
+    try:
+        result = supabase.table('cluster_events').select('id').order('id', desc=True).limit(1).execute()
+        return result.data[0]['id'] if result.data else 0
+    except Exception as e:
+        print(f"Error fetching latest cluster event: {e}")
+        return None
+
+# ====================
+# JOB JOURNAL
+# ====================
+
+@safe_call
+def create_job(kind, payload):
+    """Journal a job as running; returns its id"""
+    try:
+        result = supabase.table('jobs').insert({'kind': kind, 'payload': payload, 'status': 'running'}).execute()
+        return result.data[0]['id'] if result.data else None
+    except Exception as e:
+        print(f"Error creating job: {e}")
+        return None
+
+@safe_call
+def update_job(job_id, status=None, payload=None):
+    """Update a job's status and/or payload"""
+    try:
+        data = {'updated_at': datetime.utcnow().isoformat()}
+        if status:
+            data['status'] = status
+        if payload is not None:
+            data['payload'] = payload
+        supabase.table('jobs').update(data).eq('id', job_id).execute()
+    except Exception as e:
+        print(f"Error updating job {job_id}: {e}")
+
+@safe_call
+def get_resumable_jobs(stale_before):
+    """Interrupted jobs, plus running ones not touched since stale_before (crashed instance)"""
+    try:
+        result = supabase.table('jobs').select('*') \
+            .or_(f"status.eq.interrupted,and(status.eq.running,updated_at.lt.{stale_before})") \
+            .order('id').execute()
+        return result.data or []
+    except Exception as e:
+        print(f"Error fetching resumable jobs: {e}")
+        return []
@@ -0,0 +1,130 @@
+"""
+Deal Cache
+Deals of active groups as compact records, kept in a bounded LRU with write-through on changes
+"""
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+import cluster
+import database
+import deal_states
+from config import DEAL_CACHE_SIZE, DEAL_CACHE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(slots=True)
+class Deal:
+    """One row of the deals table, as used by the bot"""
+    deal_id: str
+    buyer_id: int
+    seller_id: int
+    buyer_address: str = None
+    seller_address: str = None
+    bot_address: str = None
+    status: str = None
+    group_id: int = None
+
+    @classmethod
+    def from_row(cls, row, group_id=None):
+        """Build from the (deal_id, buyer_id, seller_id, buyer_address, seller_address, bot_address, status[, group_id]) tuple"""
+        if group_id is None and len(row) > 7:
+            group_id = row[7]
+        return cls(*row[:7], group_id=group_id)
+
+    @property
+    def state(self):
+        """Lifecycle state (legacy 'active' rows map to CREATED)"""
+        return deal_states.normalize(self.status)
+
+    @property
+    def roles_locked(self):
+        return deal_states.roles_locked(self.status)
+
+
+_deals = OrderedDict()   # group_id -> (Deal, loaded_at) (LRU)
+_group_by_deal = {}      # deal_id -> group_id of cached entries
+
+
+def _store(deal):
+    _deals[deal.group_id] = (deal, time.time())
+    _deals.move_to_end(deal.group_id)
+    _group_by_deal[deal.deal_id] = deal.group_id
+    while len(_deals) > DEAL_CACHE_SIZE:
+        _, (old, _) = _deals.popitem(last=False)
+        _group_by_deal.pop(old.deal_id, None)
+
+
+def _cached(group_id):
+    entry = _deals.get(group_id)
+    if not entry:
+        return None
+    deal, loaded_at = entry
+    if time.time() - loaded_at > DEAL_CACHE_SECONDS:
+        return None
+    _deals.move_to_end(group_id)
+    return deal
+
+
+def get(group_id):
+    """Deal of a group (memory first, then database); None if the group has no deal"""
+    deal = _cached(group_id)
+    if deal:
+        return deal
+
+    row = database.get_deal_by_group(group_id)
+    if not row:
+        return None
+    deal = Deal.from_row(row, group_id)
+    _store(deal)
+    return deal
+
+
+def get_by_id(deal_id):
+    """Deal by id - served from memory when its group is cached"""
+    group_id = _group_by_deal.get(deal_id)
+    if group_id is not None:
+        deal = _cached(group_id)
+        if deal and deal.deal_id == deal_id:
+            return deal
+
+    row = database.get_deal_by_id(deal_id)
+    return Deal.from_row(row) if row else None
+
+
+def set_party(deal, role, address, user_id):
+    """Write a buyer/seller address through to the database and the cached record (False if the write failed)"""
+    if not database.update_deal_address(deal.deal_id, role, address, user_id=user_id):
+        # The row may or may not have changed - reload it on the next read
+        invalidate(deal_id=deal.deal_id)
+        return False
+    if role == 'buyer':
+        deal.buyer_id, deal.buyer_address = user_id, address
+    elif role == 'seller':
+        deal.seller_id, deal.seller_address = user_id, address
+    if deal.group_id is not None:
+        _store(deal)
+    cluster.coordinator.broadcast('deal_changed', {'deal_id': deal.deal_id})
+    return True
+
+
+def invalidate(group_id=None, deal_id=None):
+    """Drop a cached deal so the next read goes to the database"""
+    if group_id is None:
+        group_id = _group_by_deal.get(deal_id)
+    entry = _deals.pop(group_id, None)
+    if entry:
+        _group_by_deal.pop(entry[0].deal_id, None)
+
+
+@deal_states.on_transition
+def _on_deal_transition(deal_id, old, new):
+    # Transitions may also write other columns (bot_address, cleared roles) - reload on next read
+    invalidate(deal_id=deal_id)
+
+
+@cluster.coordinator.subscribe('deal_changed')
+def _on_remote_change(payload):
+    # Another worker wrote this deal
+    invalidate(deal_id=payload['deal_id'])
@@ -0,0 +1,157 @@
+"""
+Deal Groups
+Creates the escrow group and its deal row as one journaled job, so a restart
+between the two steps cannot leave an orphan group. Duplicate requests from
+the same user share one creation.
+"""
+import asyncio
+import logging
+import time
+import database
+import deal_states
+import lifecycle
+import messages
+import telegram_group_manager
+from config import ADMIN_USER_IDS, CREATE_DEDUP_SECONDS, MAX_OPEN_DEALS_PER_USER
+
+logger = logging.getLogger(__name__)
+
+JOB_KIND = 'create_group'
+
+_pending = {}   # user_id -> Task of the creation in progress
+_recent = {}    # user_id -> (result, finished_at) of the last successful creation
+
+
+def _open_deals_error(user_id):
+    """Error text if the user is at the open-deal cap, else None"""
+    if user_id in ADMIN_USER_IDS:
+        return None
+    statuses = []
+    for state in deal_states.PRE_FUNDING_STATES:
+        statuses += deal_states.stored_values(state)
+    count = database.count_open_deals(user_id, statuses) or 0
+    if count >= MAX_OPEN_DEALS_PER_USER:
+        return messages.OPEN_DEALS_LIMIT_TEXT.format(count=count, limit=MAX_OPEN_DEALS_PER_USER)
+    return None
+
+
+def _settle(user_id, task):
+    _pending.pop(user_id, None)
+    if task.cancelled() or task.exception():
+        return
+    result = task.result()
+    if result['success']:
+        _recent[user_id] = (result, time.monotonic())
+
+    # Keep the window map small
+    cutoff = time.monotonic() - CREATE_DEDUP_SECONDS
+    for uid in [uid for uid, (_, at) in _recent.items() if at < cutoff]:
+        del _recent[uid]
+
+
+async def create_deal_group(deal_id, buyer_id, seller_id, bot_username, chat_id):
+    """
+    Create the Telegram group for a new deal and store the deal.
+    Repeat calls by the same buyer while a creation is running, or within
+    CREATE_DEDUP_SECONDS of it finishing, get that creation's result instead.
+    Returns the create_escrow_group result dict plus 'deal_id'
+    ({'success', 'deal_id', 'group_id', 'invite_link'} or 'error').
+    """
+    recent = _recent.get(buyer_id)
+    if recent and time.monotonic() - recent[1] < CREATE_DEDUP_SECONDS:
+        logger.info(f"Duplicate create from {buyer_id} - returning deal #{recent[0]['deal_id']}")
+        return recent[0]
+
+    task = _pending.get(buyer_id)
+    if task is None:
+        error = _open_deals_error(buyer_id)
+        if error:
+            return {'success': False, 'error': error}
+        task = asyncio.ensure_future(_create(deal_id, buyer_id, seller_id, bot_username, chat_id))
+        _pending[buyer_id] = task
+        task.add_done_callback(lambda t: _settle(buyer_id, t))
+    else:
+        logger.info(f"Coalescing create from {buyer_id} onto the one in flight")
+
+    # shield: one caller giving up must not cancel the creation the others wait on
+    return await asyncio.shield(task)
+
+
+async def _create(deal_id, buyer_id, seller_id, bot_username, chat_id):
+    payload = {
+        'deal_id': deal_id,
+        'buyer_id': buyer_id,
+        'seller_id': seller_id,
+        'chat_id': chat_id
+    }
+    job_id = lifecycle.start_job(JOB_KIND, payload)
+
+    def record_group(group_id):
+        # Journal the group the moment it exists - a restart during the remaining
+        # steps leaves a job the resumer can clean up, not an orphan group
+        payload['group_id'] = group_id
+        lifecycle.update_job(job_id, payload)
+
+    async with lifecycle.tracked(f"{JOB_KIND}:{deal_id}", job_id):
+        try:
+            result = await telegram_group_manager.create_escrow_group(
+                deal_id=deal_id, bot_username=bot_username, on_created=record_group
+            )
+        except Exception as e:
+            logger.error(f"Error creating group for deal #{deal_id}: {e}")
+            result = {'success': False, 'error': str(e), 'group_id': payload.get('group_id')}
+        result['deal_id'] = deal_id
+        if not result['success']:
+            # Close the job - otherwise the next start would try to resume it
+            lifecycle.finish_job(job_id, 'failed')
+            if result.get('group_id'):
+                # Group exists but is unusable - don't leave it behind
+                await telegram_group_manager.delete_groups([result['group_id']])
+            return result
+        if result.get('failed_steps'):
+            logger.warning(f"Deal #{deal_id} group created with failed steps: {result['failed_steps']}")
+
+        # Group is ready - an invite link in the job marks it complete
+        payload['invite_link'] = result['invite_link']
+        lifecycle.update_job(job_id, payload)
+
+        database.create_deal(deal_id, buyer_id, seller_id, result['group_id'], creator_id=buyer_id)
+        lifecycle.finish_job(job_id)
+        return result
+
+
+@lifecycle.resumer(JOB_KIND)
+async def resume_create_group(bot, job):
+    """Finish a group creation cut short by a restart"""
+    payload = job.get('payload') or {}
+    deal_id = payload.get('deal_id')
+    chat_id = payload.get('chat_id')
+
+    if not payload.get('invite_link'):
+        # Interrupted before the group was ready - remove any half-provisioned
+        # group, then ask the user to start over
+        if payload.get('group_id'):
+            report = await telegram_group_manager.delete_groups([payload['group_id']])
+            if payload['group_id'] not in report['deleted']:
+                logger.warning(f"Could not delete group {payload['group_id']} of deal #{deal_id}: {report}")
+        if chat_id:
+            await bot.send_message(
+                chat_id,
+                f"⚠️ <b>Creating escrow group #{deal_id} was interrupted by a restart.</b>\n\n"
+                "Please create the group again.",
+                parse_mode='HTML'
+            )
+        return 'abandoned'
+
+    if not database.get_deal_by_id(deal_id):
+        database.create_deal(
+            deal_id, payload['buyer_id'], payload['seller_id'], payload['group_id'], creator_id=payload['buyer_id']
+        )
+
+    if chat_id:
+        await bot.send_message(
+            chat_id,
+            telegram_group_manager.format_group_created_message(deal_id, payload['invite_link']),
+            parse_mode='HTML'
+        )
+    return 'resumed'
@@ -0,0 +1,80 @@
+"""
+Deal IDs
+Time-ordered deal ids generated locally without a database probe, sortable by
+creation time and easy to type (Crockford base32, e.g. 0K2M9-R4A01).
+Ids only stay distinct while worker indexes differ and clocks do not step back
+across a restart; the deals primary key is what finally rejects a duplicate.
+"""
+import threading
+import time
+from config import CLUSTER_WORKER_INDEX
+
+# Crockford base32: no I, L, O, U; ascending in ASCII so ids sort as strings
+ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+_TYPO_MAP = str.maketrans({'I': '1', 'L': '1', 'O': '0'})
+
+EPOCH = 1704067200  # 2024-01-01 UTC
+SECONDS_DIGITS = 7  # 35 bits of seconds -> ~1000 years
+WORKER_DIGITS = 1   # up to 32 bot instances
+SEQUENCE_DIGITS = 2 # 1024 ids per second per instance
+MAX_SEQUENCE = 32 ** SEQUENCE_DIGITS
+
+if not 0 <= CLUSTER_WORKER_INDEX < 32 ** WORKER_DIGITS:
+    raise ValueError(f"CLUSTER_WORKER_INDEX must be between 0 and {32 ** WORKER_DIGITS - 1} (deal ids have one worker digit)")
+
+_lock = threading.Lock()
+# Never reuse a second an earlier process may have used (a restart takes longer than that)
+_state = {'second': int(time.time()) - EPOCH, 'sequence': MAX_SEQUENCE}
+
+
+def _encode(value, digits):
+    chars = []
+    for _ in range(digits):
+        value, rem = divmod(value, 32)
+        chars.append(ALPHABET[rem])
+    return ''.join(reversed(chars))
+
+
+def _decode(text):
+    value = 0
+    for char in text:
+        value = value * 32 + ALPHABET.index(char)
+    return value
+
+
+def _format(second, worker, sequence):
+    raw = _encode(second, SECONDS_DIGITS) + _encode(worker, WORKER_DIGITS) + _encode(sequence, SEQUENCE_DIGITS)
+    return f"{raw[:5]}-{raw[5:]}"
+
+
+def new_deal_id(worker=CLUSTER_WORKER_INDEX):
+    """
+    Next deal id: (second, worker, sequence) does not repeat within a running
+    instance, and concurrent instances differ by worker index
+    """
+    with _lock:
+        now = int(time.time()) - EPOCH
+        if now > _state['second']:
+            _state['second'], _state['sequence'] = now, 0
+        elif _state['sequence'] >= MAX_SEQUENCE - 1:
+            # Second exhausted (or clock stepped back) - borrow the next one
+            _state['second'], _state['sequence'] = _state['second'] + 1, 0
+        else:
+            _state['sequence'] += 1
+        return _format(_state['second'], worker, _state['sequence'])
+
+
+def normalize(text):
+    """Accept what users type: lowercase, missing dash, I/L for 1, O for 0"""
+    raw = text.strip().upper().replace('-', '').translate(_TYPO_MAP)
+    if len(raw) != SECONDS_DIGITS + WORKER_DIGITS + SEQUENCE_DIGITS or any(c not in ALPHABET for c in raw):
+        return text.strip()  # legacy id - leave as is
+    return f"{raw[:5]}-{raw[5:]}"
+
+
+def created_at(deal_id):
+    """Unix time a deal id was issued (None for legacy ids)"""
+    raw = normalize(deal_id).replace('-', '')
+    if len(raw) != SECONDS_DIGITS + WORKER_DIGITS + SEQUENCE_DIGITS or any(c not in ALPHABET for c in raw):
+        return None
+    return _decode(raw[:SECONDS_DIGITS]) + EPOCH
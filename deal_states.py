@@ -0,0 +1,138 @@
+"""
+Deal State Machine
+Defines the escrow deal lifecycle and applies status changes with compare-and-set updates
+"""
+import logging
+import database
+
+logger = logging.getLogger(__name__)
+
+# Lifecycle states
+CREATED = 'created'
+ROLES_SET = 'roles_set'
+AWAITING_DEPOSIT = 'awaiting_deposit'
+FUNDED = 'funded'
+RELEASE_PENDING = 'release_pending'   # release agreed, payout not sent yet
+REFUND_PENDING = 'refund_pending'     # refund agreed, payout not sent yet
+RELEASED = 'released'
+REFUNDED = 'refunded'
+DISPUTED = 'disputed'
+EXPIRED = 'expired'
+
+ALL_STATES = [
+    CREATED, ROLES_SET, AWAITING_DEPOSIT, FUNDED, RELEASE_PENDING, REFUND_PENDING,
+    RELEASED, REFUNDED, DISPUTED, EXPIRED
+]
+
+# Allowed moves: current status -> statuses it may move to
+TRANSITIONS = {
+    CREATED: {ROLES_SET, EXPIRED},
+    ROLES_SET: {AWAITING_DEPOSIT, CREATED, EXPIRED},
+    AWAITING_DEPOSIT: {FUNDED, CREATED, EXPIRED},
+    FUNDED: {RELEASE_PENDING, REFUND_PENDING, DISPUTED},
+    DISPUTED: {RELEASE_PENDING, REFUND_PENDING},
+    RELEASE_PENDING: {RELEASED},
+    REFUND_PENDING: {REFUNDED},
+    RELEASED: set(),
+    REFUNDED: set(),
+    EXPIRED: set(),
+}
+
+# States where no money has arrived yet, so roles may still change
+PRE_FUNDING_STATES = {CREATED, ROLES_SET, AWAITING_DEPOSIT}
+TERMINAL_STATES = {RELEASED, REFUNDED, EXPIRED}
+# Payouts are sent by an escrow admin; confirming one moves the deal on
+PAYOUT_STATES = {RELEASE_PENDING: RELEASED, REFUND_PENDING: REFUNDED}
+
+# Rows written before the state machine existed used 'active'
+LEGACY_ALIASES = {'active': CREATED, None: CREATED}
+
+
+# Callbacks run after a successful transition: fn(deal_id, old_status, new_status)
+_listeners = []
+
+
+def on_transition(callback):
+    """Register a callback for successful transitions (used for caches/aggregates)"""
+    _listeners.append(callback)
+    return callback
+
+
+def _notify(deal_id, old, new):
+    for callback in _listeners:
+        try:
+            callback(deal_id, old, new)
+        except Exception as e:
+            logger.error(f"Transition listener {callback.__name__} failed: {e}")
+
+
+def replay(deal_id, old, new):
+    """Run listeners for a transition another bot instance made (see cluster.py)"""
+    _notify(deal_id, old, new)
+
+
+def normalize(status):
+    """Map legacy/missing status values onto lifecycle states"""
+    return LEGACY_ALIASES.get(status, status)
+
+
+def stored_values(state):
+    """All raw column values that mean `state` (includes legacy aliases)"""
+    return [state] + [raw for raw, alias in LEGACY_ALIASES.items() if alias == state and raw]
+
+
+def can_transition(current, new):
+    """Check whether the lifecycle allows moving from current to new"""
+    return new in TRANSITIONS.get(normalize(current), set())
+
+
+def roles_locked(status):
+    """True once funds may be in escrow - buyer/seller can no longer change"""
+    return normalize(status) not in PRE_FUNDING_STATES
+
+
+def transition(deal_id, current, new, **fields):
+    """
+    Move a deal from `current` to `new`.
+    The update only applies if the row is still in `current` (compare-and-set),
+    so two handlers racing on the same deal cannot both win.
+    Returns True if this call performed the transition.
+    """
+    current = normalize(current)
+    if not can_transition(current, new):
+        logger.warning(f"Rejected transition {current} -> {new} for deal {deal_id}")
+        return False
+
+    changed = database.compare_and_set_deal_status(deal_id, stored_values(current), new, fields)
+    if changed:
+        logger.info(f"Deal {deal_id}: {current} -> {new}")
+        _notify(deal_id, current, new)
+    return bool(changed)
+
+
+def reset_roles(deal_id):
+    """Clear both parties and return a not-yet-funded deal to CREATED"""
+    expected = []
+    for state in PRE_FUNDING_STATES:
+        expected += stored_values(state)
+
+    changed = database.compare_and_set_deal_status(deal_id, expected, CREATED, {
+        'buyer_id': 0,
+        'seller_id': 0,
+        'buyer_address': None,
+        'seller_address': None
+    })
+    if changed:
+        logger.info(f"Deal {deal_id}: roles reset")
+        _notify(deal_id, None, CREATED)
+    return bool(changed)
+
+
+def get_counts():
+    """Per-state deal counts (read from trigger-maintained counters, O(1))"""
+    counts = database.get_deal_status_counts() or {}
+    result = {state: 0 for state in ALL_STATES}
+    for raw, value in counts.items():
+        state = normalize(raw)
+        result[state] = result.get(state, 0) + value
+    return result
@@ -0,0 +1,98 @@
+"""
+Deal Sweeper
+Expires abandoned deals and reclaims (deletes) their Telegram groups in rate-limited batches
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+import database
+import deal_states
+import telegram_group_manager
+from config import (
+    STALE_DEAL_HOURS,
+    CLOSED_DEAL_RETENTION_DAYS,
+    SWEEP_INTERVAL_MINUTES,
+    SWEEP_BATCH_SIZE
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _find(states, older_than, limit):
+    """Deals in any of `states` created before `older_than`, oldest first"""
+    cutoff = older_than.isoformat()
+    deals = []
+    for state in states:
+        for raw in deal_states.stored_values(state):
+            if len(deals) >= limit:
+                return deals
+            deals += database.get_deals_by_status(raw, created_before=cutoff, limit=limit - len(deals))
+    return deals
+
+
+async def sweep(batch_size=SWEEP_BATCH_SIZE):
+    """
+    Run one sweep pass:
+    1. Expire unfunded deals older than STALE_DEAL_HOURS
+    2. Delete groups of expired deals and of paid-out deals past retention
+    3. Move those deal rows into deals_archive
+    Returns a report dict.
+    """
+    # created_at is stored in UTC (Postgres NOW() on the server)
+    now = datetime.utcnow()
+    report = {'expired': 0, 'groups_reclaimed': 0, 'archived': 0, 'failed': 0, 'flood_wait': 0}
+
+    # 1. Expire stale unfunded deals
+    stale = _find(deal_states.PRE_FUNDING_STATES, now - timedelta(hours=STALE_DEAL_HOURS), batch_size)
+    for deal in stale:
+        if deal_states.transition(deal['deal_id'], deal['status'], deal_states.EXPIRED):
+            report['expired'] += 1
+
+    # 2. Pick reclaimable deals (expired now, or closed and past retention).
+    # Only RELEASED/REFUNDED count as closed - an admin confirmed their payout;
+    # deals still waiting for one (release_pending/refund_pending) are never touched
+    reclaimable = _find([deal_states.EXPIRED], now, batch_size)
+    if len(reclaimable) < batch_size:
+        reclaimable += _find(
+            [deal_states.RELEASED, deal_states.REFUNDED],
+            now - timedelta(days=CLOSED_DEAL_RETENTION_DAYS),
+            batch_size - len(reclaimable)
+        )
+
+    group_ids = [d['group_id'] for d in reclaimable if d.get('group_id')]
+    result = await telegram_group_manager.delete_groups(group_ids)
+    deleted = set(result.get('deleted') or [])
+    report['groups_reclaimed'] = len(deleted)
+    report['failed'] = len(result.get('failed') or {})
+    report['flood_wait'] = result.get('flood_wait', 0)
+    if not result.get('success'):
+        # The session lease is taken per group, so some groups may be gone already
+        logger.error(f"Group reclamation failed: {result.get('error')}")
+        report['failed'] = len(group_ids) - len(deleted)
+
+    # 3. Archive rows whose group is gone (or never existed)
+    for deal in reclaimable:
+        group_id = deal.get('group_id')
+        if group_id and group_id not in deleted:
+            continue
+        if database.archive_deal(deal, group_reclaimed=bool(group_id)):
+            report['archived'] += 1
+
+    logger.info(
+        f"🧹 Sweep done: expired {report['expired']}, reclaimed {report['groups_reclaimed']} groups, "
+        f"archived {report['archived']}, failed {report['failed']}"
+    )
+    return report
+
+
+async def run_forever():
+    """Background loop started from post_init"""
+    while True:
+        try:
+            report = await sweep()
+            # Telegram asked us to slow down - skip ahead to when it allows more
+            delay = max(SWEEP_INTERVAL_MINUTES * 60, report['flood_wait'])
+        except Exception as e:
+            logger.error(f"❌ Deal sweeper error: {e}")
+            delay = SWEEP_INTERVAL_MINUTES * 60
+        await asyncio.sleep(delay)
@@ -0,0 +1,316 @@
+"""
+Deposit Watcher
+Polls the escrow addresses of awaiting_deposit deals in batches and marks deals funded
+once the deposit reaches the confirmation threshold
+"""
+import abc
+import asyncio
+import logging
+import time
+from collections import namedtuple, OrderedDict
+import requests
+import database
+import deal_states
+import validators
+import address_pool
+from config import DEPOSIT_PROVIDER, DEPOSIT_POLL_SECONDS, BLOCKCHAIR_API_KEY, BSCSCAN_API_KEY
+
+logger = logging.getLogger(__name__)
+
+# Last observed state of an escrow address (amount is net of the address baseline)
+Deposit = namedtuple('Deposit', ['amount', 'confirmations', 'checked_at'])
+
+# Escrow addresses kept in the watcher's cache (LRU)
+CACHE_SIZE = 5000
+
+# Free pool addresses measured per poll and network
+MEASURE_BATCH = 100
+
+# Confirmations needed before a deal counts as funded
+CONFIRMATIONS_REQUIRED = {
+    'BTC': 1,
+    'LTC': 1,
+    'USDT (TRC20)': 1,
+    'USDT (BEP20)': 1,
+    'TON': 1
+}
+
+USDT_TRC20_CONTRACT = 'TR7NHqjeKQxGTCi8q8ZY4pL8otSzgjLj6t'
+USDT_BEP20_CONTRACT = '0x55d398326f99059fF775485246999027B3197955'
+
+
+def deal_network(buyer_address):
+    """Network of a deal - deposits come in on the buyer's network"""
+    is_valid, network = validators.validate_crypto_address(buyer_address)
+    return network
+
+
+# ====================
+# PROVIDERS
+# ====================
+
+class ChainProvider(abc.ABC):
+    """
+    Source of deposit data for one or more networks.
+    fetch() gets up to max_batch addresses per call and returns
+    {address: (amount, confirmations)} for addresses that received funds.
+    It is blocking and runs in a worker thread.
+    """
+    max_batch = 1
+
+    @abc.abstractmethod
+    def fetch(self, network, addresses):
+        """{address: (amount, confirmations)} for a batch of addresses"""
+
+
+class MockProvider(ChainProvider):
+    """In-memory provider for local testing - use credit() to simulate a deposit"""
+    max_batch = 100
+
+    def __init__(self):
+        self.balances = {}
+        self.calls = 0
+
+    def credit(self, address, amount, confirmations=1):
+        self.balances[address] = (amount, confirmations)
+
+    def fetch(self, network, addresses):
+        self.calls += 1
+        return {a: self.balances[a] for a in addresses if a in self.balances}
+
+
+class BlockchairProvider(ChainProvider):
+    """BTC / LTC through Blockchair's multi-address dashboard (100 addresses per call)"""
+    max_batch = 100
+    CHAINS = {'BTC': 'bitcoin', 'LTC': 'litecoin'}
+
+    def __init__(self, api_key=''):
+        self.api_key = api_key
+
+    def fetch(self, network, addresses):
+        url = f"https://api.blockchair.com/{self.CHAINS[network]}/dashboards/addresses/{','.join(addresses)}"
+        params = {'key': self.api_key} if self.api_key else {}
+        data = requests.get(url, params=params, timeout=15).json()
+        tip = data['context']['state']
+
+        result = {}
+        for utxo in data['data'].get('utxo') or []:
+            block = utxo['block_id']
+            confirmations = tip - block + 1 if block > 0 else 0
+            amount, lowest = result.get(utxo['address'], (0.0, confirmations))
+            result[utxo['address']] = (amount + utxo['value'] / 1e8, min(lowest, confirmations))
+        return result
+
+
+class TronGridProvider(ChainProvider):
+    """
+    USDT (TRC20) incoming transfers via TronGrid (confirmed transfers only).
+    TronGrid has no multi-account endpoint, so this is one request per address.
+    """
+
+    def fetch(self, network, addresses):
+        result = {}
+        for address in addresses:
+            url = f"https://api.trongrid.io/v1/accounts/{address}/transactions/trc20"
+            params = {
+                'only_to': 'true',
+                'only_confirmed': 'true',
+                'contract_address': USDT_TRC20_CONTRACT,
+                'limit': 50
+            }
+            transfers = requests.get(url, params=params, timeout=15).json().get('data') or []
+            amount = sum(int(t['value']) for t in transfers) / 1e6
+            if amount:
+                result[address] = (amount, 1)
+        return result
+
+
+class BscScanProvider(ChainProvider):
+    """
+    USDT (BEP20) token balance via BscScan.
+    balancemulti only covers native BNB - token balances are one request per address.
+    """
+
+    def __init__(self, api_key=''):
+        self.api_key = api_key
+
+    def fetch(self, network, addresses):
+        result = {}
+        for address in addresses:
+            params = {
+                'module': 'account',
+                'action': 'tokenbalance',
+                'contractaddress': USDT_BEP20_CONTRACT,
+                'address': address,
+                'tag': 'latest',
+                'apikey': self.api_key
+            }
+            data = requests.get('https://api.bscscan.com/api', params=params, timeout=15).json()
+            amount = int(data.get('result') or 0) / 1e18
+            if amount:
+                result[address] = (amount, 1)
+        return result
+
+
+class TonCenterProvider(ChainProvider):
+    """TON balance via toncenter (one request per address)"""
+
+    def fetch(self, network, addresses):
+        result = {}
+        for address in addresses:
+            data = requests.get(
+                'https://toncenter.com/api/v2/getAddressBalance',
+                params={'address': address},
+                timeout=15
+            ).json()
+            amount = int(data.get('result') or 0) / 1e9
+            if amount:
+                result[address] = (amount, 1)
+        return result
+
+
+def build_providers():
+    """Network -> provider map based on DEPOSIT_PROVIDER"""
+    if DEPOSIT_PROVIDER == 'mock':
+        mock = MockProvider()
+        return {network: mock for network in CONFIRMATIONS_REQUIRED}
+
+    blockchair = BlockchairProvider(BLOCKCHAIR_API_KEY)
+    return {
+        'BTC': blockchair,
+        'LTC': blockchair,
+        'USDT (TRC20)': TronGridProvider(),
+        'USDT (BEP20)': BscScanProvider(BSCSCAN_API_KEY),
+        'TON': TonCenterProvider()
+    }
+
+
+# ====================
+# WATCHER
+# ====================
+
+class DepositWatcher:
+    """Tracks escrow addresses of awaiting_deposit deals and caches what it sees"""
+
+    def __init__(self, providers=None):
+        self.providers = providers if providers is not None else build_providers()
+        self._cache = OrderedDict()  # address -> Deposit (LRU)
+
+    def cached(self, address):
+        """Last observed deposit for an address (None if never polled)"""
+        return self._cache.get(address)
+
+    def _remember(self, address, deposit):
+        self._cache[address] = deposit
+        self._cache.move_to_end(address)
+        while len(self._cache) > CACHE_SIZE:
+            self._cache.popitem(last=False)
+
+    async def _measure_free_addresses(self, network, provider):
+        """
+        Record the balance of free pool addresses before they can be claimed,
+        so funds already sitting on an address are never counted as a deposit
+        """
+        addresses = database.get_unmeasured_deposit_addresses(network, limit=MEASURE_BATCH) or []
+        for i in range(0, len(addresses), provider.max_batch):
+            batch = addresses[i:i + provider.max_batch]
+            try:
+                found = await asyncio.to_thread(provider.fetch, network, batch)
+            except Exception as e:
+                logger.error(f"Error measuring {network} pool addresses: {e}")
+                return
+            for address in batch:
+                amount, _ = found.get(address, (0.0, 0))
+                database.set_deposit_baseline(address, amount)
+
+    def _tracked_deals(self):
+        """network -> {escrow address -> [deals]} for every deal awaiting a deposit"""
+        by_network = {}
+        for raw in deal_states.stored_values(deal_states.AWAITING_DEPOSIT):
+            for deal in database.get_deals_by_status(raw, limit=1000):
+                address = deal.get('bot_address')
+                network = deal_network(deal.get('buyer_address'))
+                if address and network:
+                    by_network.setdefault(network, {}).setdefault(address, []).append(deal)
+        return by_network
+
+    async def poll_once(self, bot=None):
+        """Poll every tracked address once; returns the number of deals marked funded"""
+        funded = 0
+        for network in address_pool.NETWORKS:
+            if network in self.providers:
+                await self._measure_free_addresses(network, self.providers[network])
+
+        for network, deals_by_address in self._tracked_deals().items():
+            provider = self.providers.get(network)
+            if not provider:
+                continue
+
+            addresses = list(deals_by_address)
+            for i in range(0, len(addresses), provider.max_batch):
+                batch = addresses[i:i + provider.max_batch]
+                try:
+                    found = await asyncio.to_thread(provider.fetch, network, batch)
+                except Exception as e:
+                    logger.error(f"Error polling {network} deposits: {e}")
+                    continue
+
+                now = time.time()
+                for address in batch:
+                    amount, confirmations = found.get(address, (0.0, 0))
+                    baseline = address_pool.baseline(address)
+                    if baseline is not None:
+                        amount -= baseline
+                    self._remember(address, Deposit(amount, confirmations, now))
+
+                    if amount <= 0 or confirmations < CONFIRMATIONS_REQUIRED.get(network, 1):
+                        continue
+
+                    # Only a pool address is proof of ownership - a shared wallet balance
+                    # can belong to any deal, even when just one deal is awaiting on it
+                    owner = address_pool.deal_for_address(address)
+                    deals = [d for d in deals_by_address[address] if d['deal_id'] == owner]
+                    if len(deals) != 1 or baseline is None:
+                        logger.warning(
+                            f"Deposit on {address} is not on a measured pool address owned by its deal, needs manual attribution"
+                        )
+                        continue
+
+                    if await self._mark_funded(deals[0], network, amount, bot):
+                        funded += 1
+        return funded
+
+    async def _mark_funded(self, deal, network, amount, bot):
+        """Move the deal to FUNDED and tell the group"""
+        if not deal_states.transition(deal['deal_id'], deal_states.AWAITING_DEPOSIT, deal_states.FUNDED, amount=amount):
+            return False
+
+        if bot and deal.get('group_id'):
+            try:
+                await bot.send_message(
+                    chat_id=deal['group_id'],
+                    text=(
+                        "✅ <b>DEPOSIT CONFIRMED</b>\n\n"
+                        f"💰 <b>{amount:g} {network}</b> received in escrow.\n\n"
+                        "Seller may now deliver. Buyer, use /pay_seller once you receive the product/service."
+                    ),
+                    parse_mode='HTML'
+                )
+            except Exception as e:
+                logger.error(f"Error sending deposit notification for deal {deal['deal_id']}: {e}")
+        return True
+
+    async def run_forever(self, bot):
+        """Background loop started from post_init"""
+        while True:
+            try:
+                funded = await self.poll_once(bot)
+                if funded:
+                    logger.info(f"💰 {funded} deal(s) funded")
+            except Exception as e:
+                logger.error(f"❌ Deposit watcher error: {e}")
+            await asyncio.sleep(DEPOSIT_POLL_SECONDS)
+
+
+# Shared instance used by bot.py
+watcher = DepositWatcher()
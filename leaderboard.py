@@ -0,0 +1,84 @@
+"""
+Leaderboard
+Renders the top users by completed deals from the trigger-maintained leaderboard table,
+caching the rendered text until a deal is released or the cache ages out
+"""
+import html
+import logging
+import time
+import database
+import deal_states
+import messages
+
+logger = logging.getLogger(__name__)
+
+TOP_N = 20
+CACHE_SECONDS = 300
+
+SECTIONS = [
+    ('total_deals', "⚡️ <b>Top All-Rounders (Both as Buyer & Seller)</b>"),
+    ('deals_as_seller', "🛒 <b>Top Sellers</b>"),
+    ('deals_as_buyer', "🛍 <b>Top Buyers</b>"),
+]
+
+MEDALS = ["🥇", "🥈", "🥉"]
+
+_cache = {'text': None, 'built_at': 0.0}
+
+
+def invalidate():
+    """Force the next request to rebuild the text"""
+    _cache['text'] = None
+
+
+@deal_states.on_transition
+def _on_deal_transition(deal_id, old, new):
+    # Only completed deals change the standings
+    if new == deal_states.RELEASED:
+        invalidate()
+
+
+def _mention(names, user_id):
+    # Only a real username can be @-mentioned; anyone else gets a profile link
+    username, first_name = names.get(user_id, (None, None))
+    if username:
+        return f"@{html.escape(username)}"
+    label = html.escape(first_name) if first_name else f"User {user_id}"
+    return f"<a href='tg://user?id={user_id}'>{label}</a>"
+
+
+def build_text(top_n=TOP_N):
+    """Query the top rows and render the leaderboard (None if there is no data)"""
+    rankings = [(title, database.get_leaderboard(column, top_n) or []) for column, title in SECTIONS]
+    if not any(rows for _, rows in rankings):
+        return None
+
+    user_ids = {user_id for _, rows in rankings for user_id, _ in rows}
+    names = database.get_usernames(user_ids) or {}
+
+    text = "🚀 <b>MIDDLE CRYPTO LEADERBOARD</b>\n"
+    for title, rows in rankings:
+        text += f"\n{title}\n\n"
+        for rank, (user_id, count) in enumerate(rows):
+            medal = MEDALS[rank] if rank < len(MEDALS) else "🏅"
+            text += f"{medal} {_mention(names, user_id)} ({count})\n"
+    text += "\n<i>Who will rise to the top next? Keep dealing and claim your spot!</i>"
+    return text
+
+
+def get_text():
+    """Leaderboard text, served from cache while fresh"""
+    if _cache['text'] and time.time() - _cache['built_at'] < CACHE_SECONDS:
+        return _cache['text']
+
+    try:
+        text = build_text()
+    except Exception as e:
+        logger.error(f"Error building leaderboard: {e}")
+        text = None
+
+    # No completed deals yet (or DB unavailable) - keep showing the classic board
+    text = text or messages.LEADERBOARD_TEXT
+    _cache['text'] = text
+    _cache['built_at'] = time.time()
+    return text
@@ -0,0 +1,171 @@
+"""
+Lifecycle
+Graceful shutdown: stop taking updates, drain in-flight work within a deadline and
+journal unfinished jobs so the next start can resume them
+"""
+import asyncio
+import json
+import logging
+import signal
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from telegram.ext import Application
+import database
+from config import SHUTDOWN_GRACE_SECONDS, JOB_STALE_MINUTES
+
+logger = logging.getLogger(__name__)
+
+_accepting = True
+_in_flight = {}   # token -> (label, job_id, started_at)
+_queues = {}      # name -> fn() returning how many items are still queued
+_loops = []       # background tasks, cancelled at shutdown (their state lives in the DB)
+_resumers = {}    # job kind -> async fn(bot, job)
+
+
+def accepting():
+    """False once shutdown has started"""
+    return _accepting
+
+
+@asynccontextmanager
+async def tracked(label, job_id=None):
+    """Mark a piece of work as in flight so shutdown waits for it"""
+    token = object()
+    _in_flight[token] = (label, job_id, time.time())
+    try:
+        yield
+    finally:
+        _in_flight.pop(token, None)
+
+
+def spawn(coro, name):
+    """Start a background loop that shutdown cancels"""
+    task = asyncio.create_task(coro, name=name)
+    _loops.append(task)
+    return task
+
+
+def register_queue(name, pending):
+    """Shutdown waits until pending() reaches 0 (or the deadline passes)"""
+    _queues[name] = pending
+
+
+class DrainingApplication(Application):
+    """Application that counts updates being processed (ApplicationBuilder.application_class)"""
+
+    async def process_update(self, update):
+        async with tracked('update'):
+            return await super().process_update(update)
+
+
+# ====================
+# JOB JOURNAL
+# ====================
+
+def start_job(kind, payload):
+    """Journal a multi-step job before it starts; returns job id (None if the DB is down)"""
+    return database.create_job(kind, payload)
+
+
+def update_job(job_id, payload):
+    """Record progress (full payload) so a resume knows which steps already happened"""
+    if job_id:
+        database.update_job(job_id, payload=payload)
+
+
+def finish_job(job_id, status='done'):
+    if job_id:
+        database.update_job(job_id, status=status)
+
+
+def resumer(kind):
+    """Decorator registering how to finish an interrupted job of `kind`"""
+    def decorator(func):
+        _resumers[kind] = func
+        return func
+    return decorator
+
+
+async def resume_jobs(bot):
+    """Finish jobs interrupted by a shutdown, or left running by a crashed instance"""
+    stale_before = datetime.utcnow() - timedelta(minutes=JOB_STALE_MINUTES)
+    jobs = await asyncio.to_thread(database.get_resumable_jobs, stale_before.isoformat())
+    for job in jobs or []:
+        func = _resumers.get(job['kind'])
+        if not func:
+            logger.warning(f"No resumer for job {job['id']} ({job['kind']})")
+            continue
+        try:
+            status = await func(bot, job) or 'resumed'
+        except Exception as e:
+            logger.error(f"Error resuming job {job['id']} ({job['kind']}): {e}")
+            status = 'abandoned'
+        finish_job(job['id'], status)
+        logger.info(f"♻️ Job {job['id']} ({job['kind']}): {status}")
+
+
+# ====================
+# SHUTDOWN
+# ====================
+
+def _queued():
+    counts = {}
+    for name, pending in _queues.items():
+        try:
+            counts[name] = pending()
+        except Exception:
+            counts[name] = 0
+    return {name: n for name, n in counts.items() if n}
+
+
+async def drain(timeout=SHUTDOWN_GRACE_SECONDS):
+    """Wait for in-flight work and queues to empty; journal whatever is left"""
+    started = time.time()
+    initial = len(_in_flight) + sum(_queued().values())
+    while (_in_flight or _queued()) and time.time() - started < timeout:
+        await asyncio.sleep(0.2)
+
+    abandoned = list(_in_flight.values())
+    for label, job_id, _ in abandoned:
+        if job_id:
+            database.update_job(job_id, status='interrupted')
+
+    report = {
+        'drained': max(initial - len(abandoned), 0),
+        'abandoned': [label for label, _, _ in abandoned],
+        'queued_left': _queued(),
+        'seconds': round(time.time() - started, 1),
+        'at': datetime.utcnow().isoformat()
+    }
+    logger.info(
+        f"🛑 Drain finished in {report['seconds']}s: {report['drained']} drained, "
+        f"{len(report['abandoned'])} abandoned {report['abandoned']}, queued left {report['queued_left']}"
+    )
+    database.set_config('last_shutdown_report', json.dumps(report))
+    return report
+
+
+async def shutdown(application, stop):
+    """Shutdown protocol; `stop` ends the runner once draining is done"""
+    global _accepting
+    if not _accepting:
+        return
+    _accepting = False
+    logger.info("🛑 Shutdown requested - no longer accepting updates")
+
+    if application.updater and application.updater.running:
+        await application.updater.stop()
+    for task in _loops:
+        task.cancel()
+
+    register_queue('update_queue', application.update_queue.qsize)
+    await drain()
+    stop()
+
+
+def install(application, stop):
+    """Run the shutdown protocol on SIGTERM/SIGINT (call from inside the event loop)"""
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, lambda: asyncio.ensure_future(shutdown(application, stop)))
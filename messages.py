@@ -293,6 +293,22 @@ TEXT_CONTACT_ADMIN = (
 # Group-only command error (from screenshot 2)
 GROUP_ONLY_COMMAND = "🚫 Please use <code>/start</code> to initialize the bot."
 
+# Deal settlement (pay_seller / refund_buyer / dispute)
+NO_BALANCE_TEXT = "🚫 <b>NO BALANCE available in escrow address. Seller should NOT PROVIDE the buyer with product/service before balance is visible. Type /balance after 1 confirmation.</b>"
+RELEASE_REQUESTED_TEXT = "✅ <b>Release requested.</b>\n\nThe escrow admin has been notified and will send the funds to the Seller's wallet. This group is told once the payout is sent."
+REFUND_REQUESTED_TEXT = "✅ <b>Refund requested.</b>\n\nThe escrow admin has been notified and will return the funds to the Buyer's wallet. This group is told once the payout is sent."
+PAYOUT_PENDING_TEXT = "⏳ <b>A payout for this deal is already waiting for the escrow admin.</b>"
+PAYOUT_REQUEST_ADMIN_TEXT = "💸 <b>{action} requested for deal #{deal_id}</b>\n\nAmount: {amount}\nTo: <code>{address}</code>\n\nSend the funds, then confirm with /paid {deal_id}"
+RELEASE_PAID_TEXT = "✅ <b>Payout sent.</b>\n\nThe escrow admin has sent the funds to the Seller's wallet. Deal complete."
+REFUND_PAID_TEXT = "✅ <b>Refund sent.</b>\n\nThe escrow admin has returned the funds to the Buyer's wallet. Deal complete."
+ONLY_BUYER_RELEASES_TEXT = "🚫 <b>Only the Buyer can release funds to the Seller.</b>"
+ONLY_SELLER_REFUNDS_TEXT = "🚫 <b>Only the Seller can refund the Buyer.</b>"
+ONLY_PARTIES_RESET_TEXT = "🚫 <b>Only the Buyer, the Seller or a group admin can reset roles.</b>"
+DEAL_DISPUTED_TEXT = "⚖️ <b>This deal is under dispute.</b>\n\nOnly the escrow admin can settle it now."
+DISPUTE_OPENED_TEXT = "⚖️ <b>Dispute opened.</b>\n\nAn arbitrator will review this deal. Funds stay locked until it is resolved."
+DEAL_STATE_CHANGED_TEXT = "⚠️ <b>The deal changed while processing your request. Please try again.</b>"
+OPEN_DEALS_LIMIT_TEXT = "You already have {count} open deals waiting for funding (limit {limit}). Finish or let one expire before creating another."
+
 
 TEXT_CREATE = "Click /create or tap \"Create Escrow Group\" button to start a secure escrow group."
 
@@ -0,0 +1,118 @@
+"""
+Price Oracle
+Keeps USD quotes for BTC, LTC, USDT and TON in memory, refreshed on a schedule,
+so balance messages never wait on a price API
+"""
+import asyncio
+import json
+import logging
+import time
+import requests
+from config import PRICE_PROVIDER, PRICE_REFRESH_SECONDS, PRICE_MAX_AGE_SECONDS, PRICE_FIXTURE_FILE
+
+logger = logging.getLogger(__name__)
+
+# Asset symbol -> CoinGecko id
+COINGECKO_IDS = {
+    'BTC': 'bitcoin',
+    'LTC': 'litecoin',
+    'USDT': 'tether',
+    'TON': 'the-open-network'
+}
+
+
+def asset_for_network(network):
+    """'USDT (TRC20)' -> 'USDT', 'BTC' -> 'BTC'"""
+    return (network or '').split(' ')[0].upper()
+
+
+# ====================
+# PROVIDERS
+# ====================
+
+class CoinGeckoProvider:
+    """All quotes in one /simple/price call"""
+
+    def fetch(self):
+        data = requests.get(
+            'https://api.coingecko.com/api/v3/simple/price',
+            params={'ids': ','.join(COINGECKO_IDS.values()), 'vs_currencies': 'usd'},
+            timeout=10
+        ).json()
+        return {
+            asset: float(data[coin_id]['usd'])
+            for asset, coin_id in COINGECKO_IDS.items()
+            if coin_id in data
+        }
+
+
+class FixtureProvider:
+    """Fixed quotes for offline tests - from a JSON file like {"BTC": 60000} or a dict"""
+
+    def __init__(self, prices=None, path=None):
+        self.prices = prices
+        self.path = path
+
+    def fetch(self):
+        if self.prices is not None:
+            return dict(self.prices)
+        with open(self.path) as f:
+            return {k.upper(): float(v) for k, v in json.load(f).items()}
+
+
+def build_provider():
+    """Provider selected by PRICE_PROVIDER"""
+    if PRICE_PROVIDER == 'fixture':
+        return FixtureProvider(path=PRICE_FIXTURE_FILE)
+    return CoinGeckoProvider()
+
+
+# ====================
+# ORACLE
+# ====================
+
+class PriceOracle:
+    """In-memory quote cache; reads never touch the network"""
+
+    def __init__(self, provider=None, max_age=PRICE_MAX_AGE_SECONDS):
+        self.provider = provider or build_provider()
+        self.max_age = max_age
+        self._prices = {}  # asset -> (usd, fetched_at)
+
+    def refresh(self):
+        """Fetch all quotes once (blocking)"""
+        prices = self.provider.fetch()
+        now = time.time()
+        for asset, usd in prices.items():
+            self._prices[asset] = (usd, now)
+        return prices
+
+    def price(self, asset):
+        """USD price, or None if missing or older than max_age"""
+        quote = self._prices.get(asset.upper())
+        if not quote:
+            return None
+        usd, fetched_at = quote
+        if time.time() - fetched_at > self.max_age:
+            return None
+        return usd
+
+    def to_usd(self, amount, network):
+        """Convert an amount on a network to USD (None if no fresh quote)"""
+        usd = self.price(asset_for_network(network))
+        if usd is None:
+            return None
+        return amount * usd
+
+    async def run_forever(self):
+        """Background loop started from post_init"""
+        while True:
+            try:
+                await asyncio.to_thread(self.refresh)
+            except Exception as e:
+                logger.error(f"❌ Price refresh error: {e}")
+            await asyncio.sleep(PRICE_REFRESH_SECONDS)
+
+
+# Shared instance used by bot.py
+oracle = PriceOracle()
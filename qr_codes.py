@@ -0,0 +1,113 @@
+"""
+QR Codes
+Renders payment QR codes for escrow addresses, cached by content:
+memory LRU -> PNG on disk -> Telegram file_id once a code has been sent
+"""
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from io import BytesIO
+from config import MEDIA_DIR
+
+logger = logging.getLogger(__name__)
+
+QR_DIR = os.path.join(MEDIA_DIR, "qr")
+MEMORY_CACHE_SIZE = 128
+
+# URI schemes wallets understand; USDT tokens are just the plain address
+URI_SCHEMES = {
+    'BTC': 'bitcoin',
+    'LTC': 'litecoin',
+    'TON': 'ton://transfer'
+}
+
+_png_cache = OrderedDict()   # key -> PNG bytes (LRU)
+_file_ids = OrderedDict()    # key -> Telegram file_id (LRU)
+# render() runs in worker threads, so every LRU access goes through this lock
+_lock = threading.Lock()
+
+
+def payment_uri(address, amount, network):
+    """Text encoded in the QR code"""
+    scheme = URI_SCHEMES.get(network)
+    if not scheme:
+        return address
+    uri = f"{scheme}/{address}" if scheme.startswith('ton://') else f"{scheme}:{address}"
+    if amount:
+        if network == 'TON':
+            uri += f"?amount={int(amount * 1e9)}"  # nanotons
+        else:
+            uri += f"?amount={amount:g}"
+    return uri
+
+
+def cache_key(address, amount, network):
+    """Content address for a (address, amount, network) QR code"""
+    return hashlib.sha256(payment_uri(address, amount, network).encode()).hexdigest()
+
+
+def _remember(cache, key, value):
+    with _lock:
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > MEMORY_CACHE_SIZE:
+            cache.popitem(last=False)
+
+
+def _lookup(cache, key):
+    with _lock:
+        value = cache.get(key)
+        if value:
+            cache.move_to_end(key)
+        return value
+
+
+def cached_file_id(key):
+    """Telegram file_id of a QR code already uploaded (None if never sent)"""
+    return _lookup(_file_ids, key)
+
+
+def remember_file_id(key, file_id):
+    """Store the file_id Telegram returned so the next send skips the upload"""
+    _remember(_file_ids, key, file_id)
+
+
+def forget_file_id(key):
+    """Drop a file_id Telegram no longer accepts"""
+    with _lock:
+        _file_ids.pop(key, None)
+
+
+def render(address, amount, network):
+    """PNG bytes for the payment QR code (memory -> disk -> render)"""
+    key = cache_key(address, amount, network)
+
+    png = _lookup(_png_cache, key)
+    if png:
+        return png
+
+    path = os.path.join(QR_DIR, f"{key}.png")
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            png = f.read()
+    else:
+        import qrcode
+        buffer = BytesIO()
+        qrcode.make(payment_uri(address, amount, network), box_size=8, border=2).save(buffer, format="PNG")
+        png = buffer.getvalue()
+        try:
+            os.makedirs(QR_DIR, exist_ok=True)
+            # Write-then-rename so a concurrent reader never sees half a file;
+            # each writer gets its own temp file so two renders cannot interleave
+            fd, tmp_path = tempfile.mkstemp(dir=QR_DIR, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(png)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not write QR cache file: {e}")
+
+    _remember(_png_cache, key, png)
+    return png
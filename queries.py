@@ -0,0 +1,58 @@
+"""
+Queries
+Read query builders and row shaping shared by database.py (sync client) and
+api/async_db.py (async client), so both return the same results.
+Builders take `table`, a callable mapping a table name to a request builder
+(supabase.table or the async PostgREST client's from_), and return the
+unexecuted query.
+"""
+
+DEAL_STATUS_PREFIX = 'deals_status_'
+DEALS_CREATED_PREFIX = 'deals_created_'
+
+
+# ====================
+# BUILDERS
+# ====================
+
+def configs(table, keys):
+    return table('config').select('key, value').in_('key', list(keys))
+
+
+def statistics(table):
+    return table('statistics').select('*')
+
+
+def deal_status_counts(table):
+    return table('statistics').select('key, value').like('key', f"{DEAL_STATUS_PREFIX}%")
+
+
+def dashboard_statistics(table, day):
+    """Counters plus that day's deals_created_<day>, with updated_at"""
+    return table('statistics').select('key, value, updated_at') \
+        .or_(f"key.not.like.{DEALS_CREATED_PREFIX}*,key.eq.{DEALS_CREATED_PREFIX}{day}")
+
+
+def bot_users(table, limit=None):
+    """Bot users, newest first"""
+    query = table('bot_users').select('*').order('started_at', desc=True)
+    return query.limit(limit) if limit else query
+
+
+# ====================
+# ROW SHAPING
+# ====================
+
+def key_values(rows):
+    """{key: value} from key/value rows"""
+    return {row['key']: row['value'] for row in rows}
+
+
+def status_counts(rows):
+    """{status: count} from deals_status_<status> rows"""
+    return {row['key'][len(DEAL_STATUS_PREFIX):]: row['value'] for row in rows}
+
+
+def user_tuples(rows):
+    """(user_id, username, first_name, last_name, started_at) per bot user"""
+    return [(u['user_id'], u['username'], u['first_name'], u['last_name'], u['started_at']) for u in rows]
@@ -0,0 +1,140 @@
+"""
+Reference Data
+Read-mostly settings (config, escrow addresses, statistics, editable content, media,
+Telethon admin session) cached in memory and preloaded concurrently at startup
+"""
+import asyncio
+import logging
+import time
+import database
+
+logger = logging.getLogger(__name__)
+
+# Edits made in the admin panel show up in the bot within this long
+CACHE_SECONDS = 60
+# Per-user keys stay out of the config snapshot (read directly when needed)
+PRIVATE_CONFIG_PREFIXES = ('user_pin_',)
+WARMUP_TIMEOUT_SECONDS = 20
+
+_cache = {}  # name -> (value, loaded_at)
+
+
+def _load_media():
+    # get_media_records is newest first - keep the latest row per type
+    media = {}
+    for row in database.get_media_records() or []:
+        media.setdefault(row['file_type'], {
+            'file_path': row['file_path'],
+            'description': row['description'],
+            'file_id': row.get('file_id'),
+            'content_hash': row.get('content_hash')
+        })
+    return media
+
+
+_LOADERS = {
+    'config': lambda: database.get_all_config(PRIVATE_CONFIG_PREFIXES) or {},
+    'crypto_addresses': lambda: database.get_crypto_addresses() or [],
+    'statistics': lambda: database.get_statistics() or {},
+    'content': lambda: {key: content for key, content, _ in database.get_all_editable_content() or []},
+    'media': _load_media,
+    'admin_session': database.get_telegram_admin_session,
+}
+
+
+def _get(name):
+    entry = _cache.get(name)
+    if entry and time.time() - entry[1] < CACHE_SECONDS:
+        return entry[0]
+    value = _LOADERS[name]()
+    _cache[name] = (value, time.time())
+    return value
+
+
+def invalidate(name=None):
+    """Drop one snapshot (or all) so the next read reloads it"""
+    if name:
+        _cache.pop(name, None)
+    else:
+        _cache.clear()
+
+
+# ====================
+# READERS
+# ====================
+
+def config(key, default=None):
+    """Config value (same as database.get_config, served from the snapshot)"""
+    if key.startswith(PRIVATE_CONFIG_PREFIXES):
+        return database.get_config(key)
+    return _get('config').get(key, default)
+
+
+def set_config(key, value):
+    """Write a config value through to the database and the snapshot"""
+    database.set_config(key, value)
+    entry = _cache.get('config')
+    if entry and not key.startswith(PRIVATE_CONFIG_PREFIXES):
+        entry[0][key] = value
+
+
+def crypto_addresses():
+    return _get('crypto_addresses')
+
+
+def bot_wallet_address(network):
+    """Escrow address for a network (crypto_addresses first, then legacy wallet_* config)"""
+    return database.match_crypto_address(crypto_addresses(), network) or config(f"wallet_{network}")
+
+
+def statistics():
+    return _get('statistics')
+
+
+def content(key, default=""):
+    return _get('content').get(key, default)
+
+
+def media(file_type):
+    """Latest media_files row for a type as a dict with file_id when published (None if nothing uploaded)"""
+    return _get('media').get(file_type)
+
+
+def admin_session():
+    """Most recent Telethon admin session row"""
+    return _get('admin_session')
+
+
+# ====================
+# WARM-UP
+# ====================
+
+async def _timed(name, func):
+    started = time.perf_counter()
+    try:
+        await asyncio.to_thread(func)
+        status = "ok"
+    except Exception as e:
+        status = f"failed: {e}"
+    elapsed = (time.perf_counter() - started) * 1000
+    logger.info(f"🔥 Warm-up {name}: {elapsed:.0f} ms ({status})")
+    return name, elapsed
+
+
+async def warm_up(extra_steps=None):
+    """
+    Load every snapshot concurrently (plus any extra (name, fn) steps) before
+    the bot takes updates. Slow steps are left running after WARMUP_TIMEOUT_SECONDS.
+    """
+    steps = [(name, lambda name=name: _get(name)) for name in _LOADERS]
+    steps += list(extra_steps or [])
+
+    started = time.perf_counter()
+    tasks = [asyncio.create_task(_timed(name, func)) for name, func in steps]
+    done, pending = await asyncio.wait(tasks, timeout=WARMUP_TIMEOUT_SECONDS)
+    total = (time.perf_counter() - started) * 1000
+
+    if pending:
+        logger.warning(f"⚠️ Warm-up: {len(pending)} step(s) still loading after {WARMUP_TIMEOUT_SECONDS}s")
+    logger.info(f"✅ Warm-up finished in {total:.0f} ms ({len(done)}/{len(steps)} steps)")
+    return {task.result()[0]: round(task.result()[1]) for task in done}
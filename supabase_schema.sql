@@ -79,3 +79,328 @@ CREATE INDEX IF NOT EXISTS idx_users_user_id ON users(user_id);
 CREATE INDEX IF NOT EXISTS idx_deals_group_id ON deals(group_id);
 CREATE INDEX IF NOT EXISTS idx_bot_users_username ON bot_users(username);
 CREATE INDEX IF NOT EXISTS idx_media_files_type ON media_files(file_type);
+
+-- =============================================
+-- Deal lifecycle (see deal_states.py)
+-- created -> roles_set -> awaiting_deposit -> funded -> released/refunded/disputed/expired
+-- (release/refund go through release_pending/refund_pending until an admin confirms the payout)
+-- =============================================
+ALTER TABLE deals ADD COLUMN IF NOT EXISTS status_updated_at TIMESTAMP DEFAULT NOW();
+UPDATE deals SET status = 'created' WHERE status = 'active' OR status IS NULL;
+CREATE INDEX IF NOT EXISTS idx_deals_status_created ON deals(status, created_at);
+
+-- Per-status counters live in statistics as 'deals_status_<status>'
+-- so the admin panel and sweepers read counts without scanning deals.
+-- Zero them first so a status no deal has any more does not keep a stale count
+UPDATE statistics SET value = 0 WHERE key LIKE 'deals_status_%';
+INSERT INTO statistics (key, value)
+    SELECT 'deals_status_' || status, COUNT(*) FROM deals WHERE status IS NOT NULL GROUP BY status
+ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value;
+
+CREATE OR REPLACE FUNCTION track_deal_status_counts()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.status IS NOT NULL THEN
+        UPDATE statistics SET value = value - 1 WHERE key = 'deals_status_' || OLD.status;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.status IS NOT NULL THEN
+        INSERT INTO statistics (key, value) VALUES ('deals_status_' || NEW.status, 1)
+        ON CONFLICT (key) DO UPDATE SET value = statistics.value + 1;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS deals_status_count_insert ON deals;
+DROP TRIGGER IF EXISTS deals_status_count_update ON deals;
+DROP TRIGGER IF EXISTS deals_status_count_delete ON deals;
+CREATE TRIGGER deals_status_count_insert AFTER INSERT ON deals
+    FOR EACH ROW EXECUTE FUNCTION track_deal_status_counts();
+CREATE TRIGGER deals_status_count_update AFTER UPDATE OF status ON deals
+    FOR EACH ROW WHEN (OLD.status IS DISTINCT FROM NEW.status) EXECUTE FUNCTION track_deal_status_counts();
+CREATE TRIGGER deals_status_count_delete AFTER DELETE ON deals
+    FOR EACH ROW EXECUTE FUNCTION track_deal_status_counts();
+
+-- Archived deals (moved here by deal_sweeper.py once their group is reclaimed)
+CREATE TABLE IF NOT EXISTS deals_archive (
+    deal_id TEXT PRIMARY KEY,
+    buyer_id BIGINT,
+    seller_id BIGINT,
+    buyer_address TEXT,
+    seller_address TEXT,
+    bot_address TEXT,
+    amount DECIMAL,
+    group_id BIGINT,
+    status TEXT,
+    created_at TIMESTAMP,
+    status_updated_at TIMESTAMP,
+    updated_at TIMESTAMP,
+    group_reclaimed BOOLEAN DEFAULT FALSE,
+    archived_at TIMESTAMP DEFAULT NOW()
+);
+CREATE INDEX IF NOT EXISTS idx_deals_archive_archived ON deals_archive(archived_at);
+
+-- Deposit address pool (see address_pool.py): one escrow address per deal
+CREATE TABLE IF NOT EXISTS deposit_addresses (
+    address TEXT PRIMARY KEY,
+    network TEXT NOT NULL,
+    derivation_index INTEGER,
+    deal_id TEXT UNIQUE,
+    assigned_at TIMESTAMP,
+    created_at TIMESTAMP DEFAULT NOW()
+);
+CREATE INDEX IF NOT EXISTS idx_deposit_addresses_free ON deposit_addresses(network, created_at) WHERE deal_id IS NULL;
+
+-- Balance measured by the deposit watcher before the address can be claimed;
+-- deposits are counted on top of it, so leftover funds never fund a deal
+ALTER TABLE deposit_addresses ADD COLUMN IF NOT EXISTS baseline_amount NUMERIC;
+
+-- Claim a free address for a deal; SKIP LOCKED lets concurrent claims take different rows
+CREATE OR REPLACE FUNCTION claim_deposit_address(p_network TEXT, p_deal_id TEXT)
+RETURNS TEXT AS $$
+DECLARE
+    claimed TEXT;
+BEGIN
+    SELECT address INTO claimed FROM deposit_addresses WHERE deal_id = p_deal_id;
+    IF claimed IS NOT NULL THEN
+        RETURN claimed;
+    END IF;
+
+    UPDATE deposit_addresses SET deal_id = p_deal_id, assigned_at = NOW()
+    WHERE address = (
+        SELECT address FROM deposit_addresses
+        WHERE network = p_network AND deal_id IS NULL AND baseline_amount IS NOT NULL
+        ORDER BY created_at, derivation_index
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING address INTO claimed;
+
+    RETURN claimed;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Leaderboard (see leaderboard.py): completed (released) deals per user,
+-- maintained by trigger so the bot only reads the indexed top rows
+CREATE TABLE IF NOT EXISTS leaderboard (
+    user_id BIGINT PRIMARY KEY,
+    deals_as_buyer INTEGER DEFAULT 0,
+    deals_as_seller INTEGER DEFAULT 0,
+    total_deals INTEGER DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT NOW()
+);
+CREATE INDEX IF NOT EXISTS idx_leaderboard_total ON leaderboard(total_deals DESC);
+CREATE INDEX IF NOT EXISTS idx_leaderboard_seller ON leaderboard(deals_as_seller DESC);
+CREATE INDEX IF NOT EXISTS idx_leaderboard_buyer ON leaderboard(deals_as_buyer DESC);
+
+-- Backfill from deals already released
+INSERT INTO leaderboard (user_id, deals_as_buyer, deals_as_seller, total_deals)
+    SELECT user_id, SUM(as_buyer), SUM(as_seller), SUM(as_buyer + as_seller) FROM (
+        SELECT buyer_id AS user_id, 1 AS as_buyer, 0 AS as_seller FROM deals WHERE status = 'released' AND buyer_id <> 0
+        UNION ALL
+        SELECT seller_id AS user_id, 0 AS as_buyer, 1 AS as_seller FROM deals WHERE status = 'released' AND seller_id <> 0
+    ) completed
+    GROUP BY user_id
+ON CONFLICT (user_id) DO UPDATE SET
+    deals_as_buyer = EXCLUDED.deals_as_buyer,
+    deals_as_seller = EXCLUDED.deals_as_seller,
+    total_deals = EXCLUDED.total_deals;
+
+CREATE OR REPLACE FUNCTION track_leaderboard()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF NEW.buyer_id IS NOT NULL AND NEW.buyer_id <> 0 THEN
+        INSERT INTO leaderboard (user_id, deals_as_buyer, total_deals) VALUES (NEW.buyer_id, 1, 1)
+        ON CONFLICT (user_id) DO UPDATE SET
+            deals_as_buyer = leaderboard.deals_as_buyer + 1,
+            total_deals = leaderboard.total_deals + 1,
+            updated_at = NOW();
+    END IF;
+    IF NEW.seller_id IS NOT NULL AND NEW.seller_id <> 0 THEN
+        INSERT INTO leaderboard (user_id, deals_as_seller, total_deals) VALUES (NEW.seller_id, 1, 1)
+        ON CONFLICT (user_id) DO UPDATE SET
+            deals_as_seller = leaderboard.deals_as_seller + 1,
+            total_deals = leaderboard.total_deals + 1,
+            updated_at = NOW();
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS deals_leaderboard_release ON deals;
+CREATE TRIGGER deals_leaderboard_release AFTER UPDATE OF status ON deals
+    FOR EACH ROW WHEN (NEW.status = 'released' AND OLD.status IS DISTINCT FROM NEW.status)
+    EXECUTE FUNCTION track_leaderboard();
+
+-- Cluster coordination (see cluster.py): leases for single-writer resources
+-- (the Telethon admin session) and an event log used to broadcast cache invalidations
+CREATE TABLE IF NOT EXISTS cluster_leases (
+    name TEXT PRIMARY KEY,
+    holder TEXT NOT NULL,
+    expires_at TIMESTAMP NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS cluster_events (
+    id BIGSERIAL PRIMARY KEY,
+    channel TEXT NOT NULL,
+    payload JSONB,
+    origin TEXT,
+    created_at TIMESTAMP DEFAULT NOW()
+);
+
+-- Take (or renew) a lease; returns TRUE if the caller now holds it
+CREATE OR REPLACE FUNCTION acquire_lease(p_name TEXT, p_holder TEXT, p_ttl_seconds INTEGER)
+RETURNS BOOLEAN AS $$
+DECLARE
+    got TEXT;
+BEGIN
+    INSERT INTO cluster_leases (name, holder, expires_at)
+    VALUES (p_name, p_holder, NOW() + make_interval(secs => p_ttl_seconds))
+    ON CONFLICT (name) DO UPDATE SET
+        holder = EXCLUDED.holder,
+        expires_at = EXCLUDED.expires_at
+    WHERE cluster_leases.holder = p_holder OR cluster_leases.expires_at < NOW()
+    RETURNING holder INTO got;
+
+    RETURN got IS NOT NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Append an event and drop ones every worker has long since read
+CREATE OR REPLACE FUNCTION publish_cluster_event(p_channel TEXT, p_payload JSONB, p_origin TEXT)
+RETURNS BIGINT AS $$
+DECLARE
+    new_id BIGINT;
+BEGIN
+    INSERT INTO cluster_events (channel, payload, origin)
+    VALUES (p_channel, p_payload, p_origin)
+    RETURNING id INTO new_id;
+
+    DELETE FROM cluster_events WHERE created_at < NOW() - INTERVAL '1 hour';
+    RETURN new_id;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Job journal (see lifecycle.py): multi-step work such as group creation is
+-- recorded so a restart can finish what a shutdown or crash interrupted
+CREATE TABLE IF NOT EXISTS jobs (
+    id BIGSERIAL PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload JSONB DEFAULT '{}'::jsonb,
+    status TEXT DEFAULT 'running',  -- running, interrupted, done, failed, resumed, abandoned
+    created_at TIMESTAMP DEFAULT NOW(),
+    updated_at TIMESTAMP DEFAULT NOW()
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_unfinished ON jobs(updated_at) WHERE status IN ('running', 'interrupted');
+
+-- Admin Telegram sessions (same definition as CREATE_TELEGRAM_SESSIONS_TABLE.sql)
+CREATE TABLE IF NOT EXISTS telegram_sessions (
+    id SERIAL PRIMARY KEY,
+    session_string TEXT NOT NULL,
+    phone TEXT UNIQUE NOT NULL,
+    user_id BIGINT,
+    username TEXT,
+    first_name TEXT,
+    last_name TEXT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+CREATE INDEX IF NOT EXISTS idx_telegram_sessions_phone ON telegram_sessions(phone);
+CREATE INDEX IF NOT EXISTS idx_telegram_sessions_user_id ON telegram_sessions(user_id);
+
+-- Telethon access hashes (bot user, recent escrow groups) kept with the admin
+-- session so group creation/revocation needs no username/id resolution calls
+ALTER TABLE telegram_sessions ADD COLUMN IF NOT EXISTS entity_cache JSONB DEFAULT '{}'::jsonb;
+
+-- Admin panel logins between "send code" and sign-in, keyed by the id kept in
+-- the panel's session cookie, so any instance can continue the login
+CREATE TABLE IF NOT EXISTS telegram_logins (
+    login_id TEXT PRIMARY KEY,
+    phone TEXT NOT NULL,
+    phone_code_hash TEXT NOT NULL,
+    session_string TEXT NOT NULL,
+    expires_at TIMESTAMP NOT NULL
+);
+
+-- =============================================
+-- Dashboard aggregate (admin panel)
+-- users_count and deals_created_<YYYY-MM-DD> are kept current by triggers,
+-- and updated_at tells the panel when anything last changed (Last-Modified)
+-- =============================================
+INSERT INTO statistics (key, value)
+    SELECT 'users_count', COUNT(*) FROM bot_users
+ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value;
+
+INSERT INTO statistics (key, value)
+    SELECT 'deals_created_' || TO_CHAR(created_at, 'YYYY-MM-DD'), COUNT(*) FROM deals
+    WHERE created_at >= CURRENT_DATE GROUP BY 1
+ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value;
+
+CREATE OR REPLACE FUNCTION touch_statistics()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.updated_at = NOW();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS statistics_touch ON statistics;
+CREATE TRIGGER statistics_touch BEFORE UPDATE ON statistics
+    FOR EACH ROW EXECUTE FUNCTION touch_statistics();
+
+CREATE OR REPLACE FUNCTION track_users_count()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO statistics (key, value) VALUES ('users_count', CASE WHEN TG_OP = 'INSERT' THEN 1 ELSE -1 END)
+    ON CONFLICT (key) DO UPDATE SET value = statistics.value + EXCLUDED.value;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS bot_users_count ON bot_users;
+CREATE TRIGGER bot_users_count AFTER INSERT OR DELETE ON bot_users
+    FOR EACH ROW EXECUTE FUNCTION track_users_count();
+
+CREATE OR REPLACE FUNCTION track_deals_created()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO statistics (key, value) VALUES ('deals_created_' || TO_CHAR(COALESCE(NEW.created_at, NOW()), 'YYYY-MM-DD'), 1)
+    ON CONFLICT (key) DO UPDATE SET value = statistics.value + 1;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS deals_created_count ON deals;
+CREATE TRIGGER deals_created_count AFTER INSERT ON deals
+    FOR EACH ROW EXECUTE FUNCTION track_deals_created();
+
+-- Media published to Telegram from the admin panel: the bot sends by file_id
+-- (no re-upload per send); content_hash skips re-publishing an unchanged file
+ALTER TABLE media_files ADD COLUMN IF NOT EXISTS file_id TEXT;
+ALTER TABLE media_files ADD COLUMN IF NOT EXISTS content_hash TEXT;
+
+-- Who created a deal, for the per-user open deal cap (see deal_groups.py);
+-- buyer_id changes when roles are declared, creator_id never does
+ALTER TABLE deals ADD COLUMN IF NOT EXISTS creator_id BIGINT;
+ALTER TABLE deals_archive ADD COLUMN IF NOT EXISTS creator_id BIGINT;
+UPDATE deals SET creator_id = buyer_id WHERE creator_id IS NULL;
+CREATE INDEX IF NOT EXISTS idx_deals_creator_status ON deals(creator_id, status);
+
+-- Chunked admin panel uploads (see api/index.py): the manifest and the verified
+-- parts live here, not on one instance's disk, so any serverless invocation can
+-- take a part or assemble the file. Parts are base64 and go with their upload.
+CREATE TABLE IF NOT EXISTS uploads (
+    upload_id TEXT PRIMARY KEY,
+    filename TEXT NOT NULL,
+    size BIGINT NOT NULL,
+    chunk_size INTEGER NOT NULL,
+    total_parts INTEGER NOT NULL,
+    expires_at TIMESTAMP NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS upload_parts (
+    upload_id TEXT REFERENCES uploads(upload_id) ON DELETE CASCADE,
+    part_index INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (upload_id, part_index)
+);
@@ -3,15 +3,42 @@ Telegram Group Manager
 Creates escrow groups using admin session from Supabase database
 """
 import os
+import asyncio
+import contextlib
+import functools
 import logging
-from telethon import TelegramClient
+import time
+from telethon import TelegramClient, errors
 from telethon.sessions import StringSession
-from telethon.tl.functions.channels import CreateChannelRequest, InviteToChannelRequest
-from telethon.tl.types import InputPeerUser
+from telethon.tl.functions.channels import CreateChannelRequest, InviteToChannelRequest, EditAdminRequest
+from telethon.tl.functions.messages import ExportChatInviteRequest
+from telethon.tl.types import InputPeerUser, InputPeerChannel, InputUserSelf, ChatAdminRights
+from telethon import utils
+import cluster
 import database
+import reference_data
 
 logger = logging.getLogger(__name__)
 
+# One instance at a time drives the admin account (a session used from two places gets revoked)
+SESSION_LEASE = 'telethon_admin_session'
+
+def session_lease():
+    """Cluster-wide admin session lease (nothing to coordinate on a single instance)"""
+    return cluster.coordinator.lease(SESSION_LEASE) if cluster.MULTI else contextlib.nullcontext()
+
+def exclusive_session(func):
+    """Run a Telethon operation while holding the cluster-wide admin session lease"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        try:
+            async with session_lease():
+                return await func(*args, **kwargs)
+        except cluster.LeaseUnavailable as e:
+            logger.warning(f"⏳ {func.__name__}: {e}")
+            return {'success': False, 'error': str(e)}
+    return wrapper
+
 def get_credentials():
     """
     Get Telethon credentials from environment or database
@@ -24,8 +51,8 @@ def get_credentials():
     # If not in env, try database
     if not api_id or not api_hash:
         try:
-            api_id = database.get_config('telegram_api_id')
-            api_hash = database.get_config('telegram_api_hash')
+            api_id = reference_data.config('telegram_api_id')
+            api_hash = reference_data.config('telegram_api_hash')
         except Exception as e:
             logger.error(f"Error fetching API credentials from DB: {e}")
             
@@ -45,20 +72,161 @@ def get_admin_session():
     Returns: session_string or None
     """
     try:
-        session_data = database.get_telegram_admin_session()
+        session_data = reference_data.admin_session()
         if session_data and session_data.get('session_string'):
             logger.info(f"✅ Found admin session for User ID: {session_data.get('user_id')}")
             return session_data['session_string']
         else:
             logger.error("❌ No admin Telegram session found in database")
+            reference_data.invalidate('admin_session')
             return None
     except Exception as e:
         logger.error(f"❌ Error fetching admin session: {e}")
         return None
 
-async def create_escrow_group(deal_id, bot_username=None):
+class EntityCache:
     """
-    Create a Telegram escrow group using admin session
+    Access hashes persisted with the admin session (telegram_sessions.entity_cache).
+    StringSession keeps no entities, so without this every call re-resolves the bot
+    by username and channels by id.
+    """
+    MAX_CHANNELS = 200
+
+    def __init__(self, session_row):
+        self.row = session_row or {}
+        data = self.row.get('entity_cache') or {}
+        self.users = dict(data.get('users', {}))        # username (lowercase) -> [user_id, access_hash]
+        self.channels = dict(data.get('channels', {}))  # channel id (str) -> access_hash, oldest first
+        self.dirty = False
+        self._dialogs_loaded = False
+
+    async def input_user(self, client, username):
+        """InputPeerUser for a username (resolved once, then from the cache)"""
+        key = username.lower().lstrip('@')
+        entry = self.users.get(key)
+        if entry:
+            return InputPeerUser(entry[0], entry[1])
+        peer = await client.get_input_entity(username)
+        self.users[key] = [peer.user_id, peer.access_hash]
+        self.dirty = True
+        return peer
+
+    def add_channel(self, channel_id, access_hash):
+        key = str(channel_id)
+        self.channels.pop(key, None)
+        self.channels[key] = access_hash
+        while len(self.channels) > self.MAX_CHANNELS:
+            self.channels.pop(next(iter(self.channels)))
+        self.dirty = True
+        return InputPeerChannel(int(channel_id), access_hash)
+
+    def forget_channel(self, channel_id):
+        if self.channels.pop(str(channel_id), None) is not None:
+            self.dirty = True
+
+    async def input_channel(self, client, group_id):
+        """InputPeerChannel for a Bot API (-100...) or Telethon group id; ValueError if unknown"""
+        channel_id, _ = utils.resolve_id(int(group_id))
+        access_hash = self.channels.get(str(channel_id))
+        if access_hash is not None:
+            return InputPeerChannel(channel_id, access_hash)
+
+        if not self._dialogs_loaded:
+            # Groups created before the cache existed - one dialog load fills them all in
+            self._dialogs_loaded = True
+            for dialog in await client.get_dialogs(limit=None):
+                entity = dialog.entity
+                if getattr(entity, 'megagroup', False) and getattr(entity, 'access_hash', None) is not None:
+                    self.add_channel(entity.id, entity.access_hash)
+            access_hash = self.channels.get(str(channel_id))
+            if access_hash is not None:
+                return InputPeerChannel(channel_id, access_hash)
+
+        raise ValueError(f"Unknown group {group_id}")
+
+    async def save(self):
+        """Persist if anything was learned (the snapshot row is updated in place too)"""
+        if not self.dirty or not self.row.get('id'):
+            return
+        data = {'users': self.users, 'channels': self.channels}
+        self.row['entity_cache'] = data
+        await asyncio.to_thread(database.save_telegram_entity_cache, self.row['id'], data)
+        self.dirty = False
+
+# ====================
+# PROVISIONING STEPS
+# ====================
+
+# Each step is retried on its own; the others keep their results
+STEP_ATTEMPTS = 3
+# Flood waits longer than this fail the step instead of stalling the user
+MAX_FLOOD_WAIT_SECONDS = 10
+# Steps that make the bot a group admin; if any gives up, the group is unusable
+BOT_STEPS = ('resolve_bot', 'invite_bot', 'promote_bot')
+
+BOT_ADMIN_RIGHTS = dict(
+    change_info=True, post_messages=True, edit_messages=True, delete_messages=True,
+    ban_users=True, invite_users=True, pin_messages=True, add_admins=False,
+    anonymous=False, manage_call=False, other=True
+)
+# anonymous=True hides the creator from the member list
+CREATOR_ADMIN_RIGHTS = dict(
+    change_info=True, post_messages=True, edit_messages=True, delete_messages=True,
+    ban_users=True, invite_users=True, pin_messages=True, add_admins=True,
+    anonymous=True, manage_call=True, other=True
+)
+
+
+async def run_step(steps, name, func, attempts=STEP_ATTEMPTS):
+    """
+    Run one provisioning step with retries, recording its outcome in `steps`
+    ({name: {'ok', 'ms', 'attempts', 'error'}}). Returns func's result, or None if it failed.
+    """
+    started = time.perf_counter()
+    error = None
+    for attempt in range(1, attempts + 1):
+        try:
+            value = await func()
+            steps[name] = {'ok': True, 'ms': round((time.perf_counter() - started) * 1000), 'attempts': attempt}
+            return value
+        except errors.FloodWaitError as e:
+            error = e
+            if e.seconds > MAX_FLOOD_WAIT_SECONDS or attempt == attempts:
+                break
+            await asyncio.sleep(e.seconds)
+        except Exception as e:
+            error = e
+            if attempt < attempts:
+                await asyncio.sleep(attempt)
+        logger.warning(f"⚠️ Step {name} attempt {attempt} failed: {error}")
+
+    logger.error(f"❌ Step {name} failed: {error}")
+    steps[name] = {
+        'ok': False,
+        'ms': round((time.perf_counter() - started) * 1000),
+        'attempts': attempt,
+        'error': str(error)
+    }
+    return None
+
+
+def format_step_timings(steps):
+    return ", ".join(
+        f"{name} {step['ms']} ms" + ("" if step['ok'] else " (failed)") for name, step in steps.items()
+    )
+
+@exclusive_session
+async def create_escrow_group(deal_id, bot_username=None, on_created=None):
+    """
+    Create a Telegram escrow group using admin session.
+    Once the group exists, adding the bot (invite -> promote), hiding the creator and
+    exporting the invite link run concurrently, each retried on its own.
+    Returns {'success', 'group_id', 'invite_link', 'steps', 'failed_steps'} or 'error'
+    ('steps' holds per-step timings; 'failed_steps' lists optional steps that gave up).
+    A group without an invite link or without the bot as admin is a failure; its
+    'group_id' is still returned so the caller can delete it.
+    on_created(group_id) is called as soon as the group exists, before the slower
+    steps, so the caller can record it even if this call never returns.
     """
     # Get credentials dynamically
     api_id, api_hash = get_credentials()
@@ -69,6 +237,7 @@ async def create_escrow_group(deal_id, bot_username=None):
             'error': 'Configuration Error: API ID or Hash is missing. Please set them in the Admin Dashboard > Settings > Telegram.'
         }
     client = None
+    final_group_id = None
     try:
         # Get admin session from database
         session_string = get_admin_session()
@@ -84,10 +253,13 @@ async def create_escrow_group(deal_id, bot_username=None):
             api_id,
             api_hash
         )
+        cache = EntityCache(reference_data.admin_session())
         
         await client.connect()
         
         if not await client.is_user_authorized():
+            # Pick up a fresh login from the admin panel on the next attempt
+            reference_data.invalidate('admin_session')
             return {
                 'success': False,
                 'error': 'Admin session expired. Please re-login via admin panel.'
@@ -96,111 +268,24 @@ async def create_escrow_group(deal_id, bot_username=None):
         # Create the escrow group
         logger.info(f"🔨 Creating escrow group for deal #{deal_id}...")
         
-        result = await client(CreateChannelRequest(
+        steps = {}
+        started = time.perf_counter()
+        result = await run_step(steps, 'create_group', lambda: client(CreateChannelRequest(
             title=f"Escrow #{deal_id}",
             about=f"Escrow transaction #{deal_id}",
             megagroup=True  # Create as supergroup
-        ))
+        )), attempts=1)  # not idempotent - a retry after a lost reply would make a second group
+        if result is None:
+            await client.disconnect()
+            return {'success': False, 'error': steps['create_group']['error'], 'steps': steps}
         
-        # Get the created group
+        # Get the created group (its access hash comes with it - no lookup needed later)
         group = result.chats[0]
         group_id = group.id
+        channel = cache.add_channel(group.id, group.access_hash)
         
         logger.info(f"✅ Group created! ID: {group_id}")
 
-        # ------------------------------------------------------------------
-        # ADD BOT AND PROMOTE TO ADMIN
-        # ------------------------------------------------------------------
-        if bot_username:
-            try:
-                # 1. Invite Bot
-                from telethon.tl.functions.channels import InviteToChannelRequest, EditAdminRequest
-                from telethon.tl.types import ChatAdminRights
-                
-                logger.info(f"🤖 Adding bot @{bot_username} to group...")
-                await client(InviteToChannelRequest(group_id, [bot_username]))
-                
-                # 2. Promote Bot to Admin
-                # Give full rights (delete msgs, pin, invite, etc)
-                rights = ChatAdminRights(
-                    change_info=True,
-                    post_messages=True,
-                    edit_messages=True,
-                    delete_messages=True,
-                    ban_users=True,
-                    invite_users=True,
-                    pin_messages=True,
-                    add_admins=False,
-                    anonymous=False,
-                    manage_call=False,
-                    other=True
-                )
-                
-                logger.info(f"👑 Promoting bot @{bot_username} to Admin...")
-                await client(EditAdminRequest(
-                    channel=group_id,
-                    user_id=bot_username,
-                    admin_rights=rights,
-                    rank="Escrow Bot"
-                ))
-                logger.info("✅ Bot added and promoted successfully!")
-
-                # 3. Make Creator Anonymous (so they don't show in member list)
-                try:
-                    me = await client.get_me()
-                    logger.info(f"🕵️ Making Creator (ID: {me.id}) Anonymous...")
-                    
-                    creator_rights = ChatAdminRights(
-                        change_info=True,
-                        post_messages=True,
-                        edit_messages=True,
-                        delete_messages=True,
-                        ban_users=True,
-                        invite_users=True,
-                        pin_messages=True,
-                        add_admins=True,
-                        anonymous=True, # <--- KEY: Hides from member list
-                        manage_call=True,
-                        other=True
-                    )
-                    
-                    await client(EditAdminRequest(
-                        channel=group_id,
-                        user_id=me,
-                        admin_rights=creator_rights,
-                        rank="System"
-                    ))
-                    logger.info("✅ Creator is now Anonymous")
-                except Exception as anon_err:
-                     logger.error(f"⚠️ Failed to make creator anonymous: {anon_err}")
-
-            except Exception as bot_err:
-                logger.error(f"⚠️ Failed to add/promote bot: {bot_err}")
-                # Continue execution, don't fail the whole process
-        # ------------------------------------------------------------------
-        
-        # Get invite link
-        try:
-            full_channel = await client.get_entity(group_id)
-            if hasattr(full_channel, 'username') and full_channel.username:
-                invite_link = f"https://t.me/{full_channel.username}"
-            else:
-                # Create invite link
-                from telethon.tl.functions.messages import ExportChatInviteRequest
-                invite_result = await client(ExportChatInviteRequest(peer=group_id))
-                invite_link = invite_result.link
-        except Exception as link_error:
-            # Fallback: try to export invite
-            logger.warning(f"Could not get channel entity, exporting invite: {link_error}")
-            from telethon.tl.functions.messages import ExportChatInviteRequest
-            invite_result = await client(ExportChatInviteRequest(peer=group_id))
-            invite_link = invite_result.link
-        
-        logger.info(f"🔗 Invite link: {invite_link}")
-        
-        
-        await client.disconnect()
-        
         # Normalize Group ID for Bot API (Supergroups need -100 prefix)
         # Telethon returns positive ID for channels/supergroups (e.g. 12345)
         # Bot API sees them as -10012345
@@ -210,11 +295,84 @@ async def create_escrow_group(deal_id, bot_username=None):
         elif group_id > 0:
             final_group_id = int(f"-100{group_id}")
             logger.info(f"Converted Telethon ID {group_id} to Bot API ID {final_group_id}")
+
+        if on_created:
+            on_created(final_group_id)
+
+        # ------------------------------------------------------------------
+        # INDEPENDENT STEPS (concurrent over the one connection)
+        # ------------------------------------------------------------------
+        async def add_bot():
+            # Promote needs the bot in the group; retrying promote does not re-invite
+            bot = await run_step(steps, 'resolve_bot', lambda: cache.input_user(client, bot_username))
+            if bot is None:
+                return
+            logger.info(f"🤖 Adding bot @{bot_username} to group...")
+            if await run_step(steps, 'invite_bot', lambda: client(InviteToChannelRequest(channel, [bot]))) is None:
+                return
+            logger.info(f"👑 Promoting bot @{bot_username} to Admin...")
+            await run_step(steps, 'promote_bot', lambda: client(EditAdminRequest(
+                channel=channel,
+                user_id=bot,
+                admin_rights=ChatAdminRights(**BOT_ADMIN_RIGHTS),
+                rank="Escrow Bot"
+            )))
+
+        async def hide_creator():
+            logger.info(f"🕵️ Making Creator (ID: {cache.row.get('user_id')}) Anonymous...")
+            await run_step(steps, 'hide_creator', lambda: client(EditAdminRequest(
+                channel=channel,
+                user_id=InputUserSelf(),
+                admin_rights=ChatAdminRights(**CREATOR_ADMIN_RIGHTS),
+                rank="System"
+            )))
+
+        # A new megagroup never has a public username, so export a link
+        async def export_invite():
+            return await run_step(steps, 'export_invite', lambda: client(ExportChatInviteRequest(peer=channel)))
+
+        tasks = [hide_creator(), export_invite()]
+        if bot_username:
+            tasks.append(add_bot())
+        invite_result = (await asyncio.gather(*tasks))[1]
+
+        await cache.save()
+        await client.disconnect()
+
+        total_ms = round((time.perf_counter() - started) * 1000)
+        logger.info(f"⏱️ Group for deal #{deal_id} provisioned in {total_ms} ms: {format_step_timings(steps)}")
+        failed_steps = [name for name, step in steps.items() if not step['ok']]
+
+        if invite_result is None:
+            # Nobody can join without a link - report the group so it can be cleaned up
+            return {
+                'success': False,
+                'error': f"Could not create invite link: {steps['export_invite']['error']}",
+                'group_id': final_group_id,
+                'steps': steps,
+                'failed_steps': failed_steps
+            }
+
+        bot_failed = [name for name in BOT_STEPS if name in failed_steps]
+        if bot_failed:
+            # The deal runs through the bot - a group it is not admin of is useless
+            return {
+                'success': False,
+                'error': f"Could not add the bot to the group: {steps[bot_failed[0]]['error']}",
+                'group_id': final_group_id,
+                'steps': steps,
+                'failed_steps': failed_steps
+            }
+
+        invite_link = invite_result.link
+        logger.info(f"🔗 Invite link: {invite_link}")
         
         return {
             'success': True,
             'group_id': final_group_id,
-            'invite_link': invite_link
+            'invite_link': invite_link,
+            'steps': steps,
+            'failed_steps': failed_steps
         }
         
     except Exception as e:
@@ -224,9 +382,11 @@ async def create_escrow_group(deal_id, bot_username=None):
         
         return {
             'success': False,
-            'error': str(e)
+            'error': str(e),
+            'group_id': final_group_id  # set once the group exists, so it can be cleaned up
         }
 
+@exclusive_session
 async def revoke_group_invites(group_id):
     """
     Revoke all invite links for a group to close it to new members
@@ -242,25 +402,25 @@ async def revoke_group_invites(group_id):
             return {'success': False, 'error': 'No admin session found'}
             
         client = TelegramClient(StringSession(session_string), api_id, api_hash)
+        cache = EntityCache(reference_data.admin_session())
         await client.connect()
         
         if not await client.is_user_authorized():
+            # Pick up a fresh login from the admin panel on the next attempt
+            reference_data.invalidate('admin_session')
             return {'success': False, 'error': 'Admin session expired'}
             
-        # Telethon uses positive IDs (usually) but sometimes handles -100
-        # If DB passed -100 ID, we need to convert it back?
-        # get_entity usually handles it if input is int
-        # But if it's -100123... Telethon expects 123... (channel id) or -100123... (chat_id)
-        # Let's try direct use first.
-        
         try:
+            # Bot API -100 id -> cached InputPeerChannel (no resolution round-trip)
+            channel = await cache.input_channel(client, group_id)
+
             # 1. Get Exported Invites
             from telethon.tl.functions.messages import GetExportedChatInvitesRequest, EditExportedChatInviteRequest
             
             # Fetch existing invites
             result = await client(GetExportedChatInvitesRequest(
-                peer=group_id,
-                admin_id=await client.get_me(), # Invites created by admin
+                peer=channel,
+                admin_id=InputUserSelf(), # Invites created by admin
                 limit=10
             ))
             
@@ -269,13 +429,14 @@ async def revoke_group_invites(group_id):
                 if not invite.revoked:
                     # Revoke it
                     await client(EditExportedChatInviteRequest(
-                        peer=group_id,
+                        peer=channel,
                         link=invite.link,
                         revoked=True
                     ))
                     count += 1
             
             logger.info(f"🔒 Revoked {count} invite links for group {group_id}")
+            await cache.save()
             return {'success': True, 'revoked_count': count}
             
         except Exception as e:
@@ -289,6 +450,82 @@ async def revoke_group_invites(group_id):
         if client:
             await client.disconnect()
 
+async def delete_groups(group_ids, delay=1.5):
+    """
+    Delete escrow groups (admin account is the creator) one by one,
+    pausing `delay` seconds between calls to stay under Telegram rate limits.
+    The session lease is taken per group, so group creation can run in the pauses.
+    Stops early on FloodWait so the caller can retry the rest later.
+    """
+    from telethon.errors import FloodWaitError, ChannelInvalidError, ChannelPrivateError
+    from telethon.tl.functions.channels import DeleteChannelRequest
+
+    report = {'success': True, 'deleted': [], 'failed': {}, 'flood_wait': 0}
+    if not group_ids:
+        return report
+
+    api_id, api_hash = get_credentials()
+    if not api_id or not api_hash:
+        return {**report, 'success': False, 'error': 'Missing API credentials'}
+
+    client = None
+    try:
+        session_string = get_admin_session()
+        if not session_string:
+            return {**report, 'success': False, 'error': 'No admin session found'}
+
+        client = TelegramClient(StringSession(session_string), api_id, api_hash)
+        cache = EntityCache(reference_data.admin_session())
+
+        for group_id in group_ids:
+            try:
+                async with session_lease():
+                    await client.connect()
+                    try:
+                        if not await client.is_user_authorized():
+                            # Pick up a fresh login from the admin panel on the next attempt
+                            reference_data.invalidate('admin_session')
+                            report.update(success=False, error='Admin session expired')
+                            break
+                        # Cached access hash; groups from before the cache existed load dialogs once
+                        entity = await cache.input_channel(client, group_id)
+                        await client(DeleteChannelRequest(entity))
+                    finally:
+                        # Only use the session while holding the lease
+                        await client.disconnect()
+                report['deleted'].append(group_id)
+                logger.info(f"🗑️ Deleted group {group_id}")
+            except cluster.LeaseUnavailable as e:
+                logger.warning(f"⏳ delete_groups: {e}")
+                report.update(success=False, error=str(e))
+                break
+            except (ChannelInvalidError, ChannelPrivateError):
+                # Already deleted or we are no longer in it - nothing left to reclaim
+                # (an entity that cannot be resolved is a failure, not proof the group is gone)
+                report['deleted'].append(group_id)
+                logger.info(f"Group {group_id} already gone")
+            except FloodWaitError as e:
+                report['flood_wait'] = e.seconds
+                logger.warning(f"FloodWait while deleting groups, stopping batch ({e.seconds}s)")
+                break
+            except Exception as e:
+                report['failed'][group_id] = str(e)
+                logger.error(f"Error deleting group {group_id}: {e}")
+
+            if group_id in report['deleted']:
+                cache.forget_channel(utils.resolve_id(int(group_id))[0])
+            await asyncio.sleep(delay)
+
+        await cache.save()
+        return report
+
+    except Exception as e:
+        logger.error(f"Error in delete_groups: {e}")
+        return {**report, 'success': False, 'error': str(e)}
+    finally:
+        if client:
+            await client.disconnect()
+
 def format_group_created_message(deal_id, invite_link):
     """
     Format the success message when a group is created
@@ -1,17 +1,21 @@
 """
 Telethon Microservice for Telegram Group Creation
-Runs as a separate Flask service to avoid event loop conflicts with main bot
+Async HTTP service on the Telethon event loop: creations are submitted as jobs
+and polled, with a bounded number running at once
 """
 import os
+import json
 import logging
-from flask import Flask, request, jsonify
-from telethon import TelegramClient
+import random
+import time
+import uuid
+from contextlib import contextmanager
+from telethon import TelegramClient, events
 from telethon.tl.functions.channels import CreateChannelRequest, InviteToChannelRequest, EditAdminRequest
 from telethon.tl.functions.messages import ExportChatInviteRequest
 from telethon.tl.types import ChatAdminRights
 from dotenv import load_dotenv
 import asyncio
-import threading
 
 # Load environment variables
 load_dotenv()
@@ -23,46 +27,76 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-from bot_error_wrapper import handle_errors, safe_call
-
-# Flask app
-app = Flask(__name__)
-
 # Telethon configuration
 API_ID = int(os.getenv('API_ID', '0'))
 API_HASH = os.getenv('API_HASH', '')
 PHONE_NUMBER = os.getenv('PHONE_NUMBER', '')
 
-# Global Telethon client and event loop
-client = None
-loop = None
-loop_thread = None
-
-def run_async_loop(loop):
-    """Run event loop in background thread"""
-    asyncio.set_event_loop(loop)
-    loop.run_forever()
+# Service configuration
+PORT = int(os.getenv('TELETHON_SERVICE_PORT', '5001'))
+# Creations running at once (more would only collect flood waits on the one account)
+MAX_CONCURRENT_CREATIONS = int(os.getenv('TELETHON_MAX_CONCURRENT', '3'))
+# Finished jobs stay pollable this long
+JOB_RETENTION_SECONDS = int(os.getenv('TELETHON_JOB_RETENTION_SECONDS', '3600'))
+# Largest request body accepted (job payloads are a few hundred bytes of JSON)
+MAX_BODY_BYTES = 8 * 1024
+# How long the legacy /create-group endpoint waits for its job
+CREATE_WAIT_SECONDS = 120
+# Stub mode: fake groups, no Telegram account needed (local testing)
+STUB_MODE = os.getenv('TELETHON_STUB', '').lower() in ('1', 'true', 'yes')
+STUB_DELAY_SECONDS = float(os.getenv('TELETHON_STUB_DELAY', '1.5'))
+# Upper bound for the bot's reply to /start (creation continues once it passes)
+WELCOME_TIMEOUT = 4
 
-def run_coroutine_threadsafe(coro):
-    """Run a coroutine in the background event loop thread"""
-    global loop
-    future = asyncio.run_coroutine_threadsafe(coro, loop)
-    return future.result()
+# Global Telethon client (lives on the service's event loop)
+client = None
+client_lock = asyncio.Lock()
+creation_slots = asyncio.Semaphore(MAX_CONCURRENT_CREATIONS)
 
-@safe_call
 async def init_client():
     """Initialize Telethon client"""
     global client
-    if client is None or not client.is_connected():
-        client = TelegramClient('user_session', API_ID, API_HASH)
-        await client.connect()
-        if not await client.is_user_authorized():
-            logger.error("Telethon client not authorized! Run auth_telethon.py first.")
-            raise Exception("Client not authorized")
-        logger.info("Telethon client initialized and authorized")
+    async with client_lock:
+        if client is None or not client.is_connected():
+            client = TelegramClient('user_session', API_ID, API_HASH)
+            await client.connect()
+            if not await client.is_user_authorized():
+                logger.error("Telethon client not authorized! Run auth_telethon.py first.")
+                raise Exception("Client not authorized")
+            logger.info("Telethon client initialized and authorized")
     return client
 
-@safe_call
+@contextmanager
+def expect(builder, check=None):
+    """
+    Listen for an event before triggering it. Yields wait(timeout), which gives
+    the first matching event or None on timeout; the handler goes away on exit.
+    """
+    future = asyncio.get_running_loop().create_future()
+
+    async def handler(event):
+        if not future.done() and (check is None or check(event)):
+            future.set_result(event)
+
+    async def wait(timeout):
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    client.add_event_handler(handler, builder)
+    try:
+        yield wait
+    finally:
+        client.remove_event_handler(handler, builder)
+
+async def create_stub_group(buyer_id, seller_id, bot_username, deal_id):
+    """Stub mode stand-in for create_telegram_group_async"""
+    await asyncio.sleep(STUB_DELAY_SECONDS)
+    group_id = random.randint(10**9, 2 * 10**9)
+    logger.info(f"🧪 Stub group {group_id} for deal #{deal_id}")
+    return group_id, f"https://t.me/+stub{uuid.uuid4().hex[:16]}"
+
 async def create_telegram_group_async(buyer_id, seller_id, bot_username, deal_id):
     """
     Create a Telegram group for escrow with anonymous creator and bot as admin
@@ -148,6 +182,7 @@ async def create_telegram_group_async(buyer_id, seller_id, bot_username, deal_id
             )
             
             # Using positional arguments for EditAdminRequest
+            # (the request returning is the confirmation - no wait needed)
             await client(EditAdminRequest(
                 channel_entity,
                 bot_entity,
@@ -156,9 +191,6 @@ async def create_telegram_group_async(buyer_id, seller_id, bot_username, deal_id
             ))
             logger.info(f"✅ Bot promoted to admin")
             
-            # Wait for permissions to take effect
-            await asyncio.sleep(2)
-            
         except Exception as bot_error:
             logger.error(f"❌ Error adding/promoting bot: {bot_error}")
             import traceback
@@ -167,9 +199,15 @@ async def create_telegram_group_async(buyer_id, seller_id, bot_username, deal_id
         
         # Step 3: Send /start command automatically
         try:
-            await client.send_message(channel_entity, '/start')
-            logger.info(f"✅ Sent /start command")
-            await asyncio.sleep(2)  # Wait for bot to process and respond
+            with expect(events.NewMessage(chats=channel_entity, from_users=bot_entity)) as welcomed:
+                await client.send_message(channel_entity, '/start')
+                logger.info(f"✅ Sent /start command")
+                # Wait for the bot's reply (it is then set up in the group), not a fixed pause
+                started = time.monotonic()
+                if await welcomed(WELCOME_TIMEOUT):
+                    logger.info(f"✅ Bot replied in {time.monotonic() - started:.2f}s")
+                else:
+                    logger.warning(f"Bot did not reply to /start within {WELCOME_TIMEOUT}s")
         except Exception as start_error:
             logger.warning(f"Could not send /start: {start_error}")
         
@@ -186,83 +224,214 @@ async def create_telegram_group_async(buyer_id, seller_id, bot_username, deal_id
         traceback.print_exc()
         raise
 
-@app.route('/health', methods=['GET'])
-def health():
+# ====================
+# JOBS
+# ====================
+
+# job_id -> {'job_id', 'deal_id', 'status', 'result', 'error', timestamps}
+# status: queued -> running -> done | failed
+jobs = {}
+jobs_by_deal = {}   # deal_id -> job_id (a resubmitted deal gets its existing job)
+job_events = {}     # job_id -> asyncio.Event set when the job finishes
+
+def job_view(job):
+    """Public fields of a job (what the status endpoint returns)"""
+    return {key: value for key, value in job.items() if not key.startswith('_')}
+
+def prune_jobs():
+    """Forget finished jobs older than JOB_RETENTION_SECONDS"""
+    cutoff = time.time() - JOB_RETENTION_SECONDS
+    for job_id in [j for j, job in jobs.items() if (job['finished_at'] or time.time()) < cutoff]:
+        job = jobs.pop(job_id)
+        job_events.pop(job_id, None)
+        if jobs_by_deal.get(job['deal_id']) == job_id:
+            del jobs_by_deal[job['deal_id']]
+
+async def run_job(job):
+    """Run one creation once a slot is free"""
+    async with creation_slots:
+        job['status'] = 'running'
+        job['started_at'] = time.time()
+        create = create_stub_group if STUB_MODE else create_telegram_group_async
+        try:
+            group_id, invite_link = await create(
+                job['_args']['buyer_id'], job['_args']['seller_id'], job['_args']['bot_username'], job['deal_id']
+            )
+            job['result'] = {'group_id': group_id, 'invite_link': invite_link, 'deal_id': job['deal_id']}
+            job['status'] = 'done'
+        except Exception as e:
+            job['error'] = str(e)
+            job['status'] = 'failed'
+        finally:
+            job['finished_at'] = time.time()
+            logger.info(
+                f"Job {job['job_id']} (deal #{job['deal_id']}) {job['status']} in "
+                f"{job['finished_at'] - job['started_at']:.1f}s "
+                f"(queued {job['started_at'] - job['created_at']:.1f}s)"
+            )
+            job_events[job['job_id']].set()
+
+def submit_job(data):
+    """Queue a creation; returns the job (an existing one if this deal was already submitted)"""
+    prune_jobs()
+    existing = jobs.get(jobs_by_deal.get(data['deal_id']))
+    if existing and existing['status'] != 'failed':
+        return existing
+
+    job = {
+        'job_id': uuid.uuid4().hex,
+        'deal_id': data['deal_id'],
+        'status': 'queued',
+        'result': None,
+        'error': None,
+        'created_at': time.time(),
+        'started_at': None,
+        'finished_at': None,
+        '_args': {field: data[field] for field in ('buyer_id', 'seller_id', 'bot_username')}
+    }
+    jobs[job['job_id']] = job
+    jobs_by_deal[job['deal_id']] = job['job_id']
+    job_events[job['job_id']] = asyncio.Event()
+    job['_task'] = asyncio.create_task(run_job(job))
+    return job
+
+def validate(data):
+    """Error message for a bad creation request, else None"""
+    if not data:
+        return 'No data provided'
+    for field in ['buyer_id', 'seller_id', 'bot_username', 'deal_id']:
+        if field not in data:
+            return f'Missing required field: {field}'
+    return None
+
+# ====================
+# ENDPOINTS
+# ====================
+
+async def health(data):
     """Health check endpoint"""
+    is_connected = client is not None and client.is_connected()
+    running = sum(1 for job in jobs.values() if job['status'] == 'running')
+    queued = sum(1 for job in jobs.values() if job['status'] == 'queued')
+    return 200, {
+        'status': 'ok',
+        'telethon': 'stub' if STUB_MODE else ('connected' if is_connected else 'disconnected'),
+        'running': running,
+        'queued': queued,
+        'max_concurrent': MAX_CONCURRENT_CREATIONS
+    }
+
+async def submit(data):
+    """Submit a group creation; answers at once with the job to poll"""
+    error = validate(data)
+    if error:
+        return 400, {'success': False, 'error': error}
+    job = submit_job(data)
+    return 202, {'success': True, **job_view(job), 'status_url': f"/jobs/{job['job_id']}"}
+
+async def job_status(data, job_id):
+    """Status of a submitted job"""
+    job = jobs.get(job_id)
+    if not job:
+        return 404, {'success': False, 'error': 'Unknown job'}
+    return 200, {'success': True, **job_view(job)}
+
+async def create_group(data):
+    """Create a Telegram group and wait for it (older clients; new ones submit and poll /jobs)"""
+    error = validate(data)
+    if error:
+        return 400, {'success': False, 'error': error}
+    job = submit_job(data)
     try:
-        is_connected = client is not None and client.is_connected()
-        return jsonify({
-            'status': 'ok',
-            'telethon': 'connected' if is_connected else 'disconnected'
-        }), 200
+        await asyncio.wait_for(asyncio.shield(job_events[job['job_id']].wait()), CREATE_WAIT_SECONDS)
+    except asyncio.TimeoutError:
+        return 202, {'success': False, 'error': 'Still creating - poll the job', **job_view(job)}
+    if job['status'] == 'failed':
+        return 500, {'success': False, 'error': job['error'], 'job_id': job['job_id']}
+    return 200, {'success': True, **job['result']}
+
+ROUTES = {
+    ('GET', '/health'): health,
+    ('POST', '/jobs'): submit,
+    ('POST', '/create-group'): create_group,
+}
+
+REASONS = {200: 'OK', 202: 'Accepted', 400: 'Bad Request', 404: 'Not Found', 413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+async def dispatch(method, path, body):
+    path = path.split('?')[0]
+    data = json.loads(body) if body else None
+    if method == 'GET' and path.startswith('/jobs/'):
+        return await job_status(data, path[len('/jobs/'):])
+    handler = ROUTES.get((method, path))
+    if not handler:
+        return 404, {'success': False, 'error': 'Not found'}
+    return await handler(data)
+
+async def handle_connection(reader, writer):
+    """Minimal HTTP/1.1: one JSON request and response per connection"""
+    try:
+        head = (await reader.readuntil(b"\r\n\r\n")).decode('latin-1').split("\r\n")
+        method, path = head[0].split(' ')[:2]
+        headers = {}
+        for line in head[1:]:
+            if ':' in line:
+                key, value = line.split(':', 1)
+                headers[key.strip().lower()] = value.strip()
+        try:
+            length = int(headers.get('content-length', 0))
+        except ValueError:
+            length = -1
+        if length < 0:
+            status, payload = 400, {'success': False, 'error': 'Invalid Content-Length'}
+        elif length > MAX_BODY_BYTES:
+            # The port is public - never buffer more than a job payload needs
+            status, payload = 413, {'success': False, 'error': 'Request body too large'}
+        else:
+            body = await reader.readexactly(length) if length else b''
+            try:
+                status, payload = await dispatch(method, path, body)
+            except json.JSONDecodeError:
+                status, payload = 400, {'success': False, 'error': 'Invalid JSON'}
     except Exception as e:
-        return jsonify({
-            'status': 'error',
-            'message': str(e)
-        }), 500
-
-@app.route('/create-group', methods=['POST'])
-def create_group():
-    """Create a Telegram group with anonymous creator and bot as admin"""
+        logger.error(f"Error handling request: {e}")
+        status, payload = 500, {'success': False, 'error': str(e)}
+
+    response = json.dumps(payload).encode()
     try:
-        data = request.get_json()
-        if not data:
-            return jsonify({'success': False, 'error': 'No data provided'}), 400
-        
-        # Validate request
-        required_fields = ['buyer_id', 'seller_id', 'bot_username', 'deal_id']
-        for field in required_fields:
-            if field not in data:
-                return jsonify({
-                    'success': False,
-                    'error': f'Missing required field: {field}'
-                }), 400
-        
-        buyer_id = data['buyer_id']
-        seller_id = data['seller_id']
-        bot_username = data['bot_username']
-        deal_id = data['deal_id']
-        
-        # Create group using background event loop
-        group_id, invite_link = run_coroutine_threadsafe(
-            create_telegram_group_async(buyer_id, seller_id, bot_username, deal_id)
+        writer.write(
+            f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(response)}\r\n"
+            f"Connection: close\r\n\r\n".encode() + response
         )
-        
-        return jsonify({
-            'success': True,
-            'group_id': group_id,
-            'invite_link': invite_link,
-            'deal_id': deal_id
-        }), 200
-        
-    except Exception as e:
-        import traceback
-        error_traceback = traceback.format_exc()
-        logger.error(f"Error in create_group endpoint:\n{error_traceback}")
-        return jsonify({
-            'success': False,
-            'error': f"{str(e)}\n\nTraceback:\n{error_traceback}"
-        }), 500
+        await writer.drain()
+    except Exception:
+        pass
+    finally:
+        writer.close()
+
+async def main():
+    # Initialize client
+    if STUB_MODE:
+        logger.info("🧪 Stub mode - groups are simulated, no Telegram account used")
+    else:
+        try:
+            await init_client()
+            logger.info("✅ Telethon client pre-initialized successfully")
+        except Exception as e:
+            logger.error(f"❌ Failed to initialize client: {e}")
+
+    server = await asyncio.start_server(handle_connection, '0.0.0.0', PORT)
+    async with server:
+        await server.serve_forever()
 
 if __name__ == '__main__':
     print("=" * 60)
     print("🚀 Telethon Microservice Starting...")
-    print("📍 URL: http://localhost:5001")
-    print("🔐 Using session: user_session.session")
+    print(f"📍 URL: http://localhost:{PORT}")
+    print("🔐 Using session: user_session.session" if not STUB_MODE else "🧪 Stub mode")
+    print(f"⚙️ Up to {MAX_CONCURRENT_CREATIONS} concurrent creations")
     print("=" * 60)
     
-    # Start event loop in background thread
-    loop = asyncio.new_event_loop()
-    loop_thread = threading.Thread(target=run_async_loop, args=(loop,), daemon=True)
-    loop_thread.start()
-    logger.info("✅ Background event loop started")
-    
-    # Initialize client
-    try:
-        run_coroutine_threadsafe(init_client())
-        logger.info("✅ Telethon client pre-initialized successfully")
-    except Exception as e:
-        logger.error(f"❌ Failed to initialize client: {e}")
-    
-    # Run Flask app
-    app.run(host='0.0.0.0', port=5001, debug=False)
+    asyncio.run(main())